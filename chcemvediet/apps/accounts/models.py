@@ -10,7 +10,7 @@ from jsonfield import JSONField
 from poleno.mail.models import Message
 from poleno.utils.models import QuerySet, OriginalValuesMixin
 from poleno.utils.misc import FormatMixin, squeeze
-from chcemvediet.apps.anonymization.models import AttachmentAnonymization, AttachmentFinalization
+from chcemvediet.apps.anonymization.anonymization import invalidate_anonymizations
 from chcemvediet.apps.inforequests.models import InforequestEmail
 from chcemvediet.apps.inforequests.constants import DEFAULT_DAYS_TO_PUBLISH_INFOREQUEST
 
@@ -112,9 +112,18 @@ class Profile(FormatMixin, OriginalValuesMixin, models.Model):
         super(Profile, self).save(*args, **kwargs)
 
     def _delete_outdated_attachments(self):
-        if self._custom_anonymized_strings_changed():
-            AttachmentFinalization.objects.owned_by(self.user).delete()
-            AttachmentAnonymization.objects.owned_by(self.user).delete()
+        if not self._custom_anonymized_strings_changed():
+            return
+        old_custom_anonymized_strings = self.get_original_value(u'custom_anonymized_strings')
+        new_custom_anonymized_strings = self.custom_anonymized_strings
+        if old_custom_anonymized_strings is None or new_custom_anonymized_strings is None:
+            # Switching between default and custom anonymization may affect any attachment.
+            invalidate_anonymizations(self.user)
+        else:
+            # Only attachments containing added or removed strings are affected.
+            changed_strings = (set(old_custom_anonymized_strings) ^
+                               set(new_custom_anonymized_strings))
+            invalidate_anonymizations(self.user, changed_strings)
 
     def _custom_anonymized_strings_changed(self):
         old_custom_anonymized_strings = self.get_original_value(u'custom_anonymized_strings')
@@ -0,0 +1,4 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+
+default_app_config = 'chcemvediet.apps.anonymization.apps.AnonymizationConfig'
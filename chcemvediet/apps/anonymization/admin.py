@@ -1,13 +1,19 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import datetime
+
+from django.views.decorators.http import require_http_methods
+from django.shortcuts import render
 from django.contrib import admin
 
 from poleno.attachments.admin import DownloadAdminMixin
+from poleno.utils.date import utc_now
 from poleno.utils.misc import decorate, filesize
 from poleno.utils.admin import admin_obj_format
 
 from .models import (AttachmentNormalization, AttachmentRecognition, AttachmentAnonymization,
-                     AttachmentFinalization)
+                     AttachmentFinalization, PipelineState)
+from .metrics import stage_metrics
 
 
 @admin.register(AttachmentNormalization, site=admin.site)
@@ -209,3 +215,54 @@ class AttachmentFinalizationAdmin(DownloadAdminMixin, admin.ModelAdmin):
             ]
     inlines = [
             ]
+
+@admin.register(PipelineState, site=admin.site)
+class PipelineStateAdmin(admin.ModelAdmin):
+    date_hierarchy = None
+    list_display = [
+            u'id',
+            decorate(
+                lambda o: admin_obj_format(o.attachment, u'{obj}'),
+                short_description=u'Attachment',
+                admin_order_field=u'attachment',
+            ),
+            u'stage',
+            u'status',
+            u'claimed_at',
+            u'worker',
+            ]
+    list_filter = [
+            u'stage',
+            u'status',
+            ]
+    search_fields = [
+            u'=id',
+            u'=attachment__id',
+            u'worker',
+            ]
+    ordering = [
+            u'-id',
+            ]
+    exclude = [
+            ]
+    readonly_fields = [
+            ]
+    raw_id_fields = [
+            u'attachment',
+            ]
+    inlines = [
+            ]
+
+@admin.site.register_view(u'anonymization/metrics/', name=u'Anonymization pipeline',
+        urlname=u'anonymization_metrics', visible=False)
+@require_http_methods([u'HEAD', u'GET'])
+def metrics(request):
+    periods = [
+            (u'Last day', utc_now() - datetime.timedelta(days=1)),
+            (u'Last week', utc_now() - datetime.timedelta(days=7)),
+            (u'All time', None),
+            ]
+    return render(request, u'anonymization/admin/metrics.html', {
+            u'periods': [(label, stage_metrics(since)) for label, since in periods],
+            u'title': u'Anonymization pipeline',
+            })
@@ -1,22 +1,35 @@
 # -*- coding: utf-8 -*-
+import os
 import re
+import time
+import shutil
 import zipfile
-import StringIO
 import traceback
-from contextlib import closing
+from xml import sax
+from xml.sax import saxutils
 
-import magic
 from lxml import etree
-from django.core.files.base import ContentFile
+from django.core.files import File
 
 from poleno.cron import cron_logger
+from poleno.utils.misc import lru_cache
 
-from .models import AttachmentRecognition, AttachmentAnonymization
+from .models import (AttachmentRecognition, AttachmentAnonymization, AttachmentFinalization,
+        PipelineState)
+from .matcher import Matcher
+from .utils import temporary_directory
 from . import content_types
 
 
 ANONYMIZATION_STRING = u'xxxxx'
 WORD_SIZE_MIN = 3
+PATTERN_CACHE_SIZE = 256
+
+ODT_SPAN = (u'urn:oasis:names:tc:opendocument:xmlns:text:1.0', u'span')
+ODT_MANIFEST = u'META-INF/manifest.xml'
+ODT_MANIFEST_ENTRY = u'{urn:oasis:names:tc:opendocument:xmlns:manifest:1.0}file-entry'
+ODT_MANIFEST_MEDIA_TYPE = u'{urn:oasis:names:tc:opendocument:xmlns:manifest:1.0}media-type'
+ODT_MANIFEST_FULL_PATH = u'{urn:oasis:names:tc:opendocument:xmlns:manifest:1.0}full-path'
 
 TRANSLATE_TABLE = {
     u'a': u'(?:a|á|ä)',
@@ -52,6 +65,15 @@ TRANSLATE_TABLE = {
     u'ž': u'(?:z|ž)',
 }
 
+# Maps every accented character to the first character of its ``TRANSLATE_TABLE`` group.
+FOLD_TABLE = {ord(c): g[3:-1].split(u'|')[0] for c, g in TRANSLATE_TABLE.items()}
+
+def fold(text):
+    u"""
+    Folds ``text`` to slovak accent insensitive lowercase text of the same length.
+    """
+    return text.lower().translate(FOLD_TABLE)
+
 def generate_word_pattern(words, match_subwords):
     u"""
     Generates list of patterns, that matches slovak accent insensitive lowercase word. Each word is
@@ -89,6 +111,25 @@ def generate_numeric_pattern(numbers, match_subwords):
         patterns.append(template.format(p))
     return patterns
 
+def generate_word_keys(words):
+    u"""
+    Generates list of folded matcher keys for words. Optional separators of subwords are handled
+    by the matcher.
+    """
+    return [fold(word) for word in words if len(word) >= WORD_SIZE_MIN]
+
+def generate_numeric_keys(numbers):
+    u"""
+    Generates list of folded matcher keys for numbers. Separators are handled by the matcher.
+    """
+    keys = []
+    for number in numbers:
+        number = re.sub(u'[ -]', u'', number)
+        if len(number) < WORD_SIZE_MIN:
+            continue
+        keys.append(fold(number))
+    return keys
+
 def get_default_anonymized_strings_for_user(user, inforequest=None):
     u"""
     Return `user` default anonymized strings in two lists. First list for words, second for numbers.
@@ -104,36 +145,58 @@ def get_default_anonymized_strings_for_user(user, inforequest=None):
         numbers.append(inforequest.applicant_zip)
     return words, numbers
 
-def get_custom_anonymized_strings_for_user(user):
+def split_anonymized_strings(lines):
+    u"""
+    Splits anonymized strings in two lists. First list for words, second for numbers.
+    """
     words = []
     numbers = []
-    for line in user.profile.custom_anonymized_strings:
+    for line in lines:
         if re.sub(u'[ -]', u'', line).isdigit():
             numbers.append(line)
         else:
             words.append(line)
     return words, numbers
 
+def get_custom_anonymized_strings_for_user(user):
+    return split_anonymized_strings(user.profile.custom_anonymized_strings)
+
 def get_anonymized_strings_for_user(inforequest):
     if inforequest.applicant.profile.custom_anonymized_strings is None:
         return get_default_anonymized_strings_for_user(inforequest.applicant, inforequest)
     else:
         return get_custom_anonymized_strings_for_user(inforequest.applicant)
 
-def generate_user_pattern(inforequest, match_subwords=False):
+def compile_user_regex(words, numbers, match_subwords):
     u"""
-    Generates pattern object, that matches user anonymization strings. If ``match_subwords`` is
-    True, pattern will also match subwords.
+    Compiles user anonymization strings to a single regex. It is no longer used for anonymization
+    as backtracking over the large alternation gets slow with many strings and long texts, but it
+    is kept as the reference implementation for ``anonymization_benchmark`` command.
     """
-    words, numbers = get_anonymized_strings_for_user(inforequest)
     patterns = (
-            generate_word_pattern(set(words), match_subwords) +
-            generate_numeric_pattern(set(numbers), match_subwords)
+            generate_word_pattern(words, match_subwords) +
+            generate_numeric_pattern(numbers, match_subwords)
     )
     return re.compile(u'|'.join(patterns), re.IGNORECASE | re.UNICODE)
 
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def compile_user_pattern(words, numbers, match_subwords):
+    return Matcher(generate_word_keys(words), generate_numeric_keys(numbers),
+                   match_subwords, fold)
+
+def generate_user_pattern(inforequest, match_subwords=False):
+    u"""
+    Generates matcher object, that matches user anonymization strings. If ``match_subwords`` is
+    True, matcher will also match subwords.
+
+    Compiled patterns are cached by the anonymization strings themselves, so changing the
+    applicant profile or the inforequest never returns a stale pattern.
+    """
+    words, numbers = get_anonymized_strings_for_user(inforequest)
+    return compile_user_pattern(frozenset(words), frozenset(numbers), match_subwords)
+
 def anonymize_string(prog, content):
-    if not prog.pattern:
+    if not prog:
         return content
     return prog.sub(ANONYMIZATION_STRING, content)
 
@@ -141,7 +204,7 @@ def anonymize_markup(prog, content, parser, xpath=u'.//', namespace=None):
     u"""
     Anonymize user in each xpath of markup (xml or html) content, using defined namespace.
     """
-    if not prog.pattern:
+    if not prog:
         return content
     root = etree.fromstring(content, parser)
     for t in root.findall(xpath, namespace):
@@ -154,31 +217,120 @@ def anonymize_markup(prog, content, parser, xpath=u'.//', namespace=None):
         t.text = prog.sub(ANONYMIZATION_STRING, t.text)
     return etree.tostring(root)
 
+class SpanAnonymizer(saxutils.XMLGenerator):
+    u"""
+    SAX handler writing the parsed XML document back to ``out`` with character data directly
+    inside ``text:span`` elements anonymized. Character data is buffered only until the next
+    element boundary, so the document is never held in memory as a whole. If ``texts`` list is
+    given, the original anonymized character data are appended to it.
+    """
+
+    def __init__(self, prog, out, texts=None):
+        saxutils.XMLGenerator.__init__(self, out, u'utf-8')
+        self.prog = prog
+        self.texts = texts
+        self.stack = []
+        self.buffer = []
+
+    def flush(self):
+        if not self.buffer:
+            return
+        content = u''.join(self.buffer)
+        self.buffer = []
+        if self.stack and self.stack[-1] == ODT_SPAN:
+            if self.texts is not None and content.strip():
+                self.texts.append(content)
+            content = anonymize_string(self.prog, content)
+        saxutils.XMLGenerator.characters(self, content)
+
+    def startElementNS(self, name, qname, attrs):
+        self.flush()
+        self.stack.append(name)
+        saxutils.XMLGenerator.startElementNS(self, name, qname, attrs)
+
+    def endElementNS(self, name, qname):
+        self.flush()
+        self.stack.pop()
+        saxutils.XMLGenerator.endElementNS(self, name, qname)
+
+    def characters(self, content):
+        self.buffer.append(content)
+
+    def processingInstruction(self, target, data):
+        self.flush()
+        saxutils.XMLGenerator.processingInstruction(self, target, data)
+
+    def endDocument(self):
+        self.flush()
+        saxutils.XMLGenerator.endDocument(self)
+
+def anonymize_xml_stream(prog, stream_in, stream_out, texts=None):
+    parser = sax.make_parser()
+    parser.setFeature(sax.handler.feature_namespaces, True)
+    parser.setFeature(sax.handler.feature_external_ges, False)
+    parser.setContentHandler(SpanAnonymizer(prog, stream_out, texts))
+    parser.parse(stream_in)
+
+def get_odt_xml_members(zipfile_in):
+    u"""
+    Returns the set of XML member names of the ODT archive. XML members are recognized by their
+    media type in the ODF manifest or by their name.
+    """
+    members = set(i.filename for i in zipfile_in.infolist() if i.filename.endswith(u'.xml'))
+    if ODT_MANIFEST in members:
+        with zipfile_in.open(ODT_MANIFEST) as manifest:
+            for _, entry in etree.iterparse(manifest, tag=ODT_MANIFEST_ENTRY):
+                if entry.get(ODT_MANIFEST_MEDIA_TYPE) in content_types.XML_CONTENT_TYPES:
+                    members.add(entry.get(ODT_MANIFEST_FULL_PATH))
+                entry.clear()
+    return members
+
 def anonymize_odt(attachment_recognition):
     try:
         inforequest = attachment_recognition.attachment.generic_object.branch.inforequest
-        parser = etree.XMLParser()
         pattern = generate_user_pattern(inforequest)
-        namespace = {u'text': u'urn:oasis:names:tc:opendocument:xmlns:text:1.0'}
-        with closing(StringIO.StringIO(attachment_recognition.content)) as buffer_in:
-            with closing(StringIO.StringIO()) as buffer_out:
-                with zipfile.ZipFile(buffer_in) as zipfile_in:
-                    with zipfile.ZipFile(buffer_out, u'w') as zipfile_out:
-                        for f in zipfile_in.filelist:
-                            content = zipfile_in.read(f)
-                            if magic.from_buffer(content, mime=True) in content_types.XML_CONTENT_TYPES:
-                                zipfile_out.writestr(f, anonymize_markup(
-                                        pattern, content, parser, u'.//text:span', namespace))
-                            else:
-                                zipfile_out.writestr(f, content)
+        # Text is extracted only once, even if the user has nothing to anonymize.
+        texts = [] if attachment_recognition.text is None else None
+        with temporary_directory() as directory:
+            output = os.path.join(directory, u'anonymized.odt')
+            member = os.path.join(directory, u'member')
+            attachment_recognition.file.open(u'rb')
+            try:
+                with zipfile.ZipFile(attachment_recognition.file) as zipfile_in:
+                    with zipfile.ZipFile(output, u'w') as zipfile_out:
+                        if pattern or texts is not None:
+                            xml_members = get_odt_xml_members(zipfile_in)
+                        else:
+                            xml_members = set()
+                        for info in zipfile_in.infolist():
+                            if info.filename.endswith(u'/'):
+                                zipfile_out.writestr(info, b'')
+                                continue
+                            # Members are piped through a temporary file, as ZipFile can't write
+                            # a member from a stream.
+                            with zipfile_in.open(info) as stream_in:
+                                with open(member, u'wb') as stream_out:
+                                    if info.filename in xml_members:
+                                        anonymize_xml_stream(pattern, stream_in, stream_out, texts)
+                                    else:
+                                        shutil.copyfileobj(stream_in, stream_out)
+                            mtime = time.mktime(info.date_time + (0, 0, -1))
+                            os.utime(member, (mtime, mtime))
+                            zipfile_out.write(member, info.filename, info.compress_type)
+            finally:
+                attachment_recognition.file.close()
+            if texts is not None:
+                attachment_recognition.text = u'\n'.join(texts)
+                attachment_recognition.save(update_fields=[u'text'])
+            with open(output, u'rb') as file_odt:
                 AttachmentAnonymization.objects.create(
                     attachment=attachment_recognition.attachment,
                     successful=True,
-                    file=ContentFile(buffer_out.getvalue()),
+                    file=File(file_odt),
                     content_type=content_types.ODT_CONTENT_TYPE,
                 )
-                cron_logger.info(u'Anonymized attachment_recognition: {}'.format(
-                        attachment_recognition))
+            cron_logger.info(u'Anonymized attachment_recognition: {}'.format(
+                    attachment_recognition))
     except Exception as e:
         trace = unicode(traceback.format_exc(), u'utf-8')
         AttachmentAnonymization.objects.create(
@@ -191,13 +343,57 @@ def anonymize_odt(attachment_recognition):
                           u'unexpected error occured: {}\n{}'.format(
                                   attachment_recognition, e.__class__.__name__, trace))
 
-def anonymize_attachment():
-    attachment_recognition = (AttachmentRecognition.objects
+def attachments_affected_by(user, changed_strings):
+    u"""
+    Returns the set of pks of anonymized attachments owned by ``user``, which recognized text
+    contains any of ``changed_strings``. Attachments with no extracted text are always affected.
+    """
+    words, numbers = split_anonymized_strings(changed_strings)
+    prog = compile_user_pattern(frozenset(words), frozenset(numbers), False)
+    recognitions = (AttachmentRecognition.objects
+            .owned_by(user)
+            .successful()
+            .recognized_to_odt()
+            .filter(attachment__attachmentanonymization__isnull=False)
+            .distinct()
+            .values_list(u'attachment', u'text'))
+    affected = set()
+    for attachment_pk, text in recognitions.iterator():
+        if text is None or (prog and prog.spans(text)):
+            affected.add(attachment_pk)
+    return affected
+
+def invalidate_anonymizations(user, changed_strings=None):
+    u"""
+    Deletes anonymizations and finalizations of attachments owned by ``user`` and returns them
+    back to the anonymization pipeline stage. If ``changed_strings`` is given, only attachments
+    which recognized text contains any of the strings are invalidated. Otherwise all user
+    attachments are invalidated.
+    """
+    anonymizations = AttachmentAnonymization.objects.owned_by(user)
+    finalizations = AttachmentFinalization.objects.owned_by(user)
+    states = PipelineState.objects.filter(attachment__action__branch__inforequest__applicant=user)
+    if changed_strings is not None:
+        affected = attachments_affected_by(user, changed_strings)
+        anonymizations = anonymizations.filter(attachment__in=affected)
+        finalizations = finalizations.filter(attachment__in=affected)
+        states = states.filter(attachment__in=affected)
+    else:
+        states = states.filter(attachment__attachmentanonymization__isnull=False)
+    states = list(states.values_list(u'pk', flat=True))
+    finalizations.delete()
+    anonymizations.delete()
+    PipelineState.objects.filter(pk__in=states).update(stage=PipelineState.STAGES.ANONYMIZATION,
+            status=PipelineState.STATUSES.WAITING, claimed_at=None, worker=u'')
+
+def recognition_to_anonymize(attachment):
+    return (AttachmentRecognition.objects
             .successful()
             .recognized_to_odt()
             .not_anonymized()
+            .filter(attachment=attachment)
+            .order_by_pk()
             .first())
-    if attachment_recognition is None:
-        return
-    else:
-        anonymize_odt(attachment_recognition)
+
+def anonymize_attachment(attachment_recognition):
+    anonymize_odt(attachment_recognition)
@@ -0,0 +1,10 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+from django.apps import AppConfig
+
+
+class AnonymizationConfig(AppConfig):
+    name = u'chcemvediet.apps.anonymization'
+
+    def ready(self):
+        from . import signals
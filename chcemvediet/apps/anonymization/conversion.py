@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import fcntl
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import subprocess32
+from django.conf import settings
+
+from .utils import (temporary_directory, run_converter, add_converters_cpu_time,
+        process_tree_cpu_time)
+
+
+LIBREOFFICE_TIMEOUT = 300
+LIBREOFFICE_ACQUIRE_TIMEOUT = 300
+LIBREOFFICE_PROBE_TIMEOUT = 60
+
+class ConversionError(Exception):
+    pass
+
+class MockConverter(object):
+    u"""
+    Fake converter used if ``MOCK_LIBREOFFICE`` is set. Instead of converting the file, it copies
+    the mock for the requested output format.
+    """
+    name = u'mocked libreoffice'
+
+    def convert(self, filename, output, format=u'pdf'):
+        mock = os.path.join(settings.PROJECT_PATH, u'chcemvediet/apps/anonymization/mocks',
+                            u'converted.{}'.format(format))
+        shutil.copy2(mock, output)
+        return u'Created using mocked libreoffice.'
+
+class LibreOfficeConverter(object):
+    u"""
+    Converts files using a pool of warm headless LibreOffice instances kept running by
+    ``libreoffice_service`` management command. Every instance has its own user profile. A
+    conversion is submitted by running ``libreoffice --convert-to`` with the profile of an idle
+    instance. LibreOffice hands the request over to the instance running with the profile, so we
+    don't pay for its cold start. If the instance is not running, the request starts LibreOffice
+    with the profile by itself, so the conversion works even without the service, only slower.
+
+    Instances are used by one conversion at a time. Idle instances are claimed using file locks,
+    so the pool is shared by all processes and threads. If a conversion times out, the instance is
+    marked for restart by the service. CPU time of the conversion is recorded for the calling
+    thread, see ``utils.converters_cpu_time()``. It includes the CPU time the instance spent
+    meanwhile, found by the pid the service writes for the instance.
+
+    Settings:
+     -- LIBREOFFICE_INSTANCES: Number of instances in the pool. Defaults to 2.
+     -- LIBREOFFICE_PROFILES_PATH: Directory with instance profiles and locks. Defaults to
+        ``chcemvediet-libreoffice`` directory in the system temporary directory.
+    """
+    name = u'libreoffice'
+
+    def __init__(self, instances=None, path=None):
+        self.instances = instances if instances is not None else (
+                getattr(settings, u'LIBREOFFICE_INSTANCES', 2))
+        self.path = path if path is not None else (
+                getattr(settings, u'LIBREOFFICE_PROFILES_PATH',
+                    os.path.join(tempfile.gettempdir(), u'chcemvediet-libreoffice')))
+
+    def profile_path(self, index):
+        return os.path.join(self.path, u'instance{}'.format(index))
+
+    def restart_marker_path(self, index):
+        return os.path.join(self.path, u'instance{}.restart'.format(index))
+
+    def pid_path(self, index):
+        return os.path.join(self.path, u'instance{}.pid'.format(index))
+
+    def instance_cpu_time(self, index):
+        u"""
+        Returns CPU time consumed so far by the instance started by the service, or None if the
+        service is not running it.
+        """
+        try:
+            with open(self.pid_path(index)) as f:
+                pid = int(f.read())
+        except (IOError, ValueError):
+            return None
+        return process_tree_cpu_time(pid)
+
+    def args(self, index):
+        return [u'libreoffice', u'-env:UserInstallation=file://{}'.format(self.profile_path(index)),
+                u'--headless', u'--invisible', u'--nologo', u'--norestore', u'--nodefault',
+                u'--nolockcheck']
+
+    @contextmanager
+    def acquire(self, timeout=LIBREOFFICE_ACQUIRE_TIMEOUT, index=None):
+        u"""
+        Waits for an idle instance and yields its index. If ``index`` is given, waits for that
+        instance only. The instance is locked until the context is left.
+        """
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        indexes = range(self.instances) if index is None else [index]
+        deadline = time.time() + timeout
+        while True:
+            for index in indexes:
+                lock = open(os.path.join(self.path, u'instance{}.lock'.format(index)), u'a')
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    lock.close()
+                    continue
+                try:
+                    yield index
+                    return
+                finally:
+                    lock.close()
+            if time.time() >= deadline:
+                raise ConversionError(u'No idle LibreOffice instance available.')
+            time.sleep(0.1)
+
+    def _run(self, index, filename, directory, format, timeout):
+        return run_converter(
+            self.args(index) + [u'--convert-to', format, u'--outdir', directory, filename],
+            timeout=timeout,
+        )
+
+    def convert(self, filename, output, format=u'pdf'):
+        with self.acquire() as index:
+            with temporary_directory() as directory:
+                started = self.instance_cpu_time(index)
+                try:
+                    p = self._run(index, filename, directory, format, LIBREOFFICE_TIMEOUT)
+                except subprocess32.TimeoutExpired:
+                    # The instance is probably stuck, let the service restart it.
+                    open(self.restart_marker_path(index), u'a').close()
+                    raise
+                # The instance is locked, so all its CPU time meanwhile was spent on our file.
+                finished = self.instance_cpu_time(index)
+                if started is not None and finished is not None and finished >= started:
+                    add_converters_cpu_time(finished - started)
+                name = os.path.splitext(os.path.basename(filename))[0]
+                shutil.move(os.path.join(directory, u'{}.{}'.format(name, format)), output)
+        return u'STDOUT:\n{}\nSTDERR:\n{}'.format(unicode(p.stdout, u'utf-8'),
+                                                  unicode(p.stderr, u'utf-8'))
+
+    def probe(self, index, timeout=LIBREOFFICE_PROBE_TIMEOUT):
+        u"""
+        Checks that the instance is alive by converting a tiny text document with it. Returns
+        ``True`` if the conversion succeeded within ``timeout`` seconds, ``False`` if it failed or
+        timed out, and ``None`` if the instance is busy converting something else.
+        """
+        try:
+            with self.acquire(timeout=0, index=index):
+                with temporary_directory() as directory:
+                    filename = os.path.join(directory, u'probe.txt')
+                    with open(filename, u'wb') as f:
+                        f.write(b'probe')
+                    try:
+                        self._run(index, filename, directory, u'pdf', timeout)
+                    except (subprocess32.SubprocessError, OSError):
+                        return False
+                    return os.path.exists(os.path.join(directory, u'probe.pdf'))
+        except ConversionError:
+            return None
+
+def get_converter():
+    if settings.MOCK_LIBREOFFICE:
+        return MockConverter()
+    return LibreOfficeConverter()
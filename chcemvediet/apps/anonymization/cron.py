@@ -1,14 +1,17 @@
-from poleno.cron import cron_job
+from django.conf import settings
 
-from .normalization import normalize_attachment
-from .recognition import recognize_attachment
-from .anonymization import anonymize_attachment
-from .finalization import finalize_attachment
+from poleno.cron import cron_job, cron_logger
+
+from .pipeline import PipelineRunner
+from .scheduler import schedule_attachments
 
 
 @cron_job(run_every_mins=1)
 def anonymization():
-    normalize_attachment()
-    recognize_attachment()
-    anonymize_attachment()
-    finalize_attachment()
+    PipelineRunner().run()
+
+@cron_job(run_at_times=settings.CRON_IMPORTANT_MAINTENANCE_TIMES)
+def anonymization_schedule():
+    # Expected publication dates change as new actions are added and inforequests are published.
+    count = schedule_attachments()
+    cron_logger.info(u'Scheduled anonymization of attachments of {} inforequests.'.format(count))
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import time
+import random
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from poleno.utils.misc import squeeze, random_readable_string
+from chcemvediet.apps.anonymization.anonymization import (ANONYMIZATION_STRING, compile_user_regex,
+        compile_user_pattern)
+
+
+class Command(NoArgsCommand):
+    default_size = 256
+    default_strings = 40
+    default_repeat = 3
+
+    help = squeeze(u"""
+            Compares the speed of the anonymization matcher with the reference regex implementation
+            on a generated text containing generated anonymized strings. Where a string is a prefix
+            of another one, the regex uses whichever alternative comes first, while the matcher
+            prefers the longest match, so the number of matches may differ.
+            """)
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(u'--size', action=u'store', type=u'int', dest=u'size',
+            default=default_size, help=squeeze(u"""
+                Size of the generated text in kilobytes. Defaults to {}.
+                """).format(default_size)),
+        make_option(u'--strings', action=u'store', type=u'int', dest=u'strings',
+            default=default_strings, help=squeeze(u"""
+                Number of anonymized strings. Defaults to {}.
+                """).format(default_strings)),
+        make_option(u'--repeat', action=u'store', type=u'int', dest=u'repeat',
+            default=default_repeat, help=squeeze(u"""
+                Number of measured runs, the best one is reported. Defaults to {}.
+                """).format(default_repeat)),
+        )
+
+    def _generate(self, size, strings):
+        random.seed(0)
+        words = [random_readable_string(random.randint(4, 10)).capitalize() for i in range(strings)]
+        words += [u'{} {}'.format(w, random_readable_string(6)) for w in words[:strings//4]]
+        numbers = [u'{:03d} {:02d}'.format(random.randint(0, 999), random.randint(0, 99))
+                   for i in range(max(1, strings//8))]
+        chunks = []
+        length = 0
+        while length < size * 1024:
+            if random.random() < 0.02:
+                chunk = random.choice(words + numbers)
+            else:
+                chunk = random_readable_string(random.randint(2, 9), vowels=u'aáeéiíoóuúyý')
+            chunks.append(chunk)
+            length += len(chunk) + 1
+        return frozenset(words), frozenset(numbers), u' '.join(chunks)
+
+    def _measure(self, compile, args, text, repeat):
+        best_compile = best_sub = None
+        for i in range(repeat):
+            start = time.time()
+            prog = compile(*args)
+            compiled = time.time()
+            result = prog.sub(ANONYMIZATION_STRING, text)
+            done = time.time()
+            best_compile = min(best_compile or compiled - start, compiled - start)
+            best_sub = min(best_sub or done - compiled, done - compiled)
+        return best_compile, best_sub, result.count(ANONYMIZATION_STRING)
+
+    def handle_noargs(self, **options):
+        words, numbers, text = self._generate(options[u'size'], options[u'strings'])
+        self.stdout.write(u'Text: {} characters, strings: {} words and {} numbers'.format(
+                len(text), len(words), len(numbers)))
+        self.stdout.write(u'{:<10}{:<16}{:>12}{:>12}{:>10}'.format(
+                u'engine', u'match_subwords', u'compile [s]', u'sub [s]', u'matches'))
+        for match_subwords in [False, True]:
+            args = (words, numbers, match_subwords)
+            for name, compile in [(u'regex', compile_user_regex),
+                                  (u'matcher', compile_user_pattern.__wrapped__)]:
+                try:
+                    compile_time, sub_time, matches = self._measure(
+                            compile, args, text, options[u'repeat'])
+                except Exception as e:
+                    self.stdout.write(u'{:<10}{:<16}failed: {}'.format(
+                            name, unicode(match_subwords), e.__class__.__name__))
+                    continue
+                self.stdout.write(u'{:<10}{:<16}{:>12.4f}{:>12.4f}{:>10}'.format(
+                        name, unicode(match_subwords), compile_time, sub_time, matches))
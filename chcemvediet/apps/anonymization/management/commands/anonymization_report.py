@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import datetime
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from poleno.utils.date import utc_now
+from poleno.utils.misc import squeeze, filesize
+from chcemvediet.apps.anonymization.metrics import stage_metrics
+
+
+class Command(NoArgsCommand):
+    default_days = 7
+
+    help = squeeze(u"""
+            Reports metrics of anonymization pipeline stages: number of results, success rate, wall
+            time, CPU time, input and output sizes and the number of waiting and claimed
+            attachments.
+            """)
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(u'--days', action=u'store', type=u'int', dest=u'days',
+            default=default_days, help=squeeze(u"""
+                Aggregate results created in the last given number of days. Zero for all results.
+                Defaults to {}.
+                """).format(default_days)),
+        )
+
+    def _format(self, value, template):
+        return template.format(value) if value is not None else u'-'
+
+    def handle_noargs(self, **options):
+        since = None
+        if options[u'days']:
+            since = utc_now() - datetime.timedelta(days=options[u'days'])
+        columns = u'{:<15}{:>8}{:>9}{:>10}{:>10}{:>10}{:>12}{:>12}{:>12}{:>9}{:>9}'
+        self.stdout.write(columns.format(u'stage', u'results', u'success', u'avg [s]',
+                u'max [s]', u'cpu [s]', u'cpu sum [s]', u'input', u'output', u'waiting',
+                u'claimed'))
+        for metrics in stage_metrics(since):
+            self.stdout.write(columns.format(
+                    metrics[u'name'],
+                    metrics[u'count'],
+                    self._format(metrics[u'success_rate'], u'{:.0%}'),
+                    self._format(metrics[u'duration_avg'], u'{:.2f}'),
+                    self._format(metrics[u'duration_max'], u'{:.2f}'),
+                    self._format(metrics[u'cpu_time_avg'], u'{:.2f}'),
+                    self._format(metrics[u'cpu_time_sum'], u'{:.1f}'),
+                    filesize(metrics[u'input_size_avg']) or u'-',
+                    filesize(metrics[u'output_size_avg']) or u'-',
+                    metrics[u'waiting'],
+                    metrics[u'claimed'],
+                    ))
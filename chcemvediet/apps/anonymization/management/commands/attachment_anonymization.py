@@ -8,7 +8,7 @@ from django.db import transaction
 
 from poleno.attachments.models import Attachment
 from poleno.utils.misc import squeeze
-from chcemvediet.apps.anonymization.models import AttachmentFinalization
+from chcemvediet.apps.anonymization.models import AttachmentFinalization, PipelineState
 from chcemvediet.apps.inforequests.models import Action
 
 
@@ -79,3 +79,11 @@ class Command(BaseCommand):
             content_type=options[u'content_type'] or magic.from_buffer(content, mime=True),
             debug=options[u'debug'],
         )
+
+        # The attachment is finalized manually, so the anonymization pipeline may skip it.
+        PipelineState.objects.update_or_create(attachment=attachment, defaults=dict(
+            stage=PipelineState.STAGES.FINALIZATION,
+            status=PipelineState.STATUSES.DONE,
+            claimed_at=None,
+            worker=u'',
+        ))
@@ -0,0 +1,107 @@
+import os
+import time
+from optparse import make_option
+
+import subprocess32
+from django.core.management.base import NoArgsCommand, CommandError
+from django.conf import settings
+
+from poleno.cron import cron_logger
+from poleno.utils.misc import squeeze
+from chcemvediet.apps.anonymization.conversion import LibreOfficeConverter
+
+
+class Command(NoArgsCommand):
+    default_check_interval = 5
+    default_probe_interval = 60
+    default_probe_timeout = 60
+
+    help = squeeze(u"""
+            Keeps a pool of warm headless LibreOffice instances running, so the anonymization
+            pipeline does not start a new LibreOffice for every converted attachment. Instances
+            are checked periodically and restarted if they exit, get stuck converting a document,
+            or fail to convert a test document. The number of
+            instances is set by LIBREOFFICE_INSTANCES setting.
+            """)
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(u'--check-interval', action=u'store', type=u'float', dest=u'check_interval',
+            default=default_check_interval, help=squeeze(u"""
+                Seconds between instance health checks. Defaults to {} seconds.
+                """).format(default_check_interval)),
+        make_option(u'--probe-interval', action=u'store', type=u'float', dest=u'probe_interval',
+            default=default_probe_interval, help=squeeze(u"""
+                Seconds between test conversions checking that idle instances respond. Defaults
+                to {} seconds.
+                """).format(default_probe_interval)),
+        make_option(u'--probe-timeout', action=u'store', type=u'float', dest=u'probe_timeout',
+            default=default_probe_timeout, help=squeeze(u"""
+                Seconds after which a test conversion is considered failed. Defaults to {}
+                seconds.
+                """).format(default_probe_timeout)),
+        )
+
+    def _start(self, converter, index):
+        marker = converter.restart_marker_path(index)
+        if os.path.exists(marker):
+            os.remove(marker)
+        cron_logger.info(u'Starting LibreOffice instance {}.'.format(index))
+        process = subprocess32.Popen(converter.args(index),
+                stdout=subprocess32.DEVNULL, stderr=subprocess32.DEVNULL)
+        # Converters look the instance up by its pid to measure CPU time of their conversions.
+        with open(converter.pid_path(index), u'w') as f:
+            f.write(str(process.pid))
+        return process
+
+    def _stop(self, process):
+        if process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess32.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    def _check(self, converter, processes, probe_timeout=None):
+        u"""
+        Restarts instances which exited or were marked as stuck. If ``probe_timeout`` is given,
+        idle instances are also probed with a test conversion and restarted if they don't respond
+        in time.
+        """
+        for index, process in enumerate(processes):
+            if process.poll() is not None:
+                cron_logger.warning(u'LibreOffice instance {} exited with {}.'.format(
+                        index, process.returncode))
+            elif os.path.exists(converter.restart_marker_path(index)):
+                cron_logger.warning(u'LibreOffice instance {} is stuck.'.format(index))
+                self._stop(process)
+            elif probe_timeout is not None and converter.probe(index, probe_timeout) is False:
+                cron_logger.warning(u'LibreOffice instance {} is not responding.'.format(index))
+                self._stop(process)
+            else:
+                continue
+            processes[index] = self._start(converter, index)
+
+    def handle_noargs(self, **options):
+        if settings.MOCK_LIBREOFFICE:
+            raise CommandError(u'LibreOffice is mocked, there is nothing to run.')
+
+        converter = LibreOfficeConverter()
+        if not os.path.isdir(converter.path):
+            os.makedirs(converter.path)
+        processes = [self._start(converter, i) for i in range(converter.instances)]
+        probed = time.time()
+        try:
+            while True:
+                time.sleep(options[u'check_interval'])
+                probe = time.time() - probed >= options[u'probe_interval']
+                if probe:
+                    probed = time.time()
+                self._check(converter, processes,
+                        probe_timeout=options[u'probe_timeout'] if probe else None)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for index, process in enumerate(processes):
+                self._stop(process)
+                os.remove(converter.pid_path(index))
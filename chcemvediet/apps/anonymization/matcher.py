@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+
+
+class Automaton(object):
+    u"""
+    Aho-Corasick automaton. Finds all occurrences of all keys in a text, including overlapping
+    ones, in time linear with the text length and the number of occurrences.
+    """
+
+    def __init__(self, keys):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        for key in keys:
+            state = 0
+            for c in key:
+                nxt = self.goto[state].get(c)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][c] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                state = nxt
+            if state and len(key) not in self.out[state]:
+                self.out[state] += (len(key),)
+
+        queue = deque(self.goto[0].itervalues())
+        while queue:
+            state = queue.popleft()
+            for c, nxt in self.goto[state].iteritems():
+                queue.append(nxt)
+                fail = self.fail[state]
+                while fail and c not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[nxt] = self.goto[fail].get(c, 0)
+                self.out[nxt] += self.out[self.fail[nxt]]
+
+    def __nonzero__(self):
+        return bool(self.goto[0])
+
+    def finditer(self, text):
+        u"""
+        Yields ``(start, end)`` tuples of all key occurrences in ``text``.
+        """
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for i, c in enumerate(text):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            for length in out[state]:
+                yield i + 1 - length, i + 1
+
+def is_word_char(c):
+    return c.isalnum() or c == u'_'
+
+def is_word_boundary(text, i):
+    u"""
+    Emulates regex ``\\b`` with ``re.UNICODE`` at position ``i`` of ``text``.
+    """
+    before = i > 0 and is_word_char(text[i-1])
+    after = i < len(text) and is_word_char(text[i])
+    return before != after
+
+class Matcher(object):
+    u"""
+    Multi-pattern matcher with the same interface as compiled regex ``sub`` method. Words are
+    matched in the text folded by ``fold``, which must map every character to exactly one
+    character. Numbers are matched in the folded text with spaces and dashes removed, allowing a
+    single space or dash between any two consecutive digits. Keys must be folded already. If
+    ``match_subwords`` is False, matches must start and end on word boundaries. If it is True,
+    non alphanumeric characters of word keys are optional. Such words are matched in the folded
+    text with non alphanumeric characters removed, and every match is then checked against the
+    original text, so optional characters never multiply the keys.
+
+    At every position the longest match wins and matches never overlap, so the whole text is
+    scanned only once no matter how many keys there are.
+    """
+
+    def __init__(self, word_keys, number_keys, match_subwords, fold):
+        self.variants = {}
+        if match_subwords:
+            for key in word_keys:
+                projected = u''.join(c for c in key if c.isalnum())
+                self.variants.setdefault(projected, set()).add(key)
+            word_keys = self.variants.keys()
+        self.words = Automaton(k for k in word_keys if k)
+        self.numbers = Automaton(k for k in number_keys if k)
+        self.match_subwords = match_subwords
+        self.fold = fold
+
+    def __nonzero__(self):
+        return bool(self.words) or bool(self.numbers)
+
+    def _variant_end(self, text, start, key):
+        u"""
+        Returns the end of the longest variant of the projected ``key`` matching ``text`` at
+        ``start`` with its non alphanumeric characters optional, or ``None`` if no variant matches.
+        Characters of the text must match mandatory alphanumeric characters in order, so optional
+        characters can be matched greedily.
+        """
+        res = None
+        for variant in self.variants[key]:
+            pos = start
+            for c in variant:
+                if pos < len(text) and text[pos] == c:
+                    pos += 1
+                elif c.isalnum():
+                    break
+            else:
+                if res is None or pos > res:
+                    res = pos
+        return res
+
+    def _candidates(self, text):
+        folded = self.fold(text)
+        if self.words and self.match_subwords:
+            positions = [i for i, c in enumerate(folded) if c.isalnum()]
+            projected = u''.join(folded[i] for i in positions)
+            for start, end in self.words.finditer(projected):
+                end = self._variant_end(folded, positions[start], projected[start:end])
+                if end is not None:
+                    yield positions[start], end
+        else:
+            for span in self.words.finditer(folded):
+                yield span
+
+        if self.numbers:
+            positions = [i for i, c in enumerate(folded) if c not in u' -']
+            projected = u''.join(folded[i] for i in positions)
+            for start, end in self.numbers.finditer(projected):
+                span = positions[start:end]
+                if all(b - a <= 2 for a, b in zip(span, span[1:])):
+                    yield span[0], span[-1] + 1
+
+    def spans(self, text):
+        u"""
+        Returns the list of non-overlapping ``(start, end)`` tuples of matches in ``text``.
+        """
+        res = []
+        pos = 0
+        for start, end in sorted(self._candidates(text), key=lambda (s, e): (s, -e)):
+            if start < pos:
+                continue
+            if not self.match_subwords:
+                if not is_word_boundary(text, start) or not is_word_boundary(text, end):
+                    continue
+            res.append((start, end))
+            pos = end
+        return res
+
+    def sub(self, repl, text):
+        if isinstance(text, str):
+            text = text.decode(u'utf-8')
+        res = []
+        pos = 0
+        for start, end in self.spans(text):
+            res.append(text[pos:start])
+            res.append(repl)
+            pos = end
+        res.append(text[pos:])
+        return u''.join(res)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from django.db.models import Q, Avg, Max, Sum
+from aggregate_if import Count
+
+from .models import PipelineState
+from .pipeline import STAGES
+
+
+def stage_metrics(since=None):
+    u"""
+    Aggregates metrics of anonymization pipeline stages. Returns a list of dicts, one for every
+    stage, with the number of results, the number and rate of successful ones, average and max wall
+    time, average and total CPU time, average input and output sizes, and the number of attachments
+    waiting for the stage and being processed by it. If ``since`` is given, only results created
+    since then are aggregated. Queue depths are always current.
+    """
+    res = []
+    for stage in STAGES:
+        results = stage.result.objects.all()
+        if since is not None:
+            results = results.filter(created__gte=since)
+        metrics = results.aggregate(
+                count=Count(u'pk'),
+                successful=Count(u'pk', only=Q(successful=True)),
+                duration_avg=Avg(u'duration'),
+                duration_max=Max(u'duration'),
+                cpu_time_avg=Avg(u'cpu_time'),
+                cpu_time_sum=Sum(u'cpu_time'),
+                input_size_avg=Avg(u'input_size'),
+                output_size_avg=Avg(u'size'),
+                )
+        metrics[u'name'] = stage.name
+        metrics[u'success_rate'] = (float(metrics[u'successful']) / metrics[u'count']
+                                    if metrics[u'count'] else None)
+        states = PipelineState.objects.stage(stage.value)
+        metrics[u'waiting'] = states.waiting().count()
+        metrics[u'claimed'] = states.claimed().count()
+        res.append(metrics)
+    return res
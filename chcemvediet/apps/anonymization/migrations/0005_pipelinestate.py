@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import poleno.utils.misc
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attachments', '0006_attachment_content_hash_data'),
+        ('anonymization', '0004_attachmentfinalization'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineState',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('stage', models.SmallIntegerField(help_text='The stage the attachment is waiting for, being processed by, or the last stage it reached if it is done.', choices=[(1, 'Normalization'), (2, 'Recognition'), (3, 'Anonymization'), (4, 'Finalization')])),
+                ('status', models.SmallIntegerField(default=1, help_text='"Waiting" if the attachment waits for the stage, "Claimed" if a worker is processing it, "Done" if the attachment left the pipeline.', choices=[(1, 'Waiting'), (2, 'Claimed'), (3, 'Done')])),
+                ('claimed_at', models.DateTimeField(help_text='Date and time the attachment was claimed by a worker. NULL if not claimed.', null=True, blank=True)),
+                ('worker', models.CharField(help_text='Worker processing the attachment. Empty if not claimed.', max_length=255, blank=True)),
+                ('attachment', models.OneToOneField(to='attachments.Attachment')),
+            ],
+            options={
+            },
+            bases=(poleno.utils.misc.FormatMixin, models.Model),
+        ),
+        migrations.AlterIndexTogether(
+            name='pipelinestate',
+            index_together=set([('stage', 'status', 'id')]),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+NORMALIZATION, RECOGNITION, ANONYMIZATION, FINALIZATION = 1, 2, 3, 4
+WAITING, DONE = 1, 3
+PDF = u'application/pdf'
+ODT = u'application/vnd.oasis.opendocument.text'
+
+def forward(apps, schema_editor):
+    ContentType = apps.get_model(u'contenttypes', u'ContentType')
+    Attachment = apps.get_model(u'attachments', u'Attachment')
+    PipelineState = apps.get_model(u'anonymization', u'PipelineState')
+    stages = [
+            (NORMALIZATION, apps.get_model(u'anonymization', u'AttachmentNormalization'), PDF),
+            (RECOGNITION, apps.get_model(u'anonymization', u'AttachmentRecognition'), ODT),
+            (ANONYMIZATION, apps.get_model(u'anonymization', u'AttachmentAnonymization'), ODT),
+            (FINALIZATION, apps.get_model(u'anonymization', u'AttachmentFinalization'), PDF),
+            ]
+    try:
+        action_type = ContentType.objects.get(app_label=u'inforequests', model=u'action')
+    except ContentType.DoesNotExist:
+        return
+
+    states = []
+    for attachment in Attachment.objects.filter(generic_type=action_type).iterator():
+        finalizations = stages[-1][1].objects.filter(attachment=attachment, successful=True)
+        if finalizations.exists():
+            # Finalized manually
+            stage, status = FINALIZATION, DONE
+        else:
+            for stage, model, content_type in stages:
+                results = model.objects.filter(attachment=attachment)
+                if not results.exists():
+                    status = WAITING
+                    break
+                if not results.filter(successful=True, content_type=content_type).exists():
+                    status = DONE
+                    break
+            else:
+                status = DONE
+        states.append(PipelineState(attachment=attachment, stage=stage, status=status))
+    PipelineState.objects.bulk_create(states, batch_size=500)
+
+def backward(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0001_initial'),
+        ('anonymization', '0005_pipelinestate'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, backward),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('anonymization', '0006_pipelinestate_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachmentrecognition',
+            name='text',
+            field=models.TextField(help_text='Plain text of the recognized document, as seen by the anonymization. Used to find documents affected by changed anonymized strings. NULL if not extracted yet.', null=True, blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import datetime
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('anonymization', '0007_attachmentrecognition_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pipelinestate',
+            name='due_date',
+            field=models.DateField(default=datetime.date(9999, 12, 31), help_text='Expected publication date of the inforequest the attachment belongs to. Waiting attachments with earlier dates are processed first.'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='pipelinestate',
+            name='unpublished',
+            field=models.BooleanField(default=True, help_text='False if the inforequest the attachment belongs to is already published. Such attachments are preferred among attachments with the same due date.'),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='pipelinestate',
+            index_together=set([('stage', 'status', 'due_date', 'unpublished', 'id')]),
+        ),
+    ]
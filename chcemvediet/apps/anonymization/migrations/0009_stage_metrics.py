@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('anonymization', '0008_pipelinestate_due_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachmentanonymization',
+            name='cpu_time',
+            field=models.FloatField(help_text='CPU time spent on the anonymization in seconds, including external converters. NULL if not measured.', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='attachmentanonymization',
+            name='duration',
+            field=models.FloatField(help_text='Wall time of the anonymization in seconds. NULL if not measured.', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='attachmentanonymization',
+            name='input_size',
+            field=models.IntegerField(help_text='Size of the anonymization input file in bytes. NULL if not measured.', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='attachmentfinalization',
+            name='cpu_time',
+            field=models.FloatField(help_text='CPU time spent on the finalization in seconds, including external converters. NULL if not measured.', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='attachmentfinalization',
+            name='duration',
+            field=models.FloatField(help_text='Wall time of the finalization in seconds. NULL if not measured.', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='attachmentfinalization',
+            name='input_size',
+            field=models.IntegerField(help_text='Size of the finalization input file in bytes. NULL if not measured.', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='attachmentnormalization',
+            name='cpu_time',
+            field=models.FloatField(help_text='CPU time spent on the normalization in seconds, including external converters. NULL if not measured.', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='attachmentnormalization',
+            name='duration',
+            field=models.FloatField(help_text='Wall time of the normalization in seconds. NULL if not measured.', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='attachmentnormalization',
+            name='input_size',
+            field=models.IntegerField(help_text='Size of the normalization input file in bytes. NULL if not measured.', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='attachmentrecognition',
+            name='cpu_time',
+            field=models.FloatField(help_text='CPU time spent on the recognition in seconds, including external converters. NULL if not measured.', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='attachmentrecognition',
+            name='duration',
+            field=models.FloatField(help_text='Wall time of the recognition in seconds. NULL if not measured.', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='attachmentrecognition',
+            name='input_size',
+            field=models.IntegerField(help_text='Size of the recognition input file in bytes. NULL if not measured.', null=True, blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -1,13 +1,14 @@
 import logging
+import datetime
 import itertools
 
 from django.db import models
 from django.utils.functional import cached_property
 
 from poleno import datacheck
-from poleno.attachments.models import Attachment
+from poleno.attachments.models import Attachment, AttachmentContentMixin
 from poleno.attachments.utils import attachment_file_check, attachment_orphaned_file_check
-from poleno.utils.models import QuerySet
+from poleno.utils.models import FieldChoices, QuerySet
 from poleno.utils.date import utc_now
 from poleno.utils.misc import FormatMixin, random_string, squeeze, decorate, adjust_extension
 
@@ -24,10 +25,13 @@ class AttachmentNormalizationQuerySet(QuerySet):
     def not_recognized(self):
         return self.filter(attachment__attachmentrecognition__isnull=True)
 
+    def same_content_as(self, attachment):
+        return self.filter(attachment__content_hash=attachment.content_hash)
+
     def order_by_pk(self):
         return self.order_by(u'pk')
 
-class AttachmentNormalization(FormatMixin, models.Model):
+class AttachmentNormalization(AttachmentContentMixin, FormatMixin, models.Model):
 
     # May NOT be NULL
     attachment = models.ForeignKey(Attachment)
@@ -71,6 +75,25 @@ class AttachmentNormalization(FormatMixin, models.Model):
                 computed when creating a new object.
                 """))
 
+    # May be NULL; Measured by the anonymization pipeline.
+    duration = models.FloatField(null=True, blank=True,
+            help_text=squeeze(u"""
+                Wall time of the normalization in seconds. NULL if not measured.
+                """))
+
+    # May be NULL; Measured by the anonymization pipeline.
+    cpu_time = models.FloatField(null=True, blank=True,
+            help_text=squeeze(u"""
+                CPU time spent on the normalization in seconds, including external converters. NULL if
+                not measured.
+                """))
+
+    # May be NULL; Measured by the anonymization pipeline.
+    input_size = models.IntegerField(null=True, blank=True,
+            help_text=squeeze(u"""
+                Size of the normalization input file in bytes. NULL if not measured.
+                """))
+
     # May NOT be NULL
     debug = models.TextField(blank=True,
             help_text=squeeze(u"""
@@ -125,10 +148,16 @@ class AttachmentRecognitionQuerySet(QuerySet):
     def not_anonymized(self):
         return self.filter(attachment__attachmentanonymization__isnull=True)
 
+    def same_content_as(self, attachment):
+        return self.filter(attachment__content_hash=attachment.content_hash)
+
     def order_by_pk(self):
         return self.order_by(u'pk')
 
-class AttachmentRecognition(FormatMixin, models.Model):
+    def owned_by(self, user):
+        return self.filter(attachment__action__branch__inforequest__applicant=user)
+
+class AttachmentRecognition(AttachmentContentMixin, FormatMixin, models.Model):
 
     # May NOT be NULL
     attachment = models.ForeignKey(Attachment)
@@ -172,12 +201,38 @@ class AttachmentRecognition(FormatMixin, models.Model):
                 computed when creating a new object.
                 """))
 
+    # May be NULL; Measured by the anonymization pipeline.
+    duration = models.FloatField(null=True, blank=True,
+            help_text=squeeze(u"""
+                Wall time of the recognition in seconds. NULL if not measured.
+                """))
+
+    # May be NULL; Measured by the anonymization pipeline.
+    cpu_time = models.FloatField(null=True, blank=True,
+            help_text=squeeze(u"""
+                CPU time spent on the recognition in seconds, including external converters. NULL if
+                not measured.
+                """))
+
+    # May be NULL; Measured by the anonymization pipeline.
+    input_size = models.IntegerField(null=True, blank=True,
+            help_text=squeeze(u"""
+                Size of the recognition input file in bytes. NULL if not measured.
+                """))
+
     # May NOT be NULL
     debug = models.TextField(blank=True,
             help_text=squeeze(u"""
                 Debug message from recognition.
                 """))
 
+    # May be NULL; Extracted when the recognition is anonymized for the first time.
+    text = models.TextField(null=True, blank=True,
+            help_text=squeeze(u"""
+                Plain text of the recognized document, as seen by the anonymization. Used to find
+                documents affected by changed anonymized strings. NULL if not extracted yet.
+                """))
+
     # Backward relations added to other models:
     #
     #  -- Attachment.attachment_recognition_set
@@ -232,7 +287,7 @@ class AttachmentAnonymizationQuerySet(QuerySet):
     def owned_by(self, user):
         return self.filter(attachment__action__branch__inforequest__applicant=user)
 
-class AttachmentAnonymization(FormatMixin, models.Model):
+class AttachmentAnonymization(AttachmentContentMixin, FormatMixin, models.Model):
 
     # May NOT be NULL
     attachment = models.ForeignKey(Attachment)
@@ -277,6 +332,25 @@ class AttachmentAnonymization(FormatMixin, models.Model):
                 computed when creating a new object.
                 """))
 
+    # May be NULL; Measured by the anonymization pipeline.
+    duration = models.FloatField(null=True, blank=True,
+            help_text=squeeze(u"""
+                Wall time of the anonymization in seconds. NULL if not measured.
+                """))
+
+    # May be NULL; Measured by the anonymization pipeline.
+    cpu_time = models.FloatField(null=True, blank=True,
+            help_text=squeeze(u"""
+                CPU time spent on the anonymization in seconds, including external converters. NULL if
+                not measured.
+                """))
+
+    # May be NULL; Measured by the anonymization pipeline.
+    input_size = models.IntegerField(null=True, blank=True,
+            help_text=squeeze(u"""
+                Size of the anonymization input file in bytes. NULL if not measured.
+                """))
+
     # May NOT be NULL
     debug = models.TextField(blank=True,
             help_text=squeeze(u"""
@@ -331,7 +405,7 @@ class AttachmentFinalizationQuerySet(QuerySet):
     def owned_by(self, user):
         return self.filter(attachment__action__branch__inforequest__applicant=user)
 
-class AttachmentFinalization(FormatMixin, models.Model):
+class AttachmentFinalization(AttachmentContentMixin, FormatMixin, models.Model):
 
     # May NOT be NULL
     attachment = models.ForeignKey(Attachment)
@@ -375,6 +449,25 @@ class AttachmentFinalization(FormatMixin, models.Model):
                 computed when creating a new object.
                 """))
 
+    # May be NULL; Measured by the anonymization pipeline.
+    duration = models.FloatField(null=True, blank=True,
+            help_text=squeeze(u"""
+                Wall time of the finalization in seconds. NULL if not measured.
+                """))
+
+    # May be NULL; Measured by the anonymization pipeline.
+    cpu_time = models.FloatField(null=True, blank=True,
+            help_text=squeeze(u"""
+                CPU time spent on the finalization in seconds, including external converters. NULL if
+                not measured.
+                """))
+
+    # May be NULL; Measured by the anonymization pipeline.
+    input_size = models.IntegerField(null=True, blank=True,
+            help_text=squeeze(u"""
+                Size of the finalization input file in bytes. NULL if not measured.
+                """))
+
     # May NOT be NULL
     debug = models.TextField(blank=True,
             help_text=squeeze(u"""
@@ -420,6 +513,104 @@ class AttachmentFinalization(FormatMixin, models.Model):
         return format(self.pk)
 
 
+class PipelineStateQuerySet(QuerySet):
+    def stage(self, stage):
+        return self.filter(stage=stage)
+
+    def waiting(self):
+        return self.filter(status=PipelineState.STATUSES.WAITING)
+
+    def claimed(self):
+        return self.filter(status=PipelineState.STATUSES.CLAIMED)
+
+    def done(self):
+        return self.filter(status=PipelineState.STATUSES.DONE)
+
+    def not_done(self):
+        return self.exclude(status=PipelineState.STATUSES.DONE)
+
+    def order_by_pk(self):
+        return self.order_by(u'pk')
+
+    def order_by_urgency(self):
+        return self.order_by(u'due_date', u'unpublished', u'pk')
+
+class PipelineState(FormatMixin, models.Model):
+    u"""
+    Position of an attachment attached to an action in the anonymization pipeline. Waiting
+    attachments of a stage are found by a single index seek, instead of joining the stage results.
+    """
+
+    # May NOT be NULL
+    attachment = models.OneToOneField(Attachment)
+
+    # May NOT be NULL
+    STAGES = FieldChoices(
+            (u'NORMALIZATION', 1, u'Normalization'),
+            (u'RECOGNITION',   2, u'Recognition'),
+            (u'ANONYMIZATION', 3, u'Anonymization'),
+            (u'FINALIZATION',  4, u'Finalization'),
+            )
+    stage = models.SmallIntegerField(choices=STAGES._choices,
+            help_text=squeeze(u"""
+                The stage the attachment is waiting for, being processed by, or the last stage
+                it reached if it is done.
+                """))
+
+    # May NOT be NULL
+    STATUSES = FieldChoices(
+            (u'WAITING', 1, u'Waiting'),
+            (u'CLAIMED', 2, u'Claimed'),
+            (u'DONE',    3, u'Done'),
+            )
+    status = models.SmallIntegerField(choices=STATUSES._choices, default=STATUSES.WAITING,
+            help_text=squeeze(u"""
+                "Waiting" if the attachment waits for the stage, "Claimed" if a worker is
+                processing it, "Done" if the attachment left the pipeline.
+                """))
+
+    # May be NULL
+    claimed_at = models.DateTimeField(null=True, blank=True,
+            help_text=squeeze(u"""
+                Date and time the attachment was claimed by a worker. NULL if not claimed.
+                """))
+
+    # May be empty
+    worker = models.CharField(max_length=255, blank=True,
+            help_text=squeeze(u"""
+                Worker processing the attachment. Empty if not claimed.
+                """))
+
+    # May NOT be NULL; Computed by ``scheduler.schedule_attachments()``
+    NEVER = datetime.date.max
+    due_date = models.DateField(default=NEVER,
+            help_text=squeeze(u"""
+                Expected publication date of the inforequest the attachment belongs to. Waiting
+                attachments with earlier dates are processed first.
+                """))
+
+    # May NOT be NULL; Computed by ``scheduler.schedule_attachments()``
+    # Inverted, so the urgency order is ascending like the index.
+    unpublished = models.BooleanField(default=True,
+            help_text=squeeze(u"""
+                False if the inforequest the attachment belongs to is already published. Such
+                attachments are preferred among attachments with the same due date.
+                """))
+
+    # Indexes:
+    #  -- attachment: OneToOneField
+    #  -- stage, status, due_date, unpublished, id: index_together
+
+    objects = PipelineStateQuerySet.as_manager()
+
+    class Meta:
+        index_together = [
+                [u'stage', u'status', u'due_date', u'unpublished', u'id'],
+                ]
+
+    def __unicode__(self):
+        return format(self.pk)
+
 @datacheck.register
 def datachecks_AttachmentNormalization(superficial, autofix):
     u"""
@@ -1,31 +1,29 @@
 import os
-import shutil
 import traceback
 
-import subprocess32
-from django.core.files.base import ContentFile
+from django.core.files import File
 from django.conf import settings
 
 from poleno.cron import cron_logger
 from poleno.attachments.models import Attachment
 from poleno.utils.misc import guess_extension
-from chcemvediet.apps.inforequests.models import Action
 
 from .models import AttachmentNormalization
-from .utils import temporary_directory
+from .utils import temporary_directory, copy_content, run_converter
+from .conversion import get_converter
 from . import content_types
 
 
-LIBREOFFICE_TIMEOUT = 300
 IMAGEMAGIC_TIMEOUT = 300
 
 def normalize_pdf(attachment):
-    AttachmentNormalization.objects.create(
-        attachment=attachment,
-        successful=True,
-        file=ContentFile(attachment.content),
-        content_type=content_types.PDF_CONTENT_TYPE
-    )
+    with attachment.open_content() as file:
+        AttachmentNormalization.objects.create(
+            attachment=attachment,
+            successful=True,
+            file=file,
+            content_type=content_types.PDF_CONTENT_TYPE
+        )
     cron_logger.info(u'Normalized attachment: {}'.format(attachment))
 
 def normalize_using_mock(attachment, package):
@@ -35,54 +33,43 @@ def normalize_using_mock(attachment, package):
         AttachmentNormalization.objects.create(
             attachment=attachment,
             successful=True,
-            file=ContentFile(file.read()),
+            file=File(file),
             content_type=content_types.PDF_CONTENT_TYPE,
             debug=u'Created using mocked {}.'.format(package)
         )
     cron_logger.info(u'Normalized attachment using mocked {}: {}'.format(package, attachment))
 
 def normalize_using_libreoffice(attachment):
-    if settings.MOCK_LIBREOFFICE:
-        normalize_using_mock(attachment, u'libreoffice')
-        return
-
+    converter = get_converter()
     try:
-        p = None
         with temporary_directory() as directory:
             filename = os.path.join(directory, u'file' + guess_extension(attachment.content_type))
-            shutil.copy2(attachment.file.path, filename)
-            p = subprocess32.run(
-                [u'libreoffice', u'--headless', u'--convert-to', u'pdf', u'--outdir', directory,
-                 filename],
-                stdout=subprocess32.PIPE,
-                stderr=subprocess32.PIPE,
-                timeout=LIBREOFFICE_TIMEOUT,
-                check=True,
-            )
-            with open(os.path.join(directory, u'file.pdf'), u'rb') as file_pdf:
+            output = os.path.join(directory, u'normalized.pdf')
+            copy_content(attachment, filename)
+            debug = converter.convert(filename, output)
+            with open(output, u'rb') as file_pdf:
                 AttachmentNormalization.objects.create(
                     attachment=attachment,
                     successful=True,
-                    file=ContentFile(file_pdf.read()),
+                    file=File(file_pdf),
                     content_type=content_types.PDF_CONTENT_TYPE,
-                    debug=u'STDOUT:\n{}\nSTDERR:\n{}'.format(unicode(p.stdout, u'utf-8'),
-                                                             unicode(p.stderr, u'utf-8'),
-                                                             )
+                    debug=debug,
                 )
-            cron_logger.info(u'Normalized attachment using libreoffice: {}'.format(attachment))
+            cron_logger.info(u'Normalized attachment using {}: {}'.format(
+                converter.name, attachment))
     except Exception as e:
         trace = unicode(traceback.format_exc(), u'utf-8')
-        stdout = unicode(p.stdout if p else getattr(e, u'stdout', ''), u'utf-8')
-        stderr = unicode(p.stderr if p else getattr(e, u'stderr', ''), u'utf-8')
+        stdout = unicode(getattr(e, u'stdout', None) or '', u'utf-8')
+        stderr = unicode(getattr(e, u'stderr', None) or '', u'utf-8')
         AttachmentNormalization.objects.create(
             attachment=attachment,
             successful=False,
             content_type=content_types.PDF_CONTENT_TYPE,
             debug=u'STDOUT:\n{}\nSTDERR:\n{}\n{}'.format(stdout, stderr, trace)
         )
-        cron_logger.error(u'Normalizing attachment using libreoffice has failed: {}\n An '
+        cron_logger.error(u'Normalizing attachment using {} has failed: {}\n An '
                           u'unexpected error occured: {}\n{}'.format(
-                                  attachment, e.__class__.__name__, trace))
+                                  converter.name, attachment, e.__class__.__name__, trace))
 
 def normalize_using_imagemagic(attachment):
     if settings.MOCK_IMAGEMAGIC:
@@ -93,19 +80,16 @@ def normalize_using_imagemagic(attachment):
         p = None
         with temporary_directory() as directory:
             filename = os.path.join(directory, u'file' + guess_extension(attachment.content_type))
-            shutil.copy2(attachment.file.path, filename)
-            p = subprocess32.run(
+            copy_content(attachment, filename)
+            p = run_converter(
                 [u'convert', filename, os.path.join(directory, u'file.pdf')],
-                stdout=subprocess32.PIPE,
-                stderr=subprocess32.PIPE,
                 timeout=IMAGEMAGIC_TIMEOUT,
-                check=True,
             )
             with open(os.path.join(directory, u'file.pdf'), u'rb') as file_pdf:
                 AttachmentNormalization.objects.create(
                     attachment=attachment,
                     successful=True,
-                    file=ContentFile(file_pdf.read()),
+                    file=File(file_pdf),
                     content_type=content_types.PDF_CONTENT_TYPE,
                     debug=u'STDOUT:\n{}\nSTDERR:\n{}'.format(unicode(p.stdout, u'utf-8'),
                                                              unicode(p.stderr, u'utf-8'),
@@ -136,15 +120,40 @@ def skip_normalization(attachment):
     cron_logger.info(u'Skipping normalization of attachment with not supported content '
                      u'type: {}'.format(attachment))
 
-def normalize_attachment():
-    attachment = (Attachment.objects
-                  .attached_to(Action)
-                  .not_normalized()
-                  .first()
-                  )
-    if attachment is None:
+def reuse_normalization(attachment):
+    u"""
+    Copies successful normalization of another attachment with the same content, so we don't run
+    the same conversion again. Returns False if there is no such normalization.
+    """
+    if attachment.content_hash is None:
+        return False
+    original = (AttachmentNormalization.objects
+            .successful()
+            .same_content_as(attachment)
+            .order_by_pk()
+            .first())
+    if original is None:
+        return False
+    with original.open_content() as file:
+        AttachmentNormalization.objects.create(
+            attachment=attachment,
+            successful=True,
+            file=file,
+            content_type=original.content_type,
+            debug=u'Reused normalization {} of an attachment with the same content.'.format(
+                    original)
+        )
+    cron_logger.info(u'Normalized attachment reusing normalization {}: {}'.format(
+            original, attachment))
+    return True
+
+def attachment_to_normalize(attachment):
+    return Attachment.objects.not_normalized().filter(pk=attachment.pk).first()
+
+def normalize_attachment(attachment):
+    if reuse_normalization(attachment):
         return
-    elif attachment.content_type == content_types.PDF_CONTENT_TYPE:
+    if attachment.content_type == content_types.PDF_CONTENT_TYPE:
         normalize_pdf(attachment)
     elif attachment.content_type in content_types.LIBREOFFICE_CONTENT_TYPES:
         normalize_using_libreoffice(attachment)
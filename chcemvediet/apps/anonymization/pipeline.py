@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import traceback
+import socket
+import resource
+import datetime
+import threading
+import multiprocessing
+from Queue import Queue, Empty
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.contrib.contenttypes.models import ContentType
+
+from poleno import datacheck
+from poleno.cron import cron_logger
+from poleno.attachments.models import Attachment
+from poleno.utils.date import utc_now
+from chcemvediet.apps.inforequests.models import Action
+
+from .models import (AttachmentNormalization, AttachmentRecognition, AttachmentAnonymization,
+        AttachmentFinalization, PipelineState)
+from .normalization import attachment_to_normalize, normalize_attachment
+from .recognition import normalization_to_recognize, recognize_attachment
+from .anonymization import recognition_to_anonymize, anonymize_attachment
+from .finalization import anonymization_to_finalize, finalize_attachment
+from .scheduler import schedule_attachments
+from .utils import converters_cpu_time
+
+
+# Linux only. Python 2 lacks the constant, but the kernel supports it since 2.6.26.
+RUSAGE_THREAD = getattr(resource, u'RUSAGE_THREAD',
+        1 if sys.platform.startswith(u'linux') else None)
+
+def thread_cpu_time():
+    u"""
+    Returns CPU time consumed by the calling thread so far in seconds, or None if the platform
+    can't measure it.
+    """
+    if RUSAGE_THREAD is None:
+        return None
+    try:
+        usage = resource.getrusage(RUSAGE_THREAD)
+    except (ValueError, resource.error):
+        return None
+    return usage.ru_utime + usage.ru_stime
+
+class Stage(object):
+    u"""
+    Anonymization pipeline stage. ``value`` is the stage value from ``PipelineState.STAGES``.
+    ``input`` is a function returning the item the stage should process for the given attachment,
+    or None if there is nothing to process. ``process`` is a function processing a single item and
+    storing the stage result. ``result`` is the model of the stage results, metrics of processed
+    items are recorded on it. If None, no metrics are recorded. ``cpu_bound`` stages do their work
+    in Python, so they are processed over a pool of worker processes instead of threads.
+    """
+
+    def __init__(self, name, value, input, process, result=None, cpu_bound=False):
+        self.name = name
+        self.value = value
+        self.input = input
+        self.process = process
+        self.result = result
+        self.cpu_bound = cpu_bound
+
+STAGES = [
+        Stage(u'normalization', PipelineState.STAGES.NORMALIZATION,
+            attachment_to_normalize, normalize_attachment, AttachmentNormalization),
+        Stage(u'recognition', PipelineState.STAGES.RECOGNITION,
+            normalization_to_recognize, recognize_attachment, AttachmentRecognition),
+        Stage(u'anonymization', PipelineState.STAGES.ANONYMIZATION,
+            recognition_to_anonymize, anonymize_attachment, AttachmentAnonymization,
+            cpu_bound=True),
+        Stage(u'finalization', PipelineState.STAGES.FINALIZATION,
+            anonymization_to_finalize, finalize_attachment, AttachmentFinalization),
+        ]
+
+def enqueue_attachment(attachment):
+    u"""
+    Adds the attachment to the pipeline if it's attached to an action and schedules it. Called
+    when an attachment is created, so its state is created in the same transaction as the
+    attachment itself and the pipeline never has to look for new attachments.
+    """
+    if attachment.generic_type_id != ContentType.objects.get_for_model(Action).pk:
+        return
+    state = PipelineState.objects.create(attachment=attachment,
+            stage=PipelineState.STAGES.NORMALIZATION)
+    schedule_attachments(PipelineState.objects.filter(pk=state.pk))
+
+def enqueue_attachments():
+    u"""
+    Adds attachments attached to actions which are not in the pipeline yet and schedules them.
+    Attachments are added when they are created, so only attachments attached to actions later,
+    e.g. in the admin, are missing. They are found by an anti-join over the whole attachments
+    table, so the pipeline doesn't run it, only the datacheck autofix does. Returns the number of
+    added attachments.
+    """
+    pks = list(Attachment.objects
+            .attached_to(Action)
+            .filter(pipelinestate__isnull=True)
+            .values_list(u'pk', flat=True))
+    states = [PipelineState(attachment_id=pk, stage=PipelineState.STAGES.NORMALIZATION)
+              for pk in pks]
+    PipelineState.objects.bulk_create(states)
+    if states:
+        schedule_attachments(PipelineState.objects.filter(attachment__in=pks))
+    return len(states)
+
+@datacheck.register
+def datachecks(superficial, autofix):
+    u"""
+    Checks that every attachment attached to an action is in the anonymization pipeline.
+    """
+    count = (Attachment.objects
+            .attached_to(Action)
+            .filter(pipelinestate__isnull=True)
+            .count())
+    if count and autofix:
+        enqueue_attachments()
+    if count:
+        yield datacheck.Error(u'{} action attachments are not in the anonymization pipeline.',
+                count, autofixable=True)
+
+# Runner of the worker process. Set by the pool initializer, so it's not sent with every item.
+_pool_runner = None
+
+def _init_pool_worker(runner):
+    global _pool_runner
+    _pool_runner = runner
+
+def _process_in_pool(args):
+    u"""
+    Processes a single item in a worker process. Returns the processed item, or None if nothing
+    was processed. It's a module level function, so the pool can pass it to its worker processes.
+    """
+    index, pk, deadline = args
+    if deadline is not None and time.time() >= deadline:
+        return None
+    processed = []
+    _pool_runner._claim_and_process(_pool_runner.stages[index], pk, processed)
+    return processed[0] if processed else None
+
+class PipelineRunner(object):
+    u"""
+    Runs anonymization pipeline stages one after another. Every stage takes a batch of waiting
+    attachments and processes them over a pool of workers until the batch is exhausted or the
+    stage time budget runs out. Attachments already being processed are never interrupted, the
+    budget only stops workers from taking new attachments. Stages converting attachments spend
+    their time waiting for external converters running in their own processes, so their workers
+    are threads. CPU bound stages, i.e. the anonymization itself, run Python code which holds the
+    GIL, so their workers are forked processes instead.
+
+    Waiting attachments are found by an index seek in ``PipelineState`` table, the most urgent ones
+    first. Attachments of inforequests expected to be published sooner are more urgent, see
+    ``scheduler.expected_publication_date()``. A worker claims an attachment by atomically
+    switching its state from waiting to claimed, so an attachment is never processed twice, even
+    if processed concurrently by another runner. The claim is committed right away and the
+    attachment is processed outside any transaction, so no locks are held while converters run.
+    The stage stores its result when the processing is done, then its metrics are recorded and the
+    attachment is advanced to the next stage in a single short transaction. If the worker crashes
+    in between, the stage finds the stored result when the claim is released, so the attachment is
+    just advanced without being processed again. If processing an attachment fails, the failure
+    is logged and its claim is released right away, so it is retried by the next run. Claims older
+    than the claim timeout are considered abandoned by a crashed worker and are released.
+
+    Wall time, CPU time and input size of every processed item are recorded on its stage result.
+    CPU time is the time of the worker thread processing the item plus the time of external
+    converters it ran, see ``utils.converters_cpu_time()``. Both are measured per thread, so items
+    processed concurrently don't mix.
+
+    With a single worker, attachments are processed directly in the calling thread, so the runner
+    may be used within a transaction and with an in-memory database. With more workers, DB
+    connections of the calling thread are closed before worker processes are forked, so they don't
+    share them.
+
+    Settings:
+     -- ANONYMIZATION_BATCH_SIZE: Max number of items taken by a stage in one run. Defaults to 10.
+     -- ANONYMIZATION_STAGE_TIME_BUDGET: Seconds after which workers stop taking new items of the
+        stage. ``None`` means no limit. Defaults to 15 seconds.
+     -- ANONYMIZATION_WORKERS: Number of worker threads or processes. Defaults to 1.
+     -- ANONYMIZATION_CLAIM_TIMEOUT: Seconds after which claims are released. Defaults to 1 hour.
+    """
+
+    def __init__(self, stages=None, batch_size=None, time_budget=None, workers=None):
+        self.stages = stages if stages is not None else STAGES
+        self.batch_size = batch_size if batch_size is not None else (
+                getattr(settings, u'ANONYMIZATION_BATCH_SIZE', 10))
+        self.time_budget = time_budget if time_budget is not None else (
+                getattr(settings, u'ANONYMIZATION_STAGE_TIME_BUDGET', 15))
+        self.workers = workers if workers is not None else (
+                getattr(settings, u'ANONYMIZATION_WORKERS', 1))
+        self.claim_timeout = getattr(settings, u'ANONYMIZATION_CLAIM_TIMEOUT', 3600)
+
+    def _worker_name(self):
+        return u'{}:{}:{}'.format(socket.gethostname(), os.getpid(),
+                threading.current_thread().name)
+
+    def _release_abandoned(self, stage):
+        limit = utc_now() - datetime.timedelta(seconds=self.claim_timeout)
+        released = (PipelineState.objects
+                .stage(stage.value)
+                .claimed()
+                .filter(claimed_at__lt=limit)
+                .update(status=PipelineState.STATUSES.WAITING, claimed_at=None, worker=u''))
+        if released:
+            cron_logger.warning(u'Released {} abandoned claims of anonymization pipeline stage '
+                                u'{}.'.format(released, stage.name))
+
+    def _claim(self, stage, pk):
+        claimed = (PipelineState.objects
+                .stage(stage.value)
+                .waiting()
+                .filter(pk=pk)
+                .update(status=PipelineState.STATUSES.CLAIMED, claimed_at=utc_now(),
+                        worker=self._worker_name()))
+        return claimed == 1
+
+    def _advance(self, stage, state):
+        state.status = PipelineState.STATUSES.DONE
+        state.claimed_at = None
+        state.worker = u''
+        index = self.stages.index(stage)
+        if index + 1 < len(self.stages):
+            next_stage = self.stages[index + 1]
+            if next_stage.input(state.attachment) is not None:
+                state.stage = next_stage.value
+                state.status = PipelineState.STATUSES.WAITING
+        state.save()
+
+    def _process(self, stage, item):
+        started = time.time()
+        cpu_started = thread_cpu_time()
+        converters_started = converters_cpu_time()
+        stage.process(item)
+        cpu_time = None
+        if cpu_started is not None:
+            cpu_time = (thread_cpu_time() - cpu_started
+                    + converters_cpu_time() - converters_started)
+        return dict(duration=time.time() - started, cpu_time=cpu_time, input_size=item.size)
+
+    def _record_metrics(self, stage, attachment, metrics):
+        if stage.result is None:
+            return
+        result = stage.result.objects.filter(attachment=attachment).order_by(u'-pk').first()
+        if result is None:
+            return
+        stage.result.objects.filter(pk=result.pk).update(**metrics)
+
+    def _release(self, stage, pk):
+        (PipelineState.objects
+                .stage(stage.value)
+                .claimed()
+                .filter(pk=pk)
+                .update(status=PipelineState.STATUSES.WAITING, claimed_at=None, worker=u''))
+
+    def _claim_and_process(self, stage, pk, processed):
+        if not self._claim(stage, pk):
+            # Claimed by another worker meanwhile
+            return
+        try:
+            state = PipelineState.objects.select_related(u'attachment').get(pk=pk)
+            item = stage.input(state.attachment)
+            # Converters may run for minutes, no transaction is held open while they run.
+            metrics = self._process(stage, item) if item is not None else None
+            with transaction.atomic():
+                if metrics is not None:
+                    self._record_metrics(stage, state.attachment, metrics)
+                self._advance(stage, state)
+        except Exception:
+            # The failure is isolated to the item. Its claim is released, so it is retried by the
+            # next run, and the rest of the batch and later stages go on.
+            trace = unicode(traceback.format_exc(), u'utf-8')
+            cron_logger.error(u'Anonymization pipeline stage {} failed to process item {}:\n{}'
+                              .format(stage.name, pk, trace))
+            self._release(stage, pk)
+            return
+        if item is not None:
+            processed.append(item)
+
+    def _work(self, stage, queue, deadline, processed):
+        while deadline is None or time.time() < deadline:
+            try:
+                pk = queue.get_nowait()
+            except Empty:
+                break
+            self._claim_and_process(stage, pk, processed)
+
+    def _work_in_thread(self, stage, queue, deadline, processed, errors):
+        try:
+            self._work(stage, queue, deadline, processed)
+        except Exception:
+            errors.append(sys.exc_info())
+        finally:
+            # Every thread has its own DB connections, they are not closed automatically.
+            for connection in connections.all():
+                connection.close()
+
+    def _work_in_processes(self, stage, pks, deadline, workers, processed):
+        # Forked workers must not share DB connections with the calling process.
+        for connection in connections.all():
+            connection.close()
+        index = self.stages.index(stage)
+        pool = multiprocessing.Pool(workers, _init_pool_worker, (self,))
+        try:
+            for item in pool.imap_unordered(_process_in_pool,
+                    [(index, pk, deadline) for pk in pks]):
+                if item is not None:
+                    processed.append(item)
+            pool.close()
+        except Exception:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def run_stage(self, stage):
+        u"""
+        Processes a batch of items waiting for the given stage. Returns the list of processed
+        items.
+        """
+        self._release_abandoned(stage)
+        pks = list(PipelineState.objects
+                .stage(stage.value)
+                .waiting()
+                .order_by_urgency()
+                .values_list(u'pk', flat=True)[:self.batch_size])
+        if not pks:
+            return []
+
+        queue = Queue()
+        for pk in pks:
+            queue.put(pk)
+        deadline = time.time() + self.time_budget if self.time_budget is not None else None
+        processed = [] # ``list.append`` is atomic, so workers may share it.
+
+        workers = min(self.workers, len(pks))
+        errors = []
+        if workers <= 1:
+            self._work(stage, queue, deadline, processed)
+        elif stage.cpu_bound:
+            self._work_in_processes(stage, pks, deadline, workers, processed)
+        else:
+            threads = [threading.Thread(target=self._work_in_thread,
+                    args=(stage, queue, deadline, processed, errors)) for i in range(workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        cron_logger.info(u'Anonymization pipeline stage {} processed {} of {} items.'.format(
+                stage.name, len(processed), len(pks)))
+
+        # Reraise failure from worker threads
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return processed
+
+    def run(self):
+        for stage in self.stages:
+            self.run_stage(stage)
@@ -1,15 +1,13 @@
 import os
-import shutil
 import traceback
 
-import subprocess32
-from django.core.files.base import ContentFile
+from django.core.files import File
 from django.conf import settings
 
 from poleno.cron import cron_logger
 
 from .models import AttachmentNormalization, AttachmentRecognition
-from .utils import temporary_directory
+from .utils import temporary_directory, copy_content, run_converter
 from . import content_types
 
 
@@ -22,7 +20,7 @@ def recognize_using_mock(attachment_normalization):
         AttachmentRecognition.objects.create(
             attachment=attachment_normalization.attachment,
             successful=True,
-            file=ContentFile(file.read()),
+            file=File(file),
             content_type=content_types.ODT_CONTENT_TYPE,
             debug=u'Created using mocked abbyyocr11.'
         )
@@ -38,22 +36,19 @@ def recognize_using_ocr(attachment_normalization):
         p = None
         with temporary_directory() as directory:
             filename = os.path.join(directory, u'file.pdf')
-            shutil.copy2(attachment_normalization.file.path, filename)
-            p = subprocess32.run(
+            copy_content(attachment_normalization, filename)
+            p = run_converter(
                 [u'abbyyocr11', u'--recognitionLanguage', u'Slovak', u'--splitDualPages', u'-if',
                  filename, u'-f', u'ODT', u'--rtfKeepLines', u'--rtfRemoveSoftHyphens',
                  u'--rtfPageSynthesisMode', u'ExactCopy', u'-of',
                  os.path.join(directory, u'file.odt')],
-                stdout=subprocess32.PIPE,
-                stderr=subprocess32.PIPE,
                 timeout=OCR_TIMEOUT,
-                check=True,
             )
             with open(os.path.join(directory, u'file.odt'), u'rb') as file_odt:
                 AttachmentRecognition.objects.create(
                     attachment=attachment_normalization.attachment,
                     successful=True,
-                    file=ContentFile(file_odt.read()),
+                    file=File(file_odt),
                     content_type=content_types.ODT_CONTENT_TYPE,
                     debug=u'STDOUT:\n{}\nSTDERR:\n{}'.format(unicode(p.stdout, u'utf-8'),
                                                              unicode(p.stderr, u'utf-8'),
@@ -75,13 +70,44 @@ def recognize_using_ocr(attachment_normalization):
                           u'unexpected error occured: {}\n{}'.format(
                           attachment_normalization, e.__class__.__name__, trace))
 
-def recognize_attachment():
-    attachment_normalization = (AttachmentNormalization.objects
+def reuse_recognition(attachment_normalization):
+    u"""
+    Copies successful recognition of another attachment with the same content together with its
+    extracted text, so we don't run OCR again. Returns False if there is no such recognition.
+    """
+    attachment = attachment_normalization.attachment
+    if attachment.content_hash is None:
+        return False
+    original = (AttachmentRecognition.objects
+            .successful()
+            .recognized_to_odt()
+            .same_content_as(attachment)
+            .order_by_pk()
+            .first())
+    if original is None:
+        return False
+    with original.open_content() as file:
+        AttachmentRecognition.objects.create(
+            attachment=attachment,
+            successful=True,
+            file=file,
+            content_type=original.content_type,
+            text=original.text,
+            debug=u'Reused recognition {} of an attachment with the same content.'.format(original)
+        )
+    cron_logger.info(u'Recognized attachment_normalization reusing recognition {}: {}'.format(
+            original, attachment_normalization))
+    return True
+
+def normalization_to_recognize(attachment):
+    return (AttachmentNormalization.objects
             .successful()
             .normalized_to_pdf()
             .not_recognized()
+            .filter(attachment=attachment)
+            .order_by_pk()
             .first())
-    if attachment_normalization is None:
-        return
-    else:
+
+def recognize_attachment(attachment_normalization):
+    if not reuse_recognition(attachment_normalization):
         recognize_using_ocr(attachment_normalization)
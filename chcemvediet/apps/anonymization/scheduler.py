@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from poleno.utils.date import local_date, local_today
+from chcemvediet.apps.inforequests.constants import DAYS_TO_CLOSE_INFOREQUEST
+from chcemvediet.apps.inforequests.models import Inforequest, Branch
+
+from .models import PipelineState
+
+
+def expected_publication_date(inforequest):
+    u"""
+    Returns the date ``publish_inforequests`` cron job is expected to publish the inforequest on,
+    if nothing happens with it meanwhile. Returns ``PipelineState.NEVER`` if the inforequest will
+    never be published automatically. Already published inforequests are due today at the latest.
+
+    Requires ``Inforequest.branches`` with ``Branch.last_action`` and the applicant profile, so
+    prefetch them if scheduling many inforequests.
+    """
+    if inforequest.published is False:
+        return PipelineState.NEVER
+    days_to_publish_inforequest = inforequest.applicant.profile.days_to_publish_inforequest
+    dates = []
+    for branch in inforequest.branches:
+        action = branch.last_action
+        if action.deadline:
+            days_to_publish = DAYS_TO_CLOSE_INFOREQUEST + days_to_publish_inforequest
+            dates.append(action.deadline.snooze_date + datetime.timedelta(days=days_to_publish))
+        else:
+            dates.append(local_date(action.created) +
+                         datetime.timedelta(days=days_to_publish_inforequest))
+    due_date = max(dates) if dates else local_today()
+    if inforequest.published:
+        due_date = min(due_date, local_today())
+    return due_date
+
+def schedule_attachments(states=None):
+    u"""
+    Computes due dates of pipeline states by the expected publication date of inforequests their
+    attachments belong to. Only states which are not done yet are scheduled. If ``states`` is
+    None, all of them are. Returns the number of scheduled inforequests.
+    """
+    if states is None:
+        states = PipelineState.objects.all()
+    states = states.not_done()
+    pks = (states
+            .values_list(u'attachment__action__branch__inforequest', flat=True)
+            .distinct())
+    inforequests = (Inforequest.objects
+            .filter(pk__in=list(pks))
+            .select_related(u'applicant__profile')
+            .prefetch_related(Inforequest.prefetch_branches())
+            .prefetch_related(Branch.prefetch_last_action(u'branches'))
+            )
+    count = 0
+    for inforequest in inforequests:
+        (states
+            .filter(attachment__action__branch__inforequest=inforequest)
+            .update(due_date=expected_publication_date(inforequest),
+                    unpublished=not inforequest.published))
+        count += 1
+    return count
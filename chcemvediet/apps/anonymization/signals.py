@@ -0,0 +1,14 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from poleno.attachments.models import Attachment
+
+from .pipeline import enqueue_attachment
+
+
+@receiver(post_save, sender=Attachment)
+def enqueue_attachment_on_attachment_post_save(sender, **kwargs):
+    if kwargs[u'created'] and not kwargs[u'raw']:
+        enqueue_attachment(kwargs[u'instance'])
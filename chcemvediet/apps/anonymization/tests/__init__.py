@@ -0,0 +1,24 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+from testfixtures import TempDirectory
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from chcemvediet.tests import ChcemvedietTestCaseMixin
+
+
+class AnonymizationTestCaseMixin(ChcemvedietTestCaseMixin, TestCase):
+
+    def _pre_setup(self):
+        super(AnonymizationTestCaseMixin, self)._pre_setup()
+        self.tempdir = TempDirectory()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.tempdir.path,
+            )
+        self.settings_override.enable()
+
+    def _post_teardown(self):
+        self.settings_override.disable()
+        self.tempdir.cleanup()
+        super(AnonymizationTestCaseMixin, self)._post_teardown()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import os
+import zipfile
+from StringIO import StringIO
+
+from lxml import etree
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.test import TestCase
+
+from chcemvediet.apps.anonymization.anonymization import (generate_user_pattern,
+        compile_user_pattern, anonymize_string, anonymize_markup, anonymize_odt,
+        invalidate_anonymizations)
+from chcemvediet.apps.anonymization.models import (AttachmentRecognition,
+        AttachmentAnonymization, AttachmentFinalization, PipelineState)
+from chcemvediet.apps.anonymization import content_types
+from chcemvediet.apps.anonymization.tests import AnonymizationTestCaseMixin
+
+
+class GenerateUserPatternTest(AnonymizationTestCaseMixin, TestCase):
+
+    def setUp(self):
+        super(GenerateUserPatternTest, self).setUp()
+        compile_user_pattern.cache_clear()
+
+
+    def test_pattern_is_compiled_once(self):
+        inforequest = self._create_inforequest()
+        prog = generate_user_pattern(inforequest)
+        self.assertIs(generate_user_pattern(inforequest), prog)
+        self.assertIsNot(generate_user_pattern(inforequest, match_subwords=True), prog)
+
+    def test_pattern_is_shared_by_inforequests_with_the_same_strings(self):
+        inforequest1 = self._create_inforequest()
+        inforequest2 = self._create_inforequest()
+        self.assertIs(generate_user_pattern(inforequest1), generate_user_pattern(inforequest2))
+
+    def test_changed_profile_is_not_served_stale_pattern(self):
+        user = self._create_user(custom_anonymized_strings=[u'Secret'])
+        inforequest = self._create_inforequest(applicant=user)
+        self.assertEqual(anonymize_string(generate_user_pattern(inforequest), u'Secret Moo'),
+                u'xxxxx Moo')
+        user.profile.custom_anonymized_strings = [u'Moo']
+        user.profile.save()
+        self.assertEqual(anonymize_string(generate_user_pattern(inforequest), u'Secret Moo'),
+                u'Secret xxxxx')
+
+class AnonymizeOdtTest(AnonymizationTestCaseMixin, TestCase):
+
+    def setUp(self):
+        super(AnonymizeOdtTest, self).setUp()
+        compile_user_pattern.cache_clear()
+        self.user.profile.custom_anonymized_strings = [u'Hrvatski', u'Česky']
+        self.user.profile.save()
+        path = os.path.join(settings.PROJECT_PATH,
+                u'chcemvediet/apps/anonymization/mocks/recognized.odt')
+        with open(path, u'rb') as f:
+            self.odt = f.read()
+        self.attachment = self._create_attachment(generic_object=self.action)
+        self.recognition = AttachmentRecognition.objects.create(
+                attachment=self.attachment,
+                successful=True,
+                file=ContentFile(self.odt),
+                content_type=content_types.ODT_CONTENT_TYPE,
+                )
+
+    def _span_texts(self, content):
+        namespace = {u'text': u'urn:oasis:names:tc:opendocument:xmlns:text:1.0'}
+        root = etree.fromstring(content)
+        return [(t.text, [tt.tail for tt in t]) for t in root.findall(u'.//text:span', namespace)]
+
+
+    def test_spans_are_anonymized(self):
+        anonymize_odt(self.recognition)
+        anonymization = AttachmentAnonymization.objects.get(attachment=self.attachment)
+        self.assertTrue(anonymization.successful)
+        with zipfile.ZipFile(StringIO(anonymization.content)) as result:
+            content = result.read(u'content.xml')
+        self.assertNotIn(b'Hrvatski', content)
+        self.assertNotIn(u'Česky'.encode(u'utf-8'), content)
+        self.assertIn(b'Suomi', content)
+
+    def test_same_spans_as_in_memory_anonymization(self):
+        anonymize_odt(self.recognition)
+        anonymization = AttachmentAnonymization.objects.get(attachment=self.attachment)
+        with zipfile.ZipFile(StringIO(anonymization.content)) as result:
+            content = result.read(u'content.xml')
+        with zipfile.ZipFile(StringIO(self.odt)) as original:
+            expected = anonymize_markup(generate_user_pattern(self.inforequest),
+                    original.read(u'content.xml'), etree.XMLParser(), u'.//text:span',
+                    {u'text': u'urn:oasis:names:tc:opendocument:xmlns:text:1.0'})
+        self.assertEqual(self._span_texts(content), self._span_texts(expected))
+
+    def test_archive_members_are_kept(self):
+        anonymize_odt(self.recognition)
+        anonymization = AttachmentAnonymization.objects.get(attachment=self.attachment)
+        with zipfile.ZipFile(StringIO(anonymization.content)) as result:
+            with zipfile.ZipFile(StringIO(self.odt)) as original:
+                self.assertEqual(
+                        [(i.filename, i.compress_type) for i in result.infolist()],
+                        [(i.filename, i.compress_type) for i in original.infolist()])
+                self.assertEqual(result.read(u'mimetype'), original.read(u'mimetype'))
+
+    def test_recognized_text_is_extracted(self):
+        anonymize_odt(self.recognition)
+        recognition = AttachmentRecognition.objects.get(pk=self.recognition.pk)
+        self.assertIn(u'Hrvatski', recognition.text)
+        self.assertIn(u'Suomi', recognition.text)
+
+class InvalidateAnonymizationsTest(AnonymizationTestCaseMixin, TestCase):
+
+    def setUp(self):
+        super(InvalidateAnonymizationsTest, self).setUp()
+        compile_user_pattern.cache_clear()
+        self.user.profile.custom_anonymized_strings = [u'Secret']
+        self.user.profile.save()
+
+    def _create_anonymized_attachment(self, text):
+        attachment = self._create_attachment(generic_object=self.action)
+        AttachmentRecognition.objects.create(attachment=attachment, successful=True,
+                content_type=content_types.ODT_CONTENT_TYPE, text=text)
+        AttachmentAnonymization.objects.create(attachment=attachment, successful=True,
+                content_type=content_types.ODT_CONTENT_TYPE)
+        AttachmentFinalization.objects.create(attachment=attachment, successful=True,
+                content_type=content_types.PDF_CONTENT_TYPE)
+        PipelineState.objects.filter(attachment=attachment).update(
+                stage=PipelineState.STAGES.FINALIZATION, status=PipelineState.STATUSES.DONE)
+        return attachment
+
+    def _assertInvalidated(self, attachment, invalidated):
+        self.assertEqual(
+                AttachmentAnonymization.objects.filter(attachment=attachment).exists(),
+                not invalidated)
+        self.assertEqual(
+                AttachmentFinalization.objects.filter(attachment=attachment).exists(),
+                not invalidated)
+        state = PipelineState.objects.get(attachment=attachment)
+        if invalidated:
+            self.assertEqual(state.stage, PipelineState.STAGES.ANONYMIZATION)
+            self.assertEqual(state.status, PipelineState.STATUSES.WAITING)
+        else:
+            self.assertEqual(state.status, PipelineState.STATUSES.DONE)
+
+
+    def test_only_attachments_containing_added_string_are_invalidated(self):
+        affected = self._create_anonymized_attachment(u'Hello Ján Kováč')
+        unaffected = self._create_anonymized_attachment(u'Hello world')
+        self.user.profile.custom_anonymized_strings = [u'Secret', u'Jan Kovac']
+        self.user.profile.save()
+        self._assertInvalidated(affected, True)
+        self._assertInvalidated(unaffected, False)
+
+    def test_only_attachments_containing_removed_string_are_invalidated(self):
+        affected = self._create_anonymized_attachment(u'Top Secret')
+        unaffected = self._create_anonymized_attachment(u'Hello world')
+        self.user.profile.custom_anonymized_strings = [u'Other']
+        self.user.profile.save()
+        self._assertInvalidated(affected, True)
+        self._assertInvalidated(unaffected, False)
+
+    def test_attachment_with_unknown_text_is_invalidated(self):
+        attachment = self._create_anonymized_attachment(None)
+        self.user.profile.custom_anonymized_strings = [u'Secret', u'Other']
+        self.user.profile.save()
+        self._assertInvalidated(attachment, True)
+
+    def test_switching_to_default_anonymization_invalidates_all_attachments(self):
+        attachment = self._create_anonymized_attachment(u'Hello world')
+        self.user.profile.custom_anonymized_strings = None
+        self.user.profile.save()
+        self._assertInvalidated(attachment, True)
+
+    def test_unchanged_strings_invalidate_nothing(self):
+        attachment = self._create_anonymized_attachment(u'Top Secret')
+        self.user.profile.custom_anonymized_strings = [u'Secret']
+        self.user.profile.save()
+        self._assertInvalidated(attachment, False)
+
+    def test_attachments_of_other_users_are_not_invalidated(self):
+        user = self._create_user()
+        inforequest = self._create_inforequest(applicant=user)
+        branch = self._create_branch(inforequest=inforequest)
+        action = self._create_action(branch=branch)
+        attachment = self._create_attachment(generic_object=action)
+        AttachmentAnonymization.objects.create(attachment=attachment, successful=True,
+                content_type=content_types.ODT_CONTENT_TYPE)
+        invalidate_anonymizations(self.user)
+        self.assertTrue(AttachmentAnonymization.objects.filter(attachment=attachment).exists())
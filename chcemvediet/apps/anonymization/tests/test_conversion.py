@@ -0,0 +1,207 @@
+import os
+
+import mock
+import subprocess32
+from django.core.management import call_command
+from django.test import TestCase
+
+from chcemvediet.apps.anonymization.conversion import (MockConverter, LibreOfficeConverter,
+        ConversionError, get_converter)
+from chcemvediet.apps.anonymization.management.commands.libreoffice_service import Command
+from chcemvediet.apps.anonymization.utils import (temporary_directory, run_converter,
+        converters_cpu_time, process_tree_cpu_time)
+
+
+class ConversionTest(TestCase):
+
+    def setUp(self):
+        self.directory_context = temporary_directory()
+        self.directory = self.directory_context.__enter__()
+        self.filename = os.path.join(self.directory, u'file.doc')
+        with open(self.filename, u'wb') as f:
+            f.write(b'content')
+
+    def tearDown(self):
+        self.directory_context.__exit__(None, None, None)
+
+    def _converter(self, instances=2):
+        return LibreOfficeConverter(instances=instances,
+                path=os.path.join(self.directory, u'profiles'))
+
+    def _run(self, args, **kwargs):
+        outdir = args[args.index(u'--outdir') + 1]
+        format = args[args.index(u'--convert-to') + 1]
+        name = os.path.splitext(os.path.basename(args[-1]))[0]
+        with open(os.path.join(outdir, u'{}.{}'.format(name, format)), u'wb') as f:
+            f.write(b'converted')
+        return subprocess32.CompletedProcess(args, 0, stdout=b'out', stderr=b'err')
+
+
+    def test_get_converter_returns_mock_converter_if_libreoffice_is_mocked(self):
+        with self.settings(MOCK_LIBREOFFICE=True):
+            self.assertIsInstance(get_converter(), MockConverter)
+        with self.settings(MOCK_LIBREOFFICE=False):
+            self.assertIsInstance(get_converter(), LibreOfficeConverter)
+
+    def test_mock_converter_copies_mock_for_requested_format(self):
+        output = os.path.join(self.directory, u'output')
+        debug = MockConverter().convert(self.filename, output, format=u'pdf')
+        self.assertEqual(debug, u'Created using mocked libreoffice.')
+        with open(output, u'rb') as f:
+            self.assertTrue(f.read().startswith(b'%PDF'))
+
+    def test_libreoffice_converter_submits_job_to_instance_profile(self):
+        converter = self._converter()
+        output = os.path.join(self.directory, u'normalized.pdf')
+        with mock.patch(u'chcemvediet.apps.anonymization.conversion.run_converter',
+                side_effect=self._run) as run:
+            debug = converter.convert(self.filename, output)
+        args = run.call_args[0][0]
+        self.assertIn(u'-env:UserInstallation=file://{}'.format(converter.profile_path(0)), args)
+        self.assertIn(u'--convert-to', args)
+        self.assertEqual(debug, u'STDOUT:\nout\nSTDERR:\nerr')
+        with open(output, u'rb') as f:
+            self.assertEqual(f.read(), b'converted')
+
+    def test_libreoffice_converter_converts_to_requested_format(self):
+        converter = self._converter()
+        output = os.path.join(self.directory, u'output')
+        with mock.patch(u'chcemvediet.apps.anonymization.conversion.run_converter',
+                side_effect=self._run) as run:
+            converter.convert(self.filename, output, format=u'odt')
+        args = run.call_args[0][0]
+        self.assertEqual(args[args.index(u'--convert-to') + 1], u'odt')
+        with open(output, u'rb') as f:
+            self.assertEqual(f.read(), b'converted')
+
+    def test_libreoffice_converter_uses_idle_instance(self):
+        converter = self._converter()
+        with converter.acquire() as index:
+            self.assertEqual(index, 0)
+            with converter.acquire() as other:
+                self.assertEqual(other, 1)
+
+    def test_libreoffice_converter_fails_if_no_instance_is_idle(self):
+        converter = self._converter(instances=1)
+        with converter.acquire():
+            with self.assertRaises(ConversionError):
+                with converter.acquire(timeout=0):
+                    pass
+
+    def test_libreoffice_converter_marks_instance_for_restart_on_timeout(self):
+        converter = self._converter()
+        output = os.path.join(self.directory, u'normalized.pdf')
+        with mock.patch(u'chcemvediet.apps.anonymization.conversion.run_converter',
+                side_effect=subprocess32.TimeoutExpired(u'cmd', 1)):
+            with self.assertRaises(subprocess32.TimeoutExpired):
+                converter.convert(self.filename, output)
+        self.assertTrue(os.path.exists(converter.restart_marker_path(0)))
+        self.assertFalse(os.path.exists(converter.restart_marker_path(1)))
+
+    def test_probe_succeeds_if_instance_converts_test_document(self):
+        converter = self._converter()
+        with mock.patch(u'chcemvediet.apps.anonymization.conversion.run_converter',
+                side_effect=self._run) as run:
+            self.assertTrue(converter.probe(1, timeout=5))
+        self.assertIn(u'-env:UserInstallation=file://{}'.format(converter.profile_path(1)), run.call_args[0][0])
+        self.assertEqual(run.call_args[1][u'timeout'], 5)
+
+    def test_probe_fails_if_test_conversion_times_out(self):
+        converter = self._converter()
+        with mock.patch(u'chcemvediet.apps.anonymization.conversion.run_converter',
+                side_effect=subprocess32.TimeoutExpired(u'cmd', 5)):
+            self.assertIs(converter.probe(0, timeout=5), False)
+
+    def test_probe_skips_busy_instance(self):
+        converter = self._converter()
+        with converter.acquire(index=0):
+            with mock.patch(u'chcemvediet.apps.anonymization.conversion.run_converter') as run:
+                self.assertIsNone(converter.probe(0))
+        self.assertEqual(run.call_count, 0)
+
+    def test_libreoffice_converter_records_cpu_time_of_instance(self):
+        converter = self._converter()
+        output = os.path.join(self.directory, u'normalized.pdf')
+        started = converters_cpu_time()
+        with mock.patch(u'chcemvediet.apps.anonymization.conversion.run_converter',
+                side_effect=self._run):
+            with mock.patch.object(converter, u'instance_cpu_time', side_effect=[1.0, 3.5]):
+                converter.convert(self.filename, output)
+        self.assertAlmostEqual(converters_cpu_time() - started, 2.5)
+
+    def test_libreoffice_converter_finds_instance_by_pid_written_by_service(self):
+        converter = self._converter()
+        os.makedirs(converter.path)
+        self.assertIsNone(converter.instance_cpu_time(0))
+        with open(converter.pid_path(0), u'w') as f:
+            f.write(str(os.getpid()))
+        self.assertGreater(converter.instance_cpu_time(0), 0)
+
+    def test_run_converter_returns_output_and_records_cpu_time(self):
+        started = converters_cpu_time()
+        p = run_converter([u'sh', u'-c',
+                u'i=0; while [ $i -lt 100000 ]; do i=$((i+1)); done; echo out; echo err >&2'],
+                timeout=60)
+        self.assertEqual(p.returncode, 0)
+        self.assertEqual(p.stdout, b'out\n')
+        self.assertEqual(p.stderr, b'err\n')
+        self.assertGreater(converters_cpu_time(), started)
+
+    def test_run_converter_fails_if_converter_fails(self):
+        with self.assertRaises(subprocess32.CalledProcessError) as cm:
+            run_converter([u'sh', u'-c', u'echo failed; exit 3'], timeout=60)
+        self.assertEqual(cm.exception.returncode, 3)
+        self.assertEqual(cm.exception.output, b'failed\n')
+
+    def test_run_converter_kills_converter_after_timeout(self):
+        with self.assertRaises(subprocess32.TimeoutExpired):
+            run_converter([u'sleep', u'60'], timeout=0.1)
+
+    def test_process_tree_cpu_time_of_not_running_process_is_none(self):
+        process = subprocess32.Popen([u'true'])
+        process.wait()
+        self.assertIsNone(process_tree_cpu_time(process.pid))
+
+    def test_service_writes_pid_of_started_instance(self):
+        converter = self._converter()
+        os.makedirs(converter.path)
+        with mock.patch(u'subprocess32.Popen') as popen:
+            popen.return_value.pid = 1234
+            Command()._start(converter, 0)
+        with open(converter.pid_path(0)) as f:
+            self.assertEqual(f.read(), u'1234')
+
+    def test_service_restarts_instance_failing_probe(self):
+        converter = self._converter(instances=2)
+        os.makedirs(converter.path)
+        processes = [mock.Mock(), mock.Mock()]
+        processes[0].poll.return_value = None
+        processes[1].poll.return_value = None
+        with mock.patch.object(converter, u'probe', side_effect=[True, False]) as probe:
+            with mock.patch(u'subprocess32.Popen') as popen:
+                Command()._check(converter, processes, probe_timeout=5)
+        self.assertEqual(probe.mock_calls, [mock.call(0, 5), mock.call(1, 5)])
+        self.assertEqual(popen.call_count, 1)
+        self.assertEqual(popen.call_args[0][0], converter.args(1))
+
+    def test_service_restarts_exited_and_stuck_instances(self):
+        converter = self._converter(instances=3)
+        os.makedirs(converter.path)
+        open(converter.restart_marker_path(2), u'a').close()
+        processes = [mock.Mock(), mock.Mock(), mock.Mock()]
+        processes[0].poll.return_value = 1
+        processes[1].poll.return_value = None
+        processes[2].poll.return_value = None
+        stuck = processes[2]
+        with mock.patch(u'subprocess32.Popen') as popen:
+            Command()._check(converter, processes)
+        self.assertEqual(popen.call_count, 2)
+        self.assertEqual(popen.call_args_list[0][0][0], converter.args(0))
+        self.assertEqual(popen.call_args_list[1][0][0], converter.args(2))
+        self.assertEqual(stuck.terminate.call_count, 1)
+        self.assertFalse(os.path.exists(converter.restart_marker_path(2)))
+
+    def test_service_fails_if_libreoffice_is_mocked(self):
+        with self.settings(MOCK_LIBREOFFICE=True):
+            with self.assertRaisesMessage(Exception, u'LibreOffice is mocked'):
+                call_command(u'libreoffice_service')
@@ -0,0 +1,59 @@
+from django.test import TestCase
+
+from chcemvediet.apps.anonymization.models import AttachmentNormalization, AttachmentRecognition
+from chcemvediet.apps.anonymization.normalization import normalize_attachment
+from chcemvediet.apps.anonymization.recognition import recognize_attachment
+from chcemvediet.apps.anonymization import content_types
+from chcemvediet.apps.anonymization.tests import AnonymizationTestCaseMixin
+
+
+class DeduplicationTest(AnonymizationTestCaseMixin, TestCase):
+
+    def _create_attachment(self, **kwargs):
+        return super(DeduplicationTest, self)._create_attachment(generic_object=self.action,
+                **kwargs)
+
+    def _normalize(self, attachment):
+        normalize_attachment(attachment)
+        return AttachmentNormalization.objects.get(attachment=attachment)
+
+    def _recognize(self, attachment):
+        recognize_attachment(self._normalize(attachment))
+        return AttachmentRecognition.objects.get(attachment=attachment)
+
+
+    def test_normalization_is_reused_for_the_same_content(self):
+        original = self._normalize(self._create_attachment(content=u'Content'))
+        normalization = self._normalize(self._create_attachment(content=u'Content'))
+        self.assertTrue(normalization.successful)
+        self.assertEqual(normalization.content_type, content_types.PDF_CONTENT_TYPE)
+        self.assertEqual(normalization.content, original.content)
+        self.assertEqual(normalization.debug, u'Reused normalization {} of an attachment with '
+                u'the same content.'.format(original))
+
+    def test_normalization_is_not_reused_for_other_content(self):
+        self._normalize(self._create_attachment(content=u'Content'))
+        normalization = self._normalize(self._create_attachment(content=u'Other'))
+        self.assertNotIn(u'Reused', normalization.debug)
+
+    def test_failed_normalization_is_not_reused(self):
+        attachment = self._create_attachment(content=u'Content')
+        AttachmentNormalization.objects.create(attachment=attachment, successful=False)
+        normalization = self._normalize(self._create_attachment(content=u'Content'))
+        self.assertTrue(normalization.successful)
+        self.assertNotIn(u'Reused', normalization.debug)
+
+    def test_recognition_is_reused_for_the_same_content(self):
+        original = self._recognize(self._create_attachment(content=u'Content'))
+        recognition = self._recognize(self._create_attachment(content=u'Content'))
+        self.assertTrue(recognition.successful)
+        self.assertEqual(recognition.content, original.content)
+        self.assertEqual(recognition.debug, u'Reused recognition {} of an attachment with '
+                u'the same content.'.format(original))
+
+    def test_reused_recognition_keeps_extracted_text(self):
+        original = self._recognize(self._create_attachment(content=u'Content'))
+        original.text = u'Recognized text'
+        original.save(update_fields=[u'text'])
+        recognition = self._recognize(self._create_attachment(content=u'Content'))
+        self.assertEqual(recognition.text, u'Recognized text')
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from django.core.management import call_command
+from django.test import TestCase
+
+from poleno.utils.misc import collect_stdout
+from chcemvediet.apps.anonymization.anonymization import compile_user_pattern, compile_user_regex
+from chcemvediet.apps.anonymization.matcher import Automaton
+
+
+class AutomatonTest(TestCase):
+
+    def test_finds_all_overlapping_occurrences(self):
+        automaton = Automaton([u'he', u'she', u'his', u'hers'])
+        self.assertItemsEqual(list(automaton.finditer(u'ushers')), [(1, 4), (2, 4), (2, 6)])
+
+    def test_empty_automaton(self):
+        automaton = Automaton([])
+        self.assertFalse(automaton)
+        self.assertEqual(list(automaton.finditer(u'text')), [])
+
+class MatcherTest(TestCase):
+
+    def _sub(self, text, words=(), numbers=(), match_subwords=False):
+        prog = compile_user_pattern.__wrapped__(
+                frozenset(words), frozenset(numbers), match_subwords)
+        return prog.sub(u'xxx', text)
+
+
+    def test_accent_and_case_insensitive(self):
+        self.assertEqual(self._sub(u'Ján, JAN a jän.', words=[u'jan']), u'xxx, xxx a xxx.')
+
+    def test_word_boundaries(self):
+        self.assertEqual(self._sub(u'Novák Nováková', words=[u'Novák']), u'xxx Nováková')
+        self.assertEqual(self._sub(u'Novák Nováková', words=[u'Novák'], match_subwords=True),
+                u'xxx xxxová')
+
+    def test_optional_separators_in_subwords(self):
+        self.assertEqual(self._sub(u'Hlavná-ulica Hlavnáulica', words=[u'Hlavná-ulica'],
+                match_subwords=True), u'xxx xxx')
+        self.assertEqual(self._sub(u'Hlavná-ulica Hlavnáulica', words=[u'Hlavná-ulica']),
+                u'xxx Hlavnáulica')
+
+    def test_optional_separators_must_be_in_their_places(self):
+        self.assertEqual(self._sub(u'a.b-c a-b.c ab-c ab.c abc a b c', words=[u'a.b-c'],
+                match_subwords=True), u'xxx a-b.c xxx ab.c xxx a b c')
+
+    def test_separator_heavy_subword_does_not_multiply_keys(self):
+        word = u'-'.join(u'ab' for i in range(40))
+        prog = compile_user_pattern.__wrapped__(frozenset([word]), frozenset(), True)
+        self.assertEqual(len(prog.words.goto), 81)
+        self.assertEqual(prog.sub(u'xxx', u'<{}>'.format(word)), u'<xxx>')
+        self.assertEqual(prog.sub(u'xxx', u'<{}>'.format(word.replace(u'-', u''))), u'<xxx>')
+        self.assertEqual(prog.sub(u'xxx', u'<{}>'.format(word.replace(u'-', u' '))),
+                u'<{}>'.format(word.replace(u'-', u' ')))
+
+    def test_numbers_with_separators(self):
+        text = u'PSČ 811 01, 81101, 8-1-1-0-1, 811  01'
+        self.assertEqual(self._sub(text, numbers=[u'811 01']), u'PSČ xxx, xxx, xxx, 811  01')
+
+    def test_longest_match_wins(self):
+        self.assertEqual(self._sub(u'Ján Novák Kováč', words=[u'Ján', u'Ján Novák']), u'xxx Kováč')
+
+    def test_empty_matcher_is_false(self):
+        self.assertFalse(compile_user_pattern.__wrapped__(frozenset([u'ab']), frozenset(), False))
+
+    def test_same_results_as_regex(self):
+        text = (u'Ján Nováková, Hlavná 12, Hlavná12, 811 01 Bratislava; jan.novak@example.com, '
+                u'Námestie-SNP, Námestie SNP, NámestieSNP')
+        for match_subwords in [False, True]:
+            args = (frozenset([u'Ján', u'Novák', u'Hlavná 12', u'Bratislava', u'Námestie-SNP']),
+                    frozenset([u'81101']), match_subwords)
+            self.assertEqual(compile_user_pattern.__wrapped__(*args).sub(u'xxx', text),
+                    compile_user_regex(*args).sub(u'xxx', text))
+
+    def test_more_strings_than_regex_groups_limit(self):
+        words = [u'word{:03d}'.format(i) for i in range(150)]
+        self.assertEqual(self._sub(u'word149 word150', words=words), u'xxx word150')
+
+class AnonymizationBenchmarkCommandTest(TestCase):
+
+    def test_command(self):
+        with collect_stdout() as output:
+            call_command(u'anonymization_benchmark', size=4, strings=8, repeat=1)
+        self.assertIn(u'regex', output.stdout)
+        self.assertIn(u'matcher', output.stdout)
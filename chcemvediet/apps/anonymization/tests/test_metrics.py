@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from chcemvediet.apps.anonymization.metrics import stage_metrics
+from chcemvediet.apps.anonymization.models import AttachmentNormalization, AttachmentFinalization
+from chcemvediet.apps.anonymization.pipeline import PipelineRunner
+from chcemvediet.apps.anonymization.tests import AnonymizationTestCaseMixin
+
+
+class StageMetricsTest(AnonymizationTestCaseMixin, TestCase):
+
+    def _create_attachment(self, **kwargs):
+        kwargs.setdefault(u'generic_object', self.action)
+        kwargs.setdefault(u'content', u'%PDF-1.4\n%%EOF\n')
+        kwargs.setdefault(u'name', u'filename.pdf')
+        return super(StageMetricsTest, self)._create_attachment(**kwargs)
+
+    def _metrics(self):
+        return {m[u'name']: m for m in stage_metrics()}
+
+
+    def test_metrics_are_recorded_on_stage_results(self):
+        attachment = self._create_attachment()
+        PipelineRunner().run()
+        normalization = AttachmentNormalization.objects.get(attachment=attachment)
+        self.assertIsNotNone(normalization.duration)
+        self.assertIsNotNone(normalization.cpu_time)
+        self.assertEqual(normalization.input_size, attachment.size)
+        finalization = AttachmentFinalization.objects.get(attachment=attachment)
+        self.assertIsNotNone(finalization.duration)
+        self.assertIsNotNone(finalization.input_size)
+
+    def test_results_are_aggregated(self):
+        self._create_attachment()
+        self._create_attachment(content=b'\x00\x01\x02\x03', name=u'filename')
+        PipelineRunner().run()
+        metrics = self._metrics()
+        self.assertEqual(metrics[u'normalization'][u'count'], 2)
+        self.assertEqual(metrics[u'normalization'][u'successful'], 1)
+        self.assertEqual(metrics[u'normalization'][u'success_rate'], 0.5)
+        self.assertEqual(metrics[u'finalization'][u'count'], 1)
+        self.assertIsNotNone(metrics[u'finalization'][u'duration_avg'])
+
+    def test_queue_depth(self):
+        self._create_attachment()
+        self._create_attachment()
+        PipelineRunner(batch_size=1).run()
+        metrics = self._metrics()
+        self.assertEqual(metrics[u'normalization'][u'waiting'], 1)
+        self.assertEqual(metrics[u'normalization'][u'claimed'], 0)
+        self.assertEqual(metrics[u'recognition'][u'waiting'], 0)
+
+    def test_empty_stages(self):
+        metrics = self._metrics()
+        self.assertEqual(metrics[u'recognition'][u'count'], 0)
+        self.assertIsNone(metrics[u'recognition'][u'success_rate'])
+        self.assertIsNone(metrics[u'recognition'][u'duration_avg'])
+
+    def test_report_command(self):
+        self._create_attachment()
+        PipelineRunner().run()
+        stdout = StringIO()
+        call_command(u'anonymization_report', stdout=stdout)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(lines[1].startswith(u'normalization'))
+
+    def test_admin_dashboard(self):
+        user = self._create_user()
+        user.is_staff = True
+        user.is_superuser = True
+        user.save()
+        self.assertTrue(self.client.login(username=user.username,
+                password=u'default_testing_secret'))
+        response = self.client.get(reverse(u'admin:anonymization_metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, u'anonymization/admin/metrics.html')
@@ -0,0 +1,215 @@
+import datetime
+
+import mock
+from django.db import connection
+from django.test import TestCase
+
+from poleno.utils.date import utc_now
+from chcemvediet.apps.anonymization.models import (AttachmentNormalization,
+        AttachmentFinalization, PipelineState)
+from chcemvediet.apps.anonymization.normalization import attachment_to_normalize
+from chcemvediet.apps.anonymization.pipeline import (PipelineRunner, Stage, STAGES,
+        enqueue_attachments, datachecks, _init_pool_worker, _process_in_pool)
+from chcemvediet.apps.anonymization.utils import add_converters_cpu_time
+from chcemvediet.apps.anonymization.tests import AnonymizationTestCaseMixin
+
+
+class PipelineRunnerTest(AnonymizationTestCaseMixin, TestCase):
+
+    def _create_attachment(self, **kwargs):
+        kwargs.setdefault(u'generic_object', self.action)
+        kwargs.setdefault(u'content', u'%PDF-1.4\n%%EOF\n')
+        kwargs.setdefault(u'name', u'filename.pdf')
+        return super(PipelineRunnerTest, self)._create_attachment(**kwargs)
+
+
+    def test_every_stage_processes_a_batch_of_items(self):
+        attachments = [self._create_attachment() for i in range(3)]
+        with self.settings(MOCK_LIBREOFFICE=True, MOCK_OCR=True):
+            PipelineRunner(batch_size=2, workers=1).run()
+        self.assertItemsEqual(
+                [n.attachment for n in AttachmentNormalization.objects.all()], attachments[:2])
+        self.assertItemsEqual(
+                [f.attachment for f in AttachmentFinalization.objects.all()], attachments[:2])
+
+    def test_exhausted_time_budget_processes_nothing(self):
+        self._create_attachment()
+        PipelineRunner(time_budget=0).run()
+        self.assertFalse(AttachmentNormalization.objects.exists())
+
+    def test_item_claimed_meanwhile_is_skipped(self):
+        attachments = [self._create_attachment() for i in range(2)]
+        def process(attachment):
+            # Simulates another runner claiming the second attachment meanwhile.
+            AttachmentNormalization.objects.create(attachment=attachment, successful=False)
+            PipelineState.objects.filter(attachment=attachments[1]).update(
+                    status=PipelineState.STATUSES.CLAIMED, claimed_at=utc_now())
+        process = mock.Mock(side_effect=process)
+        stage = Stage(u'testing', PipelineState.STAGES.NORMALIZATION, attachment_to_normalize,
+                process)
+        processed = PipelineRunner(stages=[stage]).run_stage(stage)
+        self.assertEqual(processed, attachments[:1])
+        self.assertEqual(process.mock_calls, [mock.call(attachments[0])])
+
+    def test_item_is_processed_outside_transaction(self):
+        attachment = self._create_attachment()
+        def process(attachment):
+            # The test itself runs in a transaction, the runner must not open a savepoint within it.
+            self.assertEqual(connection.savepoint_ids, [])
+            # The claim is committed before the item is processed.
+            self.assertEqual(PipelineState.objects.get(attachment=attachment).status,
+                    PipelineState.STATUSES.CLAIMED)
+            AttachmentNormalization.objects.create(attachment=attachment, successful=False)
+        process = mock.Mock(side_effect=process)
+        stage = Stage(u'testing', PipelineState.STAGES.NORMALIZATION, attachment_to_normalize,
+                process, AttachmentNormalization)
+        processed = PipelineRunner(stages=[stage]).run_stage(stage)
+        self.assertEqual(processed, [attachment])
+        self.assertEqual(process.call_count, 1)
+        self.assertIsNotNone(AttachmentNormalization.objects.get(attachment=attachment).duration)
+
+    def test_cpu_time_includes_converters_run_for_item(self):
+        attachment = self._create_attachment()
+        def process(attachment):
+            add_converters_cpu_time(10.0)
+            AttachmentNormalization.objects.create(attachment=attachment, successful=False)
+        stage = Stage(u'testing', PipelineState.STAGES.NORMALIZATION, attachment_to_normalize,
+                process, AttachmentNormalization)
+        PipelineRunner(stages=[stage]).run_stage(stage)
+        self.assertGreaterEqual(AttachmentNormalization.objects.get(attachment=attachment).cpu_time,
+                10.0)
+
+    def test_item_with_stored_result_is_advanced_without_processing(self):
+        attachment = self._create_attachment()
+        # Simulates a worker crashed after the stage stored its result.
+        AttachmentNormalization.objects.create(attachment=attachment, successful=False)
+        PipelineState.objects.update(status=PipelineState.STATUSES.CLAIMED,
+                claimed_at=utc_now() - datetime.timedelta(hours=2), worker=u'crashed')
+        process = mock.Mock()
+        stage = Stage(u'testing', PipelineState.STAGES.NORMALIZATION, attachment_to_normalize,
+                process)
+        PipelineRunner(stages=[stage]).run_stage(stage)
+        self.assertFalse(process.called)
+        self.assertEqual(PipelineState.objects.get(attachment=attachment).status,
+                PipelineState.STATUSES.DONE)
+
+    def test_cpu_bound_stage_is_processed_over_worker_processes(self):
+        stage = Stage(u'testing', PipelineState.STAGES.ANONYMIZATION, mock.Mock(), mock.Mock(),
+                cpu_bound=True)
+        self._create_attachment()
+        self._create_attachment()
+        PipelineState.objects.update(stage=PipelineState.STAGES.ANONYMIZATION)
+        runner = PipelineRunner(stages=[stage], workers=2)
+        with mock.patch.object(runner, u'_work_in_processes') as work_in_processes:
+            with mock.patch(u'chcemvediet.apps.anonymization.pipeline.threading') as threading:
+                runner.run_stage(stage)
+        self.assertEqual(work_in_processes.call_count, 1)
+        self.assertFalse(threading.Thread.called)
+
+    def test_anonymization_is_the_only_cpu_bound_stage(self):
+        self.assertEqual([s.name for s in STAGES if s.cpu_bound], [u'anonymization'])
+
+    def test_worker_process_processes_item(self):
+        attachment = self._create_attachment()
+        state = PipelineState.objects.get(attachment=attachment)
+        runner = PipelineRunner()
+        _init_pool_worker(runner)
+        with self.settings(MOCK_LIBREOFFICE=True):
+            item = _process_in_pool((0, state.pk, None))
+        self.assertEqual(item, attachment)
+        self.assertTrue(AttachmentNormalization.objects.filter(attachment=attachment).exists())
+
+    def test_worker_process_takes_no_item_after_deadline(self):
+        attachment = self._create_attachment()
+        state = PipelineState.objects.get(attachment=attachment)
+        _init_pool_worker(PipelineRunner())
+        self.assertIsNone(_process_in_pool((0, state.pk, 0)))
+        self.assertFalse(AttachmentNormalization.objects.filter(attachment=attachment).exists())
+
+    def test_action_attachment_is_enqueued_when_created(self):
+        attachment = self._create_attachment()
+        self._create_attachment(generic_object=self.user)
+        state = PipelineState.objects.get()
+        self.assertEqual(state.attachment, attachment)
+        self.assertEqual(state.stage, PipelineState.STAGES.NORMALIZATION)
+        self.assertEqual(state.status, PipelineState.STATUSES.WAITING)
+
+    def test_run_does_not_look_for_new_attachments(self):
+        with mock.patch(u'chcemvediet.apps.anonymization.pipeline.enqueue_attachments') as enqueue:
+            PipelineRunner().run()
+        self.assertFalse(enqueue.called)
+
+    def test_enqueue_attachments_adds_attachments_attached_to_actions_later(self):
+        attachment = self._create_attachment(generic_object=self.user)
+        attachment.generic_object = self.action
+        attachment.save()
+        self.assertEqual(enqueue_attachments(), 1)
+        self.assertEqual(enqueue_attachments(), 0)
+        self.assertEqual(PipelineState.objects.get().attachment, attachment)
+
+    def test_datacheck_fixes_attachments_missing_in_pipeline(self):
+        attachment = self._create_attachment()
+        self.assertEqual(list(datachecks(superficial=False, autofix=False)), [])
+        PipelineState.objects.all().delete()
+        issues = list(datachecks(superficial=False, autofix=False))
+        self.assertEqual([i.msg for i in issues],
+                [u'1 action attachments are not in the anonymization pipeline.'])
+        self.assertFalse(PipelineState.objects.exists())
+        list(datachecks(superficial=False, autofix=True))
+        self.assertEqual(PipelineState.objects.get().attachment, attachment)
+
+    def test_failed_item_is_released_and_batch_goes_on(self):
+        attachments = [self._create_attachment() for i in range(2)]
+        def process(attachment):
+            if attachment == attachments[0]:
+                raise ValueError(u'Testing failure')
+            AttachmentNormalization.objects.create(attachment=attachment, successful=False)
+        process = mock.Mock(side_effect=process)
+        stage = Stage(u'testing', PipelineState.STAGES.NORMALIZATION, attachment_to_normalize,
+                process)
+        with mock.patch(u'chcemvediet.apps.anonymization.pipeline.cron_logger') as logger:
+            processed = PipelineRunner(stages=[stage]).run_stage(stage)
+        self.assertEqual(processed, attachments[1:])
+        self.assertEqual(process.call_count, 2)
+        self.assertRegexpMatches(logger.error.call_args[0][0], u'failed to process item')
+        state = PipelineState.objects.get(attachment=attachments[0])
+        self.assertEqual(state.status, PipelineState.STATUSES.WAITING)
+        self.assertEqual(state.worker, u'')
+        self.assertIsNone(state.claimed_at)
+        self.assertEqual(PipelineState.objects.get(attachment=attachments[1]).status,
+                PipelineState.STATUSES.DONE)
+
+    def test_state_advances_through_all_stages(self):
+        attachment = self._create_attachment()
+        PipelineRunner().run()
+        state = PipelineState.objects.get(attachment=attachment)
+        self.assertEqual(state.stage, PipelineState.STAGES.FINALIZATION)
+        self.assertEqual(state.status, PipelineState.STATUSES.DONE)
+        self.assertEqual(state.worker, u'')
+        self.assertIsNone(state.claimed_at)
+
+    def test_state_is_done_after_failed_stage(self):
+        attachment = self._create_attachment(content=b'\x00\x01\x02\x03', name=u'filename')
+        PipelineRunner().run()
+        state = PipelineState.objects.get(attachment=attachment)
+        self.assertEqual(state.stage, PipelineState.STAGES.NORMALIZATION)
+        self.assertEqual(state.status, PipelineState.STATUSES.DONE)
+        self.assertFalse(AttachmentNormalization.objects.get(attachment=attachment).successful)
+
+    def test_abandoned_claim_is_released(self):
+        attachment = self._create_attachment()
+        PipelineState.objects.update(status=PipelineState.STATUSES.CLAIMED,
+                claimed_at=utc_now() - datetime.timedelta(hours=2), worker=u'crashed')
+        PipelineRunner().run()
+        state = PipelineState.objects.get(attachment=attachment)
+        self.assertEqual(state.status, PipelineState.STATUSES.DONE)
+        self.assertTrue(AttachmentFinalization.objects.filter(attachment=attachment).exists())
+
+    def test_recent_claim_is_not_released(self):
+        attachment = self._create_attachment()
+        PipelineState.objects.update(status=PipelineState.STATUSES.CLAIMED,
+                claimed_at=utc_now(), worker=u'busy')
+        PipelineRunner().run()
+        state = PipelineState.objects.get(attachment=attachment)
+        self.assertEqual(state.status, PipelineState.STATUSES.CLAIMED)
+        self.assertFalse(AttachmentNormalization.objects.filter(attachment=attachment).exists())
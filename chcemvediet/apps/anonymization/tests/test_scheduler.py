@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from django.test import TestCase
+
+from poleno.utils.date import local_today, local_datetime_from_local
+from chcemvediet.apps.inforequests.constants import DAYS_TO_CLOSE_INFOREQUEST
+from chcemvediet.apps.inforequests.models import Action
+from chcemvediet.apps.anonymization.models import AttachmentNormalization, PipelineState
+from chcemvediet.apps.anonymization.pipeline import PipelineRunner, STAGES
+from chcemvediet.apps.anonymization.scheduler import (expected_publication_date,
+        schedule_attachments)
+from chcemvediet.apps.anonymization.tests import AnonymizationTestCaseMixin
+
+
+class SchedulerTest(AnonymizationTestCaseMixin, TestCase):
+
+    def _create_inforequest_with_action(self, **kwargs):
+        inforequest = self._create_inforequest(**kwargs)
+        branch = self._create_branch(inforequest=inforequest)
+        action = self._create_action(branch=branch)
+        return inforequest, action
+
+    def _create_attachment(self, action):
+        return super(SchedulerTest, self)._create_attachment(generic_object=action,
+                content=u'%PDF-1.4\n%%EOF\n', name=u'filename.pdf')
+
+
+    def test_branch_with_deadline_is_published_after_deadline_is_missed(self):
+        inforequest, action = self._create_inforequest_with_action()
+        days = DAYS_TO_CLOSE_INFOREQUEST + self.user.profile.days_to_publish_inforequest
+        self.assertEqual(expected_publication_date(inforequest),
+                action.deadline.snooze_date + datetime.timedelta(days=days))
+
+    def test_branch_without_deadline_is_published_after_last_action(self):
+        inforequest = self._create_inforequest()
+        branch = self._create_branch(inforequest=inforequest)
+        self._create_action(branch=branch, type=Action.TYPES.ADVANCEMENT,
+                created=local_datetime_from_local(u'2010-10-05 10:33:00'))
+        days = self.user.profile.days_to_publish_inforequest
+        self.assertEqual(expected_publication_date(inforequest),
+                datetime.date(2010, 10, 5) + datetime.timedelta(days=days))
+
+    def test_inforequest_never_published_is_never_due(self):
+        inforequest, _ = self._create_inforequest_with_action(published=False)
+        self.assertEqual(expected_publication_date(inforequest), PipelineState.NEVER)
+
+    def test_published_inforequest_is_due_today_at_the_latest(self):
+        inforequest, _ = self._create_inforequest_with_action(published=True)
+        self.assertEqual(expected_publication_date(inforequest), local_today())
+
+    def test_created_attachments_are_scheduled(self):
+        inforequest, action = self._create_inforequest_with_action(published=True)
+        attachment = self._create_attachment(action)
+        state = PipelineState.objects.get(attachment=attachment)
+        self.assertEqual(state.due_date, local_today())
+        self.assertFalse(state.unpublished)
+
+    def test_done_attachments_are_not_rescheduled(self):
+        inforequest, action = self._create_inforequest_with_action(published=True)
+        attachment = self._create_attachment(action)
+        PipelineState.objects.filter(attachment=attachment).update(
+                stage=PipelineState.STAGES.FINALIZATION, status=PipelineState.STATUSES.DONE,
+                due_date=PipelineState.NEVER)
+        self.assertEqual(schedule_attachments(), 0)
+        state = PipelineState.objects.get(attachment=attachment)
+        self.assertEqual(state.due_date, PipelineState.NEVER)
+
+    def test_urgent_attachments_are_processed_first(self):
+        _, action1 = self._create_inforequest_with_action(published=False)
+        _, action2 = self._create_inforequest_with_action()
+        _, action3 = self._create_inforequest_with_action(published=True)
+        attachment1 = self._create_attachment(action1)
+        attachment2 = self._create_attachment(action2)
+        attachment3 = self._create_attachment(action3)
+        runner = PipelineRunner(batch_size=1)
+        self.assertEqual(runner.run_stage(STAGES[0]), [attachment3])
+        self.assertEqual(runner.run_stage(STAGES[0]), [attachment2])
+        self.assertEqual(runner.run_stage(STAGES[0]), [attachment1])
+        self.assertEqual(AttachmentNormalization.objects.count(), 3)
@@ -1,7 +1,11 @@
+import os
 import tempfile
 import shutil
+import threading
 from contextlib import contextmanager
 
+import subprocess32
+
 
 @contextmanager
 def temporary_directory(*args, **kwargs):
@@ -10,3 +14,99 @@ def temporary_directory(*args, **kwargs):
         yield directory_name
     finally:
         shutil.rmtree(directory_name)
+
+def copy_content(obj, filename):
+    u"""
+    Copies the content of Attachment (or Attachment like) object to ``filename``, so external
+    programs can convert it. Files in local storage are copied directly, other files are copied
+    chunk by chunk.
+    """
+    path = obj.content_path
+    if path is not None:
+        shutil.copy2(path, filename)
+        return
+    with open(filename, u'wb') as file:
+        for chunk in obj.content_chunks():
+            file.write(chunk)
+
+_converters = threading.local()
+
+def converters_cpu_time():
+    u"""
+    Returns CPU time consumed so far by external converters run by the calling thread in seconds.
+    """
+    return getattr(_converters, u'cpu_time', 0.0)
+
+def add_converters_cpu_time(seconds):
+    _converters.cpu_time = converters_cpu_time() + seconds
+
+def run_converter(args, timeout):
+    u"""
+    Runs an external converter like ``subprocess32.run(args, stdout=PIPE, stderr=PIPE,
+    timeout=timeout, check=True)`` and adds its CPU time to ``converters_cpu_time()`` of the
+    calling thread. The converter is reaped with ``os.wait4()``, which returns the resource usage
+    of the converter itself, so converters run concurrently by other threads don't mix. Its
+    output is buffered in temporary files, so the calling thread only waits for it to exit.
+    """
+    with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+        process = subprocess32.Popen(args, stdout=stdout, stderr=stderr)
+        expired = []
+        def kill():
+            # Only a process not reaped yet is killed, so its pid can't be reused by another one.
+            if process.returncode is None:
+                expired.append(True)
+                process.kill()
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+        try:
+            pid, status, usage = os.wait4(process.pid, 0)
+            process.returncode = (-os.WTERMSIG(status) if os.WIFSIGNALED(status)
+                    else os.WEXITSTATUS(status))
+        finally:
+            timer.cancel()
+        add_converters_cpu_time(usage.ru_utime + usage.ru_stime)
+        stdout.seek(0)
+        stderr.seek(0)
+        output = stdout.read()
+        errors = stderr.read()
+    if expired:
+        raise subprocess32.TimeoutExpired(args, timeout, output=output, stderr=errors)
+    if process.returncode:
+        raise subprocess32.CalledProcessError(process.returncode, args, output=output,
+                stderr=errors)
+    return subprocess32.CompletedProcess(args, process.returncode, stdout=output, stderr=errors)
+
+def process_tree_cpu_time(pid):
+    u"""
+    Returns CPU time consumed so far by the running process ``pid`` and all its running
+    descendants in seconds, read from ``/proc``. Returns None if the process is not running or the
+    platform has no ``/proc``.
+    """
+    try:
+        names = os.listdir(u'/proc')
+    except OSError:
+        return None
+    parents = {}
+    times = {}
+    for name in names:
+        if not name.isdigit():
+            continue
+        try:
+            with open(os.path.join(u'/proc', name, u'stat'), u'rb') as f:
+                stat = f.read()
+        except IOError:
+            # The process exited meanwhile.
+            continue
+        # The command name may contain spaces and parentheses, fields after it are plain numbers.
+        fields = stat.rsplit(b')', 1)[1].split()
+        parents[int(name)] = int(fields[1])
+        times[int(name)] = int(fields[11]) + int(fields[12])
+    if pid not in times:
+        return None
+    tree = set([pid])
+    grown = True
+    while grown:
+        children = set(p for p, parent in parents.items() if parent in tree) - tree
+        grown = bool(children)
+        tree |= children
+    return float(sum(times[p] for p in tree)) / os.sysconf(b'SC_CLK_TCK')
@@ -8,6 +8,7 @@ from django.utils.translation import ugettext_lazy as _
 from django.contrib.sessions.models import Session
 
 from poleno.attachments.forms import AttachmentsField
+from poleno.mail.models import Message
 from poleno.utils.models import after_saved
 from poleno.utils.urls import reverse
 from poleno.utils.mail import render_mail
@@ -1216,7 +1217,7 @@ class ObligeeActionWizard(Wizard):
         msg = render_mail(u'inforequests/mails/obligee_action_help_request',
                           from_email=settings.DEFAULT_FROM_EMAIL,
                           to=[settings.SUPPORT_EMAIL],
-                          attachments=[(a.name, a.content, a.content_type)
+                          attachments=[(a.name, a, a.content_type)
                                        for a in self.values[u'attachments'] or []],
                           dictionary={
                               u'wizard': self,
@@ -1224,6 +1225,7 @@ class ObligeeActionWizard(Wizard):
                               u'email': self.email,
                           },
                           )
+        msg.priority = Message.PRIORITIES.HIGH
         msg.send()
 
         if self.email:
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inforequests', '0024_feedback_rating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inforequest',
+            name='unique_email_key',
+            field=models.CharField(help_text='Lowercase unique email used to match inbound emails case insensitive.', max_length=255, null=True, editable=False),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,25 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def forward(apps, schema_editor):
+    Inforequest = apps.get_model(u'inforequests', u'Inforequest')
+    for inforequest in Inforequest.objects.all():
+        inforequest.unique_email_key = inforequest.unique_email.lower()
+        inforequest.save()
+
+def backward(apps, schema_editor):
+    pass
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inforequests', '0025_inforequest_unique_email_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, backward),
+    ]
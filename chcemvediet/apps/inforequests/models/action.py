@@ -13,6 +13,7 @@ from multiselectfield import MultiSelectField
 
 from poleno import datacheck
 from poleno.attachments.models import Attachment
+from poleno.mail.models import Message
 from poleno.workdays import workdays
 from poleno.utils.models import FieldChoices, QuerySet, join_lookup, after_saved
 from poleno.utils.date import utc_now, local_today
@@ -510,7 +511,9 @@ class Action(FormatMixin, models.Model):
 
         msg = EmailMessage(self.subject, self.content, sender_formatted, recipients)
         for attachment in self.attachments:
-            msg.attach(attachment.name, attachment.content, attachment.content_type)
+            msg.attach(attachment.name, attachment, attachment.content_type)
+        # Requests and appeals have legal deadlines
+        msg.priority = Message.PRIORITIES.URGENT
         msg.send()
 
         inforequestemail = InforequestEmail(
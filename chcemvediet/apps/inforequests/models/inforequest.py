@@ -19,6 +19,35 @@ from poleno.utils.misc import random_readable_string, squeeze, decorate, slugify
 
 
 class InforequestQuerySet(QuerySet):
+    def route(self, messages):
+        u"""
+        Resolves inforequests the given inbound messages belong to using a single query. A message
+        belongs to the inforequest with ``unique_email`` the message was received for. If we don't
+        know the address the message was received for, we match the inforequest against message
+        recipients. Addresses are matched case insensitive. Returns a dict mapping messages to
+        their inforequests. Messages matching no inforequest or more than one inforequest are
+        omitted. Message recipients should be prefetched with
+        ``prefetch_related(Message.prefetch_recipients())`` before routing many messages.
+        """
+        keys = {}
+        for message in messages:
+            if message.received_for:
+                keys[message] = {message.received_for.lower()}
+            else:
+                keys[message] = {r.mail.lower() for r in message.recipients}
+
+        addresses = set.union(set(), *keys.values())
+        if not addresses:
+            return {}
+        inforequests = self.filter(unique_email_key__in=addresses)
+        inforequests = {ir.unique_email_key: ir for ir in inforequests}
+
+        res = {}
+        for message, message_keys in keys.items():
+            matched = [inforequests[k] for k in message_keys if k in inforequests]
+            if len(matched) == 1:
+                res[message] = matched[0]
+        return res
     def owned_by(self, user):
         return self.filter(applicant=user)
     def closed(self):
@@ -106,6 +135,13 @@ class Inforequest(FormatMixin, models.Model):
                 tell them to send their response to a different email address.
                 """))
 
+    # May NOT be empty; Unique; Read-only; Automaticly computed in save() when creating a new
+    # instance. Normalized ``unique_email`` used to route inbound messages to the inforequest.
+    unique_email_key = models.CharField(max_length=255, unique=True, editable=False,
+            help_text=squeeze(u"""
+                Lowercase unique email used to match inbound emails case insensitive.
+                """))
+
     # Should NOT be empty
     subject = models.CharField(blank=True, max_length=255,
             help_text=squeeze(u"""
@@ -160,6 +196,7 @@ class Inforequest(FormatMixin, models.Model):
     # Indexes:
     #  -- applicant: ForeignKey
     #  -- unique_email: unique
+    #  -- unique_email_key: unique
     #  -- submission_date, id: index_together
 
     objects = InforequestQuerySet.as_manager()
@@ -526,6 +563,7 @@ class Inforequest(FormatMixin, models.Model):
             while True:
                 token = random_readable_string(length)
                 self.unique_email = settings.INFOREQUEST_UNIQUE_EMAIL.format(token=token)
+                self.unique_email_key = self.unique_email.lower()
                 try:
                     with transaction.atomic():
                         super(Inforequest, self).save(*args, **kwargs)
@@ -534,6 +572,7 @@ class Inforequest(FormatMixin, models.Model):
                     if length <= 10:
                         continue
                     self.unique_email = None
+                    self.unique_email_key = None
                     raise # Give up
                 return # object is already saved
 
@@ -542,7 +581,7 @@ class Inforequest(FormatMixin, models.Model):
     def get_absolute_url(self, anchor=u''):
         return reverse(u'inforequests:detail', kwargs=dict(inforequest=self)) + anchor
 
-    def _send_notification(self, template, anchor, dictionary):
+    def _send_notification(self, template, anchor, dictionary, priority=Message.PRIORITIES.NORMAL):
         dictionary.update({
                 u'inforequest': self,
                 u'url': complete_url(reverse(u'account_login')) + u'?' + urlencode({
@@ -553,16 +592,17 @@ class Inforequest(FormatMixin, models.Model):
                 from_email=settings.DEFAULT_FROM_EMAIL,
                 to=[self.applicant.email],
                 dictionary=dictionary)
+        msg.priority = priority
         msg.send()
 
     def send_received_email_notification(self, email):
         self._send_notification(u'inforequests/mails/received_email_notification', u'', {
                 u'email': email,
-                })
+                }, priority=Message.PRIORITIES.HIGH)
 
     def send_undecided_email_reminder(self):
         self._send_notification(u'inforequests/mails/undecided_email_reminder', u'', {
-                })
+                }, priority=Message.PRIORITIES.LOW)
 
         self.last_undecided_email_reminder = utc_now()
         self.save(update_fields=[u'last_undecided_email_reminder'])
@@ -571,7 +611,7 @@ class Inforequest(FormatMixin, models.Model):
         self._send_notification(
                 u'inforequests/mails/obligee_deadline_reminder', u'#a{}'.format(action.pk), {
                     u'action': action,
-                    })
+                    }, priority=Message.PRIORITIES.LOW)
 
         action.last_deadline_reminder = utc_now()
         action.save(update_fields=[u'last_deadline_reminder'])
@@ -580,7 +620,7 @@ class Inforequest(FormatMixin, models.Model):
         self._send_notification(u'inforequests/mails/applicant_deadline_reminder',
                 u'#a{}'.format(action.pk), {
                     u'action': action,
-                    })
+                    }, priority=Message.PRIORITIES.LOW)
 
         action.last_deadline_reminder = utc_now()
         action.save(update_fields=[u'last_deadline_reminder'])
@@ -1,45 +1,39 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
-import operator
-
 from django.dispatch import receiver
-from django.db.models import Q
 from django.db.models.signals import post_delete
 from django.conf import settings
 from django.contrib.sessions.models import Session
 
 from poleno.attachments.models import Attachment
-from poleno.mail.signals import message_received
+from poleno.mail.signals import messages_received
 from poleno.utils.translation import translation
 
 from .models import Inforequest, InforequestEmail
 
 
-@receiver(message_received)
-def assign_email_on_message_received(sender, message, **kwargs):
-    if message.received_for:
-        q = Q(unique_email__iexact=message.received_for)
-    elif message.recipients:
-        q = (Q(unique_email__iexact=r.mail) for r in message.recipients)
-        q = reduce(operator.or_, q)
-    else:
-        return
-
-    try:
-        inforequest = Inforequest.objects.get(q)
-    except (Inforequest.DoesNotExist, Inforequest.MultipleObjectsReturned):
-        return
-
-    inforequestemail = InforequestEmail(
-            inforequest=inforequest,
-            email=message,
-            type=InforequestEmail.TYPES.UNDECIDED,
-            )
-    inforequestemail.save()
-
-    if not inforequest.closed:
-        with translation(settings.LANGUAGE_CODE):
-            inforequest.send_received_email_notification(message)
+@receiver(messages_received)
+def assign_emails_on_messages_received(sender, messages, **kwargs):
+    u"""
+    Assigns received messages to their inforequests. The whole batch of messages is routed with a
+    single query.
+    """
+    routes = Inforequest.objects.route(messages)
+    for message in messages:
+        inforequest = routes.get(message)
+        if inforequest is None:
+            continue
+
+        inforequestemail = InforequestEmail(
+                inforequest=inforequest,
+                email=message,
+                type=InforequestEmail.TYPES.UNDECIDED,
+                )
+        inforequestemail.save()
+
+        if not inforequest.closed:
+            with translation(settings.LANGUAGE_CODE):
+                inforequest.send_received_email_notification(message)
 
 @receiver(post_delete, sender=Session)
 def delete_attachments_on_session_post_delete(sender, instance, **kwargs):
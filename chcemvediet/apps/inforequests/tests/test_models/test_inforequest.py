@@ -125,6 +125,14 @@ class InforequestTest(InforequestsTestCaseMixin, TestCase):
         with self.assertRaisesMessage(AssertionError, u'Inforequest.unique_email is read-only'):
             inforequest = self._create_inforequest(unique_email=u'something@example.com')
 
+    def test_unique_email_key_field_is_lowercase_unique_email(self):
+        with self.settings(INFOREQUEST_UNIQUE_EMAIL=u'{token}@eXAMplE.coM'):
+            with mock.patch(u'chcemvediet.apps.inforequests.models.inforequest.random_readable_string', return_value=u'aAAa'):
+                inforequest = self._create_inforequest()
+        inforequest = Inforequest.objects.get(pk=inforequest.pk)
+        self.assertEqual(inforequest.unique_email, u'aAAa@eXAMplE.coM')
+        self.assertEqual(inforequest.unique_email_key, u'aaaa@example.com')
+
     def test_subject_field(self):
         inforequest = self._create_inforequest(subject=u'Subject')
         self.assertEqual(inforequest.subject, u'Subject')
@@ -1151,6 +1159,28 @@ class InforequestTest(InforequestsTestCaseMixin, TestCase):
         result = Inforequest.objects.owned_by(self.user2)
         self.assertItemsEqual(result, [])
 
+    def test_route_query_method(self):
+        inforequest1 = self._create_inforequest()
+        inforequest2 = self._create_inforequest()
+        msg1 = self._create_message(received_for=inforequest1.unique_email.upper())
+        msg2 = self._create_message(omit=[u'received_for'])
+        self._create_recipient(message=msg2, mail=inforequest2.unique_email)
+        self._create_recipient(message=msg2, mail=u'other@example.com')
+        msg3 = self._create_message(received_for=u'other@example.com')
+        msg4 = self._create_message(omit=[u'received_for'])
+        self._create_recipient(message=msg4, mail=inforequest1.unique_email)
+        self._create_recipient(message=msg4, mail=inforequest2.unique_email)
+        msgs = list(Message.objects.filter(pk__in=[msg1.pk, msg2.pk, msg3.pk, msg4.pk]).prefetch_related(Message.prefetch_recipients()))
+        with self.assertNumQueries(1):
+            result = Inforequest.objects.route(msgs)
+        self.assertEqual(result, {msgs[0]: inforequest1, msgs[1]: inforequest2})
+
+    def test_route_query_method_with_no_addresses(self):
+        msg = self._create_message(omit=[u'received_for'])
+        with self.assertNumQueries(1):
+            result = Inforequest.objects.route([msg])
+        self.assertEqual(result, {})
+
     def test_closed_and_not_closed_query_methods(self):
         Inforequest.objects.all().delete()
         inforequest1 = self._create_inforequest(closed=True)
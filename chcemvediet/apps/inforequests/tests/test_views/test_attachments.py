@@ -22,7 +22,7 @@ class UploadAttachmentViewTest(CustomTestCase):
 
     def test_allowed_http_methods(self):
         url = reverse(u'inforequests:upload_attachment')
-        allowed = [u'POST']
+        allowed = [u'GET', u'POST']
         self.assert_allowed_http_methods(allowed, url)
 
     def test_non_ajax_request_returns_400_bad_request(self):
@@ -17,7 +17,8 @@ from chcemvediet.apps.anonymization.anonymization import generate_user_pattern,
 from chcemvediet.apps.anonymization.models import AttachmentFinalization
 
 
-@require_http_methods([u'POST'])
+@attachments_views.streaming_upload
+@require_http_methods([u'GET', u'POST'])
 @require_ajax
 @transaction.atomic
 @login_required(raise_exception=True)
@@ -123,6 +123,7 @@ CRON_CLASSES = (
     u'poleno.cron.cron.clear_old_cronlogs',
     u'poleno.datacheck.cron.datacheck',
     u'poleno.mail.cron.mail',
+    u'poleno.attachments.cron.clear_abandoned_uploads',
     u'chcemvediet.apps.wizards.cron.delete_old_drafts',
     u'chcemvediet.apps.inforequests.cron.undecided_email_reminder',
     u'chcemvediet.apps.inforequests.cron.obligee_deadline_reminder',
@@ -131,6 +132,7 @@ CRON_CLASSES = (
     u'chcemvediet.apps.inforequests.cron.publish_inforequests',
     u'chcemvediet.apps.inforequests.cron.add_expirations',
     u'chcemvediet.apps.anonymization.cron.anonymization',
+    u'chcemvediet.apps.anonymization.cron.anonymization_schedule',
     u'chcemvediet.cron.clear_expired_sessions',
     u'chcemvediet.cron.send_admin_error_logs',
     )
@@ -141,6 +143,17 @@ MEDIA_URL = u'/media/'
 STATIC_ROOT = os.path.join(PROJECT_PATH, u'static')
 STATIC_URL = u'/static/'
 
+# Backend used to send downloaded files, see ``poleno.utils.http.send_file_response()``. On
+# production servers with mod_xsendfile use ``poleno.utils.http.XSendfileBackend``.
+SEND_FILE_BACKEND = u'poleno.utils.http.StreamingFileBackend'
+
+# Attachment upload limits, see ``poleno.attachments.views.upload()``. Requests are limited while
+# they are streamed. Larger files must be uploaded in chunks. Partial files of chunked uploads not
+# resumed for the given number of hours are removed.
+ATTACHMENT_MAX_REQUEST_SIZE = 16*1024*1024 # 16 MB
+ATTACHMENT_MAX_FILE_SIZE = 256*1024*1024 # 256 MB
+ATTACHMENT_PARTIAL_UPLOAD_EXPIRY = 24 # hours
+
 STATICFILES_DIRS = (
     os.path.join(PROJECT_PATH, u'fontello/output/static'),
     )
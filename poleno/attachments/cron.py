@@ -0,0 +1,32 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import os
+import glob
+import time
+
+from django.conf import settings
+
+from poleno.cron import cron_job, cron_logger
+
+from .views import get_partial_upload_dir
+
+
+@cron_job(run_at_times=settings.CRON_UNIMPORTANT_MAINTENANCE_TIMES)
+def clear_abandoned_uploads():
+    u"""
+    Removes partial files of chunked uploads not resumed for more than
+    ``ATTACHMENT_PARTIAL_UPLOAD_EXPIRY`` hours.
+    """
+    expiry = getattr(settings, u'ATTACHMENT_PARTIAL_UPLOAD_EXPIRY', 24)
+    threshold = time.time() - expiry * 60 * 60
+    removed = 0
+    for path in glob.glob(os.path.join(get_partial_upload_dir(), u'attachment-*.part')):
+        try:
+            if os.path.getmtime(path) < threshold:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            # The upload was finished or removed meanwhile.
+            pass
+    if removed:
+        cron_logger.info(u'Cleared {} abandoned partial uploads.'.format(removed))
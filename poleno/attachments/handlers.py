@@ -0,0 +1,39 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import hashlib
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler, StopUpload
+
+
+class AttachmentUploadHandler(TemporaryFileUploadHandler):
+    u"""
+    Streams uploaded files to temporary files computing their sizes and content hashes on the fly,
+    so the uploaded content is never held in memory and does not need to be read again to hash
+    it. Uploaded files get ``content_hash`` attribute. Stops the upload as soon as the request
+    uploads more than ``max_size`` bytes in total and sets ``exceeded`` flag. The rest of the
+    request body is not read.
+    """
+
+    def __init__(self, request=None, max_size=None):
+        super(AttachmentUploadHandler, self).__init__(request)
+        self.max_size = max_size
+        self.received = 0
+        self.exceeded = False
+        self.digest = None
+
+    def new_file(self, *args, **kwargs):
+        super(AttachmentUploadHandler, self).new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.max_size is not None and self.received > self.max_size:
+            self.exceeded = True
+            raise StopUpload(connection_reset=True)
+        self.digest.update(raw_data)
+        return super(AttachmentUploadHandler, self).receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super(AttachmentUploadHandler, self).file_complete(file_size)
+        file.content_hash = self.digest.hexdigest()
+        return file
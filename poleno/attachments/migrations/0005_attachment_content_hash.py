@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attachments', '0004_name_sanitization'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='content_hash',
+            field=models.CharField(help_text='Hex encoded SHA-256 hash of the attachment content. Automatically computed when creating a new object. NULL only for old attachments which files were missing when the hash was introduced.', max_length=64, null=True, db_index=True, blank=True),
+            preserve_default=True,
+        ),
+    ]
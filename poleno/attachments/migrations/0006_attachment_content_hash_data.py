@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from poleno.attachments.utils import file_content_hash
+
+
+def forward(apps, schema_editor):
+    Attachment = apps.get_model(u'attachments', u'Attachment')
+    for attachment in Attachment.objects.filter(content_hash__isnull=True).iterator():
+        try:
+            content_hash = file_content_hash(attachment.file)
+        except IOError:
+            # Missing files are reported by datachecks, we leave their hash NULL.
+            continue
+        finally:
+            attachment.file.close()
+        attachment.content_hash = content_hash
+        attachment.save()
+
+def backward(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attachments', '0005_attachment_content_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, backward),
+    ]
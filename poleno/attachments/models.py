@@ -2,22 +2,70 @@
 # -*- coding: utf-8 -*-
 import logging
 import itertools
+import contextlib
 
 import magic
-from django.core.files.base import ContentFile
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q
 from django.utils.functional import cached_property
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 
 from poleno import datacheck
-from poleno.attachments.utils import attachment_file_check, attachment_orphaned_file_check
+from poleno.attachments.utils import (file_content_hash, attachment_file_check,
+        attachment_orphaned_file_check)
 from poleno.utils.models import QuerySet
 from poleno.utils.date import utc_now
 from poleno.utils.misc import FormatMixin, random_string, squeeze, decorate, sanitize_filename
 
 
+class AttachmentContentMixin(object):
+    u"""
+    Streaming access to the content of Attachment (or Attachment like) models with ``file`` field.
+    Unlike ``content`` property, which reads and caches the whole file, these never hold more than
+    a single chunk of the file in memory.
+    """
+    CONTENT_CHUNK_SIZE = 64*1024
+
+    @property
+    def content_path(self):
+        u"""
+        Local filesystem path of the file, so external programs may read it directly. None if the
+        object has no file or its storage is not local.
+        """
+        if not self.file:
+            return None
+        try:
+            return self.file.path
+        except NotImplementedError:
+            return None
+
+    @contextlib.contextmanager
+    def open_content(self):
+        u"""
+        Context manager opening the file for reading in binary mode. Every call opens a new file
+        object, so the content may be read by several readers at once.
+        """
+        try:
+            file = self.file.storage.open(self.file.name, u'rb')
+        except IOError:
+            logger = logging.getLogger(self.__module__.rpartition(u'.')[0])
+            logger.error(u'{} is missing its file: "{}".'.format(self, self.file.name))
+            raise
+        try:
+            yield file
+        finally:
+            file.close()
+
+    def content_chunks(self, chunk_size=None):
+        u"""
+        Iterates over the file content in chunks of ``chunk_size`` bytes. Only the last chunk may
+        be shorter.
+        """
+        with self.open_content() as file:
+            for chunk in file.chunks(chunk_size or self.CONTENT_CHUNK_SIZE):
+                yield chunk
+
 class AttachmentQuerySet(QuerySet):
     def attached_to(self, *args):
         u"""
@@ -42,20 +90,50 @@ class AttachmentQuerySet(QuerySet):
         q = reduce((lambda a, b: a | b), q, Q())
         return self.filter(q)
 
+    def bulk_save(self, attachments):
+        u"""
+        Creates given new attachments with a single query. Does the same work for every
+        attachment as ``Attachment.save()`` does when creating a new object. Note that, like with
+        ``bulk_create()``, ``pre_save`` and ``post_save`` signals are not emitted and the created
+        objects do not get their primary keys set.
+        """
+        with transaction.atomic(savepoint=False):
+            for attachment in attachments:
+                assert attachment.pk is None
+                attachment._prepare_new()
+            referenced = self.referenced_files(a._shared_file_name() for a in attachments)
+            for attachment in attachments:
+                attachment._store_file(referenced)
+            return models.query.QuerySet.bulk_create(self, attachments)
+
+    def referenced_files(self, names):
+        u"""
+        Returns the set of the given file names referenced by any attachment. Referencing
+        attachments are locked until the end of the transaction, so the files can't lose their last
+        references and be deleted by a concurrent transaction meanwhile. Likewise, if a concurrent
+        transaction is deleting the last reference of a file, we wait until it is finished. Must be
+        called in a transaction.
+        """
+        names = set(names)
+        if not names:
+            return set()
+        return set(self.select_for_update().filter(file__in=names).values_list(u'file', flat=True))
+
     def not_normalized(self):
         return self.filter(attachmentnormalization__isnull=True)
 
     def order_by_pk(self):
         return self.order_by(u'pk')
 
-class Attachment(FormatMixin, models.Model):
+class Attachment(AttachmentContentMixin, FormatMixin, models.Model):
     # May NOT be NULL; Generic relation; Index is prefix of [generic_type, generic_id] index
     generic_type = models.ForeignKey(ContentType, db_index=False)
     generic_id = models.CharField(max_length=255)
     generic_object = generic.GenericForeignKey(u'generic_type', u'generic_id')
 
-    # May NOT be NULL; Random local filename is generated in save() when creating a new object.
-    file = models.FileField(upload_to=u'attachments', max_length=255)
+    # May NOT be NULL; Content addressed local filename is generated in save() when creating a new
+    # object. Attachments with the same content share the same file.
+    file = models.FileField(upload_to=u'attachments', max_length=255, db_index=True)
 
     # May NOT be empty; Automatically sanitized in save() when creating a new object.
     name = models.CharField(max_length=255,
@@ -84,8 +162,18 @@ class Attachment(FormatMixin, models.Model):
                 Attachment file size in bytes. Automatically computed when creating a new object.
                 """))
 
+    # May be NULL; Automatically computed in save() when creating a new object.
+    content_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True,
+            help_text=squeeze(u"""
+                Hex encoded SHA-256 hash of the attachment content. Automatically computed when
+                creating a new object. NULL only for old attachments which files were missing
+                when the hash was introduced.
+                """))
+
     # Indexes:
     #  -- generic_type, generic_id: index_together
+    #  -- content_hash: db_index
+    #  -- file: db_index
 
     objects = AttachmentQuerySet.as_manager()
 
@@ -106,24 +194,77 @@ class Attachment(FormatMixin, models.Model):
         finally:
             self.file.close()
 
+    def _prepare_new(self):
+        if self.created is None:
+            self.created = utc_now()
+        if self.file._committed and self.file.name:
+            # The file is already stored and shared with other attachments, e.g. by ``clone()``.
+            # We don't write anything, only compute what the caller did not provide.
+            if self.size is None:
+                self.size = self.file.size
+            if self.content_hash is None:
+                self.content_hash = file_content_hash(self.file)
+            if not self.content_type:
+                self._sniff_content_type()
+            self.name = sanitize_filename(self.name, self.content_type)
+            return
+        # Provisional name, the file can't be inspected without one.
+        self.file.name = random_string(10)
+        self.size = self.file.size
+        if self.content_hash is None:
+            self.content_hash = file_content_hash(self.file)
+        self._sniff_content_type()
+        self.name = sanitize_filename(self.name, self.content_type)
+
+    def _shared_file_name(self):
+        u"""
+        Name of the stored file the new attachment is going to share, if it is referenced.
+        """
+        if self.file._committed:
+            return self.file.name
+        return self.file.field.generate_filename(self, self.content_hash)
+
+    def _store_file(self, referenced):
+        u"""
+        Files are stored by their content hash, so the same content is stored only once. An
+        unreferenced file may be being deleted with its last attachment, so it is never reused.
+        ``referenced`` is the set of locked referenced file names, see ``referenced_files()``.
+        """
+        if self.file._committed:
+            return
+        stored_name = self._shared_file_name()
+        if stored_name in referenced and self.file.storage.exists(stored_name):
+            self.file = stored_name
+        else:
+            self.file.name = self.content_hash
+
+    def _sniff_content_type(self):
+        # libmagic never looks further than the first megabyte, so there is no need to read whole
+        # files that may be large.
+        self.file.seek(0)
+        self.content_type = magic.from_buffer(self.file.read(1024*1024), mime=True)
+
     @decorate(prevent_bulk_create=True)
     def save(self, *args, **kwargs):
-        if self.pk is None: # Creating a new object
-            self.file.name = random_string(10)
-            if self.created is None:
-                self.created = utc_now()
-            self.size = self.file.size
-            self.content_type = magic.from_buffer(self.file.read(), mime=True)
-            self.name = sanitize_filename(self.name, self.content_type)
-        super(Attachment, self).save(*args, **kwargs)
+        with transaction.atomic(savepoint=False):
+            if self.pk is None: # Creating a new object
+                self._prepare_new()
+                self._store_file(Attachment.objects.referenced_files([self._shared_file_name()]))
+            super(Attachment, self).save(*args, **kwargs)
 
     def clone(self, generic_object):
-        u""" The returned copy is not saved. """
+        u"""
+        The returned copy is not saved. The copy shares the file with the original attachment, so
+        no content is copied.
+        """
         return Attachment(
                 generic_object=generic_object,
-                file=ContentFile(self.content),
+                file=self.file.name,
                 name=self.name,
+                content_type=self.content_type,
                 created=self.created,
+                size=self.size,
+                content_hash=self.content_hash,
                 )
 
     def __unicode__(self):
@@ -10,6 +10,9 @@ from .models import Attachment
 def delete_file_on_attachment_post_delete(sender, instance, **kwargs):
     u"""
     Django ``FileField`` does not delete associated files when deleted. We need to delete them
-    manually.
+    manually. Attachments with the same content share the same file, so the file is deleted only
+    with the last attachment referencing it. Remaining references are locked while checked, so a
+    concurrently created attachment can't start sharing the file before it is deleted.
     """
-    instance.file.delete(save=False)
+    if not Attachment.objects.referenced_files([instance.file.name]):
+        instance.file.delete(save=False)
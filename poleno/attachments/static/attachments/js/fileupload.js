@@ -4,9 +4,19 @@ $(function(){
 		inputs.not('.hasFileupload').addClass('hasFileupload').each(function(){
 			$(this).fileupload({
 				dataType: 'json',
-				singleFileUploads: false,
-				limitMultiFileUploadSize: 15*1000*1000, // 15 MB
+				maxChunkSize: 10*1000*1000, // 10 MB; Must be less than ATTACHMENT_MAX_REQUEST_SIZE
 				formData: {'csrfmiddlewaretoken': $.cookie('csrftoken')},
+				add: function(event, data){
+					// Resume partially uploaded files
+					var that = this;
+					var file = data.files[0];
+					var modified = file.lastModified || '';
+					data.formData = {'csrfmiddlewaretoken': $.cookie('csrftoken'), 'modified': modified};
+					$.getJSON($(this).data('url'), {name: file.name, size: file.size, modified: modified}, function(result){
+						data.uploadedBytes = result.file && result.file.size;
+						$.blueimp.fileupload.prototype.options.add.call(that, event, data);
+					});
+				},
 			});
 		});
 	};
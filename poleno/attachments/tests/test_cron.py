@@ -0,0 +1,51 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import os
+import time
+from testfixtures import TempDirectory
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..cron import clear_abandoned_uploads
+
+
+class ClearAbandonedUploadsCronjobTest(TestCase):
+    u"""
+    Tests ``clear_abandoned_uploads()`` cron job.
+    """
+
+    def setUp(self):
+        self.tempdir = TempDirectory()
+
+        self.settings_override = override_settings(
+            FILE_UPLOAD_TEMP_DIR=self.tempdir.path,
+            ATTACHMENT_PARTIAL_UPLOAD_EXPIRY=24,
+            )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.tempdir.cleanup()
+
+
+    def _create_file(self, name, age_hours):
+        path = self.tempdir.write(name, b'content')
+        mtime = time.time() - age_hours * 60 * 60
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_partial_uploads_older_than_expiry_are_removed(self):
+        path = self._create_file(u'attachment-aaa.part', 25)
+        clear_abandoned_uploads().do()
+        self.assertFalse(os.path.exists(path))
+
+    def test_partial_uploads_newer_than_expiry_are_kept(self):
+        path = self._create_file(u'attachment-aaa.part', 23)
+        clear_abandoned_uploads().do()
+        self.assertTrue(os.path.exists(path))
+
+    def test_other_files_are_kept(self):
+        path = self._create_file(u'other.part', 25)
+        clear_abandoned_uploads().do()
+        self.assertTrue(os.path.exists(path))
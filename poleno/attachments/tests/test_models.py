@@ -1,6 +1,8 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import mock
 import random
+import hashlib
 import datetime
 from testfixtures import TempDirectory
 
@@ -14,7 +16,7 @@ from django.test.utils import override_settings
 from poleno.timewarp import timewarp
 from poleno.utils.date import utc_now, utc_datetime_from_local, local_datetime_from_local
 
-from ..models import Attachment
+from ..models import Attachment, AttachmentQuerySet
 
 
 class AttachmentModelTest(TestCase):
@@ -93,6 +95,50 @@ class AttachmentModelTest(TestCase):
         obj = self._create_instance(file=ContentFile(u'content', name=u'overriden'))
         self.assertNotIn(u'overriden', obj.file.name)
 
+    def test_file_field_name_is_content_hash(self):
+        obj = self._create_instance(file=ContentFile(u'content'))
+        self.assertEqual(obj.file.name, u'attachments/{}'.format(hashlib.sha256(u'content').hexdigest()))
+
+    def test_file_field_same_content_is_stored_once(self):
+        obj1 = self._create_instance(file=ContentFile(u'content'))
+        obj2 = self._create_instance(file=ContentFile(u'content'))
+        obj3 = self._create_instance(file=ContentFile(u'other content'))
+        self.assertEqual(obj1.file.name, obj2.file.name)
+        self.assertNotEqual(obj1.file.name, obj3.file.name)
+        self.assertEqual(obj2.content, u'content')
+
+    def test_file_deleted_with_last_attachment_referencing_it(self):
+        obj1 = self._create_instance(file=ContentFile(u'content'))
+        obj2 = obj1.clone(obj1.generic_object)
+        obj2.save()
+        storage = obj1.file.storage
+        name = obj1.file.name
+        obj1.delete()
+        self.assertTrue(storage.exists(name))
+        obj2.delete()
+        self.assertFalse(storage.exists(name))
+
+    def test_unreferenced_file_with_same_content_is_not_reused(self):
+        obj1 = self._create_instance(file=ContentFile(u'content'))
+        name = obj1.file.name
+        # Simulates the last referencing attachment being deleted by a concurrent transaction
+        # which did not delete the file yet.
+        Attachment.objects.filter(pk=obj1.pk).update(file=u'other')
+        obj2 = self._create_instance(file=ContentFile(u'content'))
+        self.assertNotEqual(obj2.file.name, name)
+        self.assertEqual(obj2.content, u'content')
+
+    def test_file_references_are_locked_when_reused_and_deleted(self):
+        obj1 = self._create_instance(file=ContentFile(u'content'))
+        with mock.patch.object(AttachmentQuerySet, u'select_for_update', autospec=True,
+                side_effect=lambda qs: qs) as select_for_update:
+            obj2 = self._create_instance(file=ContentFile(u'content'))
+            self.assertEqual(select_for_update.call_count, 1)
+            obj1.delete()
+            self.assertEqual(select_for_update.call_count, 2)
+        self.assertEqual(obj1.file.name, obj2.file.name)
+        self.assertTrue(obj2.file.storage.exists(obj2.file.name))
+
     def test_file_field_name_unchanged_when_saving_existing_instance(self):
         u"""
         Checks that when saving an already existing instance its file name is kept as it was when
@@ -140,6 +186,13 @@ class AttachmentModelTest(TestCase):
         obj = self._create_instance(_omit=['size'])
         self.assertEqual(obj.size, 7)
 
+    def test_content_hash_field_with_default_value_if_omitted(self):
+        obj = self._create_instance(_omit=['content_hash'])
+        self.assertEqual(obj.content_hash, hashlib.sha256(u'content').hexdigest())
+
+    def test_content_hash_field_is_indexed(self):
+        self.assertTrue(Attachment._meta.get_field(u'content_hash').db_index)
+
     def test_no_default_ordering(self):
         self.assertFalse(Attachment.objects.all().ordered)
 
@@ -147,6 +200,28 @@ class AttachmentModelTest(TestCase):
         obj = self._create_instance(file=ContentFile(u'content'))
         self.assertEqual(obj.content, u'content')
 
+    def test_open_content_method(self):
+        obj = self._create_instance(file=ContentFile(u'content'))
+        with obj.open_content() as file:
+            self.assertEqual(file.read(), u'content')
+        self.assertTrue(file.closed)
+
+    def test_open_content_method_with_missing_file(self):
+        obj = self._create_instance(file=ContentFile(u'content'))
+        obj.file.delete(save=False)
+        with self.assertRaises(IOError):
+            with obj.open_content() as file:
+                pass
+
+    def test_content_chunks_method(self):
+        obj = self._create_instance(file=ContentFile(u'0123456789'))
+        self.assertEqual(list(obj.content_chunks(4)), [u'0123', u'4567', u'89'])
+
+    def test_content_path_property(self):
+        obj = self._create_instance(file=ContentFile(u'content'))
+        with open(obj.content_path, u'rb') as file:
+            self.assertEqual(file.read(), u'content')
+
     def test_clone_method_clone_is_not_saved_automatically(self):
         obj = self._create_instance()
         new = obj.clone(obj.generic_object)
@@ -167,15 +242,15 @@ class AttachmentModelTest(TestCase):
         self.assertEqual(new.content_type, obj.content_type)
         self.assertEqual(new.created, obj.created)
         self.assertEqual(new.size, obj.size)
+        self.assertEqual(new.content_hash, obj.content_hash)
         self.assertEqual(new.content, obj.content)
 
-    def test_clone_method_clone_has_new_file_name(self):
+    def test_clone_method_clone_shares_file(self):
         obj = self._create_instance()
         new = obj.clone(obj.generic_object)
-        self.assertIsNone(new.file.name)
         new.save()
-        self.assertNotEqual(new.file.name, obj.file.name)
-        self.assertRegexpMatches(new.file.name, u'^attachments/[\w\d]+$')
+        self.assertEqual(new.file.name, obj.file.name)
+        self.assertEqual(new.content, obj.content)
 
     def test_clone_method_clone_has_old_created_value(self):
         timewarp.jump(local_datetime_from_local(u'2014-10-05 15:33:10'))
@@ -234,3 +309,28 @@ class AttachmentModelTest(TestCase):
         sample = random.sample(objs, 10)
         result = Attachment.objects.filter(pk__in=(d.pk for d in sample)).order_by_pk().reverse()
         self.assertEqual(list(result), sorted(sample, key=lambda d: -d.pk))
+
+    def test_bulk_save_query_method(self):
+        objs = [
+                Attachment(generic_object=self.user, file=ContentFile(u'content'), name=u'filename.txt'),
+                Attachment(generic_object=self.user2, file=ContentFile(u'<html><body>content</body></html>'), name=u'page'),
+                ]
+        # One query locks referenced files with the same content, the other inserts attachments.
+        with self.assertNumQueries(2):
+            Attachment.objects.bulk_save(objs)
+        result = Attachment.objects.order_by_pk()
+        self.assertEqual([(a.generic_object, a.name, a.content_type, a.size, a.content) for a in result], [
+                (self.user, u'filename.txt', u'text/plain', 7, u'content'),
+                (self.user2, u'page.html', u'text/html', 33, u'<html><body>content</body></html>'),
+                ])
+        self.assertNotEqual(result[0].file.name, result[1].file.name)
+        self.assertEqual([a.content_hash for a in result], [
+                hashlib.sha256(u'content').hexdigest(),
+                hashlib.sha256(u'<html><body>content</body></html>').hexdigest(),
+                ])
+
+    def test_bulk_create_query_method_is_prevented(self):
+        with self.assertRaisesMessage(ValueError, u"Can't bulk create Attachment"):
+            Attachment.objects.bulk_create([
+                    Attachment(generic_object=self.user, file=ContentFile(u'content'), name=u'filename.txt'),
+                    ])
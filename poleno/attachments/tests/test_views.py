@@ -3,6 +3,7 @@
 import time
 import datetime
 import json
+import hashlib
 from testfixtures import TempDirectory
 
 from django.core.files.base import ContentFile
@@ -10,19 +11,20 @@ from django.conf.urls import patterns, url
 from django.http import HttpResponseNotModified, FileResponse, JsonResponse
 from django.contrib.auth.models import User
 from django.utils.http import http_date
-from django.test import TestCase
+from django.test import TestCase, RequestFactory
 from django.test.utils import override_settings
 
 from poleno.utils.date import utc_now
 
 from ..models import Attachment
-from ..views import upload, download
+from ..views import upload, download, streaming_upload
 
 
 class AttachmentViewsTest(TestCase):
     u"""
     Tests ``upload()`` and ``download()`` views.
     """
+    @streaming_upload
     def upload_view(request):
         user = User.objects.first()
         return upload(request, user, lambda a: u'/download/%s/' % a.pk)
@@ -42,6 +44,7 @@ class AttachmentViewsTest(TestCase):
 
         self.settings_override = override_settings(
             MEDIA_ROOT=self.tempdir.path,
+            FILE_UPLOAD_TEMP_DIR=self.tempdir.path,
             )
         self.settings_override.enable()
 
@@ -89,6 +92,39 @@ class AttachmentViewsTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(u''.join(response.streaming_content), u'content')
 
+    def test_download_etag_is_content_hash(self):
+        obj = Attachment.objects.create(
+                generic_object=self.user,
+                file=ContentFile(u'content'),
+                name=u'filename',
+                content_type=u'text/plain',
+                )
+        response = self.client.get(u'/download/')
+        self.assertEqual(response[u'ETag'], u'"%s"' % obj.content_hash)
+
+    def test_download_with_if_none_match_with_matching_etag(self):
+        obj = Attachment.objects.create(
+                generic_object=self.user,
+                file=ContentFile(u'content'),
+                name=u'filename',
+                content_type=u'text/plain',
+                )
+        response = self.client.get(u'/download/', HTTP_IF_NONE_MATCH=u'"%s"' % obj.content_hash)
+        self.assertIs(type(response), HttpResponseNotModified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_download_with_range(self):
+        obj = Attachment.objects.create(
+                generic_object=self.user,
+                file=ContentFile(u'content'),
+                name=u'filename',
+                content_type=u'text/plain',
+                )
+        response = self.client.get(u'/download/', HTTP_RANGE=u'bytes=3-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response[u'Content-Range'], u'bytes 3-5/7')
+        self.assertEqual(u''.join(response.streaming_content), u'ten')
+
     def test_upload(self):
         response = self.client.post(u'/upload/', {u'files': ContentFile(u'uploaded', name=u'filename.txt')})
         self.assertIs(type(response), JsonResponse)
@@ -125,3 +161,80 @@ class AttachmentViewsTest(TestCase):
         self.assertEqual(obj.content, u'uploaded2')
         obj = Attachment.objects.get(pk=3)
         self.assertEqual(obj.content, u'uploaded3')
+
+    def test_upload_computes_content_hash_while_streaming(self):
+        response = self.client.post(u'/upload/', {u'files': ContentFile(u'uploaded', name=u'filename.txt')})
+        obj = Attachment.objects.get(pk=1)
+        self.assertEqual(obj.content_hash, hashlib.sha256(u'uploaded').hexdigest())
+
+    def test_upload_exceeding_request_size_limit(self):
+        with self.settings(ATTACHMENT_MAX_REQUEST_SIZE=10):
+            response = self.client.post(u'/upload/', {u'files': ContentFile(u'x' * 100, name=u'filename.txt')})
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(Attachment.objects.exists())
+
+    def test_upload_exceeding_request_size_limit_is_rejected_before_reading_body(self):
+        request = RequestFactory().post(u'/upload/', {u'files': ContentFile(u'x' * 100, name=u'filename.txt')})
+        with self.settings(ATTACHMENT_MAX_REQUEST_SIZE=10):
+            response = self.urls[0].callback(request)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(request._stream.remaining, int(request.META[u'CONTENT_LENGTH']))
+        self.assertFalse(Attachment.objects.exists())
+
+    def _upload_chunk(self, content, first, total, name=u'filename.txt', modified=u'1400000000000'):
+        content_range = u'bytes %d-%d/%d' % (first, first + len(content) - 1, total)
+        return self.client.post(u'/upload/', {u'files': ContentFile(content, name=name), u'modified': modified},
+                HTTP_CONTENT_RANGE=content_range)
+
+    def test_upload_chunks(self):
+        response = self._upload_chunk(u'first ', 0, 12)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {u'files': [{u'name': u'filename.txt', u'size': 6}]})
+        self.assertFalse(Attachment.objects.exists())
+
+        response = self._upload_chunk(u'second', 6, 12)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {u'files': [
+            {u'url': u'/download/1/', u'pk': 1, u'name': u'filename.txt', u'size': 12},
+            ]})
+        obj = Attachment.objects.get(pk=1)
+        self.assertEqual(obj.content, u'first second')
+        self.assertEqual(obj.content_hash, hashlib.sha256(u'first second').hexdigest())
+        self.assertEqual(obj.content_type, u'text/plain')
+
+    def test_upload_chunk_sent_again(self):
+        self._upload_chunk(u'first ', 0, 12)
+        self._upload_chunk(u'first ', 0, 12)
+        self._upload_chunk(u'second', 6, 12)
+        obj = Attachment.objects.get(pk=1)
+        self.assertEqual(obj.content, u'first second')
+
+    def test_upload_chunk_with_gap(self):
+        response = self._upload_chunk(u'second', 6, 12)
+        self.assertEqual(response.status_code, 416)
+        self.assertFalse(Attachment.objects.exists())
+
+    def test_upload_chunks_exceeding_file_size_limit(self):
+        with self.settings(ATTACHMENT_MAX_FILE_SIZE=10):
+            response = self._upload_chunk(u'first ', 0, 12)
+        self.assertEqual(response.status_code, 413)
+
+    def test_upload_with_invalid_content_range(self):
+        response = self.client.post(u'/upload/', {u'files': ContentFile(u'content', name=u'filename.txt')},
+                HTTP_CONTENT_RANGE=u'bytes 5-2/10')
+        self.assertEqual(response.status_code, 400)
+
+    def test_resume_upload(self):
+        query = {u'name': u'filename.txt', u'size': 12, u'modified': u'1400000000000'}
+        response = self.client.get(u'/upload/', query)
+        self.assertEqual(json.loads(response.content), {u'file': {u'name': u'filename.txt', u'size': 0}})
+        self._upload_chunk(u'first ', 0, 12)
+        response = self.client.get(u'/upload/', query)
+        self.assertEqual(json.loads(response.content), {u'file': {u'name': u'filename.txt', u'size': 6}})
+
+    def test_resume_upload_of_modified_file_starts_again(self):
+        self._upload_chunk(u'first ', 0, 12)
+        response = self.client.get(u'/upload/', {u'name': u'filename.txt', u'size': 12, u'modified': u'1500000000000'})
+        self.assertEqual(json.loads(response.content), {u'file': {u'name': u'filename.txt', u'size': 0}})
+        response = self._upload_chunk(u'second', 6, 12, modified=u'1500000000000')
+        self.assertEqual(response.status_code, 416)
@@ -1,3 +1,4 @@
+import hashlib
 import datetime
 
 from poleno.utils.misc import squeeze
@@ -5,6 +6,16 @@ from poleno.utils.date import utc_now, utc_datetime_from_local
 from poleno import datacheck
 
 
+def file_content_hash(file):
+    u"""
+    Computes hex encoded SHA-256 hash of the file content. The file is read in chunks, so it is
+    never loaded to memory as a whole.
+    """
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
 def attachment_file_check(attachments):
     u"""
     Checks that every Attachment (or Attachment like) instance, which file is not NULL, has its file
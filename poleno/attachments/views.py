@@ -1,35 +1,178 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 import os
+import re
+import hashlib
+import tempfile
+from functools import wraps
 
 from django.conf import settings
-from django.http import JsonResponse
+from django.core.files import File
+from django.http import JsonResponse, HttpResponseBadRequest
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 
 from poleno.utils.http import send_file_response
 
+from .handlers import AttachmentUploadHandler
 from .models import Attachment
 
 
+def get_max_request_size():
+    return getattr(settings, u'ATTACHMENT_MAX_REQUEST_SIZE', 16*1024*1024)
+
+def get_max_file_size():
+    return getattr(settings, u'ATTACHMENT_MAX_FILE_SIZE', 256*1024*1024)
+
+def get_partial_upload_dir():
+    return getattr(settings, u'FILE_UPLOAD_TEMP_DIR', None) or tempfile.gettempdir()
+
+def _content_length(request):
+    try:
+        return int(request.META.get(u'CONTENT_LENGTH') or 0)
+    except ValueError:
+        return 0
+
+def streaming_upload(view):
+    u"""
+    Decorator for views calling ``upload()``. Replaces request upload handlers with
+    ``AttachmentUploadHandler`` limited to ``ATTACHMENT_MAX_REQUEST_SIZE`` bytes. The handlers must
+    be set before the request body is parsed, but CSRF middleware parses it already. Therefore the
+    decorated view is exempted from CSRF middleware and checks CSRF token itself. Requests
+    declaring larger ``Content-Length`` are rejected before their body is read at all.
+    """
+    protected = csrf_protect(view)
+
+    @wraps(view)
+    def wrapped_view(request, *args, **kwargs):
+        if _content_length(request) > get_max_request_size():
+            return JsonResponse({u'error': u'Request too large.'}, status=413)
+        request.upload_handlers = [
+                AttachmentUploadHandler(request, max_size=get_max_request_size())]
+        return protected(request, *args, **kwargs)
+
+    return csrf_exempt(wrapped_view)
+
+def _upload_limit_exceeded(request):
+    return any(getattr(handler, u'exceeded', False) for handler in request.upload_handlers)
+
+def _parse_content_range(header):
+    match = re.match(r'^bytes (\d+)-(\d+)/(\d+)$', header.strip())
+    if not match:
+        return None
+    first, last, total = (int(g) for g in match.groups())
+    if last < first or total <= last:
+        return None
+    return first, last, total
+
+def _partial_upload_path(generic_object, name, total, modified):
+    u"""
+    Chunks of a file are appended to a partial file in the temporary directory. The partial file
+    is identified by the object the file is being attached to, the file name, its total size and
+    its modification time as reported by the client, so the client can resume the upload later,
+    but a different file with the same name and size is not appended to the old one. Abandoned
+    partial files are removed by ``poleno.attachments.cron.clear_abandoned_uploads`` cron job.
+    """
+    key = u'{}.{}:{}:{}:{}:{}'.format(generic_object._meta.app_label,
+            generic_object._meta.model_name, generic_object.pk, name, total, modified)
+    digest = hashlib.sha256(key.encode(u'utf-8')).hexdigest()
+    return os.path.join(get_partial_upload_dir(), u'attachment-{}.part'.format(digest))
+
+def _uploaded_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def _attachment_json(attachment, download_url_func):
+    return {
+            u'pk': attachment.pk,
+            u'name': attachment.name,
+            u'size': attachment.size,
+            u'url': download_url_func(attachment),
+            }
+
+def _upload_chunk(request, generic_object, download_url_func, content_range):
+    first, last, total = content_range
+    if total > get_max_file_size():
+        return JsonResponse({u'error': u'File too large.'}, status=413)
+    files = request.FILES.getlist(u'files')
+    if len(files) != 1:
+        return HttpResponseBadRequest()
+    file = files[0]
+    modified = request.POST.get(u'modified', u'')
+    path = _partial_upload_path(generic_object, file.name, total, modified)
+    uploaded = _uploaded_size(path)
+    if first > uploaded or last - first + 1 != file.size:
+        return JsonResponse({u'error': u'Unexpected chunk.'}, status=416)
+
+    # Chunks sent again, e.g. after a failed request, overwrite the already received data.
+    with open(path, u'ab') as partial:
+        partial.truncate(first)
+        for chunk in file.chunks():
+            partial.write(chunk)
+    if last + 1 < total:
+        return JsonResponse({u'files': [{u'name': file.name, u'size': last + 1}]})
+
+    try:
+        with open(path, u'rb') as partial:
+            attachment = Attachment(
+                    generic_object=generic_object,
+                    file=File(partial),
+                    name=file.name,
+                    )
+            attachment.save()
+    finally:
+        os.remove(path)
+    return JsonResponse({u'files': [_attachment_json(attachment, download_url_func)]})
+
 def upload(request, generic_object, download_url_func):
+    u"""
+    Upload view for attachments. Accepts whole files as well as file chunks sent with
+    ``Content-Range`` header, one file per request. Chunks are appended to a partial file until
+    the file is complete. GET request with ``name``, ``size`` and optional ``modified`` parameters
+    returns the number of already uploaded bytes of a partially uploaded file, so the client can
+    resume the upload. Chunks must be sent with the same ``modified`` parameter.
+
+    Use ``streaming_upload`` decorator on the calling view, so the uploaded content is streamed
+    to temporary files and hashed on the fly and the request size is limited.
+    """
+    if request.method == u'GET':
+        try:
+            name, total = request.GET[u'name'], int(request.GET[u'size'])
+        except (KeyError, ValueError):
+            return HttpResponseBadRequest()
+        modified = request.GET.get(u'modified', u'')
+        path = _partial_upload_path(generic_object, name, total, modified)
+        return JsonResponse({u'file': {u'name': name, u'size': _uploaded_size(path)}})
+
+    files = request.FILES.getlist(u'files')
+    if _upload_limit_exceeded(request):
+        return JsonResponse({u'error': u'Request too large.'}, status=413)
+
+    content_range = request.META.get(u'HTTP_CONTENT_RANGE')
+    if content_range:
+        content_range = _parse_content_range(content_range)
+        if content_range is None:
+            return HttpResponseBadRequest()
+        return _upload_chunk(request, generic_object, download_url_func, content_range)
+
     res = []
-    for file in request.FILES.getlist(u'files'):
+    for file in files:
         attachment = Attachment(
                 generic_object=generic_object,
                 file=file,
                 name=file.name,
+                content_hash=getattr(file, u'content_hash', None),
                 )
         attachment.save()
-        res.append({
-                u'pk': attachment.pk,
-                u'name': attachment.name,
-                u'size': attachment.size,
-                u'url': download_url_func(attachment),
-            })
+        res.append(_attachment_json(attachment, download_url_func))
     return JsonResponse({u'files': res})
 
 def download(request, attachment, filename=None):
     u"""
-    Download view for attachments and attachment like objects
+    Download view for attachments and attachment like objects. Objects with content hash use it
+    as their ETag.
     """
     path = os.path.join(settings.MEDIA_ROOT, attachment.file.name)
-    return send_file_response(request, path, filename or attachment.name, attachment.content_type)
+    return send_file_response(request, path, filename or attachment.name, attachment.content_type,
+            etag=getattr(attachment, u'content_hash', None))
@@ -5,7 +5,7 @@ from django.contrib import admin
 from poleno.utils.misc import decorate
 from poleno.utils.admin import simple_list_filter_factory
 
-from .models import Message, Recipient
+from .models import Message, Recipient, Mailbox
 
 
 class RecipientInline(admin.TabularInline):
@@ -34,6 +34,8 @@ class MessageAdmin(admin.ModelAdmin):
                 ),
             u'created',
             u'processed',
+            u'priority',
+            u'attempts',
             ]
     list_filter = [
             u'type',
@@ -42,6 +44,12 @@ class MessageAdmin(admin.ModelAdmin):
                 (u'1', u'Yes', lambda qs: qs.processed()),
                 (u'0', u'No',  lambda qs: qs.not_processed()),
                 ]),
+            simple_list_filter_factory(u'Queue', u'queue', [
+                (u'1', u'Ready',  lambda qs: qs.ready()),
+                (u'2', u'Failed', lambda qs: qs.outbound().not_processed().filter(attempts__gt=0)),
+                (u'3', u'Dead',   lambda qs: qs.dead()),
+                ]),
+            u'priority',
             ]
     search_fields = [
             u'=id',
@@ -69,3 +77,30 @@ class MessageAdmin(admin.ModelAdmin):
         queryset = super(MessageAdmin, self).get_queryset(request)
         queryset = queryset.prefetch_related(Message.prefetch_recipients())
         return queryset
+
+@admin.register(Mailbox, site=admin.site)
+class MailboxAdmin(admin.ModelAdmin):
+    date_hierarchy = None
+    list_display = [
+            u'id',
+            u'name',
+            u'uid_validity',
+            u'last_uid',
+            ]
+    list_filter = [
+            ]
+    search_fields = [
+            u'=id',
+            u'name',
+            ]
+    ordering = [
+            u'id',
+            ]
+    exclude = [
+            ]
+    readonly_fields = [
+            ]
+    raw_id_fields = [
+            ]
+    inlines = [
+            ]
@@ -14,6 +14,11 @@ from .models import Message, Recipient
 
 
 class EmailBackend(BaseEmailBackend):
+    u"""
+    Enqueues sent messages to be sent by the outbound transport. Besides strings, the content of
+    message attachments may be an ``Attachment`` instance. Such attachments are attached to the
+    queued message without copying their files.
+    """
 
     def send_messages(self, email_messages):
         for message in email_messages:
@@ -28,6 +33,8 @@ class EmailBackend(BaseEmailBackend):
         text = message.body if message.content_subtype != u'html' else None
         html = message.body if message.content_subtype == u'html' else None
         headers = message.extra_headers
+        # Senders may choose the outbound queue lane by setting ``priority`` attribute
+        priority = getattr(message, u'priority', Message.PRIORITIES.NORMAL)
 
         # We may have only one plaintext and one html message body. If the message has more
         # plaintext and/or html aternatives, they are converted to attachments.
@@ -66,6 +73,17 @@ class EmailBackend(BaseEmailBackend):
                 content_type = DEFAULT_ATTACHMENT_MIME_TYPE
             if not name:
                 name = u'attachment{}'.format(guess_extension(content_type))
+            if isinstance(content, Attachment):
+                # The message shares the file with the attached attachment, so its content is
+                # neither read nor copied.
+                attachments.append(Attachment(
+                        file=content.file.name,
+                        name=name,
+                        content_type=content.content_type,
+                        size=content.size,
+                        content_hash=content.content_hash,
+                        ))
+                continue
             attachments.append(Attachment(
                     file=ContentFile(content),
                     name=name,
@@ -79,14 +97,15 @@ class EmailBackend(BaseEmailBackend):
                 text=text or u'',
                 html=html or u'',
                 headers=headers,
+                priority=priority,
                 )
         msg.save()
         message.instance = msg
 
         for recipient in recipients:
             recipient.message = msg
-            recipient.save()
+        Recipient.objects.bulk_create(recipients)
 
         for attachment in attachments:
             attachment.generic_object = msg
-            attachment.save()
+        Attachment.objects.bulk_save(attachments)
@@ -11,71 +11,105 @@ from poleno.utils.date import utc_now
 from poleno.utils.misc import nop
 
 from .models import Message
-from .signals import message_sent, message_received
+from .signals import message_received, messages_received
+from .dispatcher import OutboundDispatcher
 
 
-@cron_job(run_every_mins=1)
-def mail():
-    # Get inbound mail
-    path = getattr(settings, u'EMAIL_INBOUND_TRANSPORT', None)
-    if path:
-        klass = import_by_path(path)
-        with klass() as transport:
-            messages = transport.get_messages()
-            while True:
-                try:
-                    with transaction.atomic():
-                        message = next(messages)
-                        nop() # To let tests raise testing exception here.
-                    cron_logger.info(u'Received email: {}'.format(message))
-                except StopIteration:
-                    break
-                except Exception:
-                    trace = unicode(traceback.format_exc(), u'utf-8')
-                    cron_logger.error(u'Receiving emails failed:\n{}'.format(trace))
-                    break
+def receive_mail(transport):
+    u"""
+    Gets inbound mail from the given transport. Every received message is stored in its own
+    transaction. Stops at the first failure.
+    """
+    messages = transport.get_messages()
+    while True:
+        try:
+            with transaction.atomic():
+                message = next(messages)
+                nop() # To let tests raise testing exception here.
+            cron_logger.info(u'Received email: {}'.format(message))
+        except StopIteration:
+            break
+        except Exception:
+            trace = unicode(traceback.format_exc(), u'utf-8')
+            cron_logger.error(u'Receiving emails failed:\n{}'.format(trace))
+            break
 
-    # Process inbound mail; At most 10 messages in one batch
+def _process_received_messages(messages):
+    u"""
+    Claims and processes the given messages in a single transaction. Returns the list of claimed
+    messages. A message is claimed with a conditional update, so it is never processed twice,
+    even if processed concurrently.
+    """
+    with transaction.atomic():
+        processed = utc_now()
+        claimed = []
+        for message in messages:
+            if Message.objects.not_processed().filter(pk=message.pk).update(processed=processed):
+                claimed.append(message)
+        if claimed:
+            messages_received.send(sender=None, messages=claimed)
+        for message in claimed:
+            message_received.send(sender=None, message=message)
+            nop() # To let tests raise testing exception here.
+    for message in claimed:
+        message.processed = processed
+    return claimed
+
+def process_received_mail(limit=10):
+    u"""
+    Emits ``messages_received`` signal with at most ``limit`` received messages that were not
+    processed yet, followed by ``message_received`` signal for every one of them. If ``limit`` is
+    ``None`` all such messages are processed. The whole batch is processed in a single
+    transaction. If processing the batch fails, its messages are processed again one by one, so a
+    single failing message does not block the others.
+    """
     messages = (Message.objects
             .inbound()
             .not_processed()
             .order_by_pk()
             .prefetch_related(Message.prefetch_recipients())
-            )[:10]
+            )
+    if limit is not None:
+        messages = messages[:limit]
+    messages = list(messages)
+    if not messages:
+        return
+
+    try:
+        claimed = _process_received_messages(messages)
+    except Exception:
+        trace = unicode(traceback.format_exc(), u'utf-8')
+        cron_logger.warning(u'Processing received emails in batch failed:\n{}'.format(trace))
+    else:
+        for message in claimed:
+            cron_logger.info(u'Processed received email: {}'.format(message))
+        return
+
     for message in messages:
         try:
-            with transaction.atomic():
-                message.processed = utc_now()
-                message.save(update_fields=[u'processed'])
-                message_received.send(sender=None, message=message)
-                nop() # To let tests raise testing exception here.
-            cron_logger.info(u'Processed received email: {}'.format(message))
+            claimed = _process_received_messages([message])
         except Exception:
             trace = unicode(traceback.format_exc(), u'utf-8')
             cron_logger.error(u'Processing received email failed: {}\n{}'.format(message, trace))
+            continue
+        if claimed:
+            cron_logger.info(u'Processed received email: {}'.format(message))
+
+@cron_job(run_every_mins=1)
+def mail():
+    # Get inbound mail; Unless it is pushed to ``mailidle`` management command
+    path = getattr(settings, u'EMAIL_INBOUND_TRANSPORT', None)
+    if path and not getattr(settings, u'EMAIL_INBOUND_IDLE', False):
+        klass = import_by_path(path)
+        with klass() as transport:
+            receive_mail(transport)
 
-    # Send outbound mail; At most 10 messages in one batch
+    # Process inbound mail; At most 10 messages in one batch
+    process_received_mail(limit=10)
+
+    # Send outbound mail; At most ``EMAIL_OUTBOUND_BATCH_SIZE`` messages in one batch; Unless it
+    # is sent by ``mailworker`` management command
     path = getattr(settings, u'EMAIL_OUTBOUND_TRANSPORT', None)
-    if path:
-        messages = (Message.objects
-                .outbound()
-                .not_processed()
-                .order_by_pk()
-                .prefetch_related(Message.prefetch_recipients())
-                .prefetch_related(Message.prefetch_attachments())
-                )[:10]
-        if messages:
-            klass = import_by_path(path)
-            with klass() as transport:
-                for message in messages:
-                    try:
-                        with transaction.atomic():
-                            transport.send_message(message)
-                            message.processed = utc_now()
-                            message.save(update_fields=[u'processed'])
-                            message_sent.send(sender=None, message=message)
-                            nop() # To let tests raise testing exception here.
-                        cron_logger.info(u'Sent email: {}'.format(message))
-                    except Exception:
-                        trace = unicode(traceback.format_exc(), u'utf-8')
-                        cron_logger.error(u'Sending email failed: {}\n{}'.format(message, trace))
+    if path and not getattr(settings, u'EMAIL_OUTBOUND_WORKER', False):
+        klass = import_by_path(path)
+        OutboundDispatcher(klass).dispatch()
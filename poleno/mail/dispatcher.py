@@ -0,0 +1,253 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import sys
+import time
+import datetime
+import threading
+import traceback
+from Queue import Queue, Empty
+
+from django.db import connections, transaction
+from django.db.models import F
+from django.conf import settings
+from django.core.mail import BadHeaderError
+
+from poleno.cron import cron_logger
+from poleno.utils.date import utc_now
+from poleno.utils.misc import nop
+
+from .models import Message
+from .signals import message_sent
+
+
+class OutboundDispatcher(object):
+    u"""
+    Sends a batch of outbound messages over a pool of worker threads. Every worker opens its own
+    transport connection and takes messages from a shared queue until the queue is empty or the
+    time budget is exhausted. Every sent message is marked as processed and ``message_sent`` signal
+    is emitted for it in a single transaction, so the signal is never lost once the message is
+    marked. If a signal receiver fails, the failure is logged and changes made by receivers are
+    rolled back, but the message stays marked, so it's not sent again.
+
+    Messages sent in the calling thread are marked as processed in the same transaction they are
+    sent in. Worker threads do not touch the database, they pass sent messages to the calling
+    thread, which marks each of them in its own transaction as soon as it receives it. So there is
+    a short window between sending a message in a worker thread and marking it, and a message sent
+    by a worker thread is sent again if the process crashes within the window.
+
+    With a single worker, messages are sent directly in the calling thread, so the dispatcher may
+    be used within a transaction and with an in-memory database. Long-running processes may pass
+    their own connected transport to ``dispatch()`` to reuse its connection for every batch.
+
+    Every batch is assembled from priority lanes by weighted round robin. Higher priority lanes
+    take more messages in every turn and go first, but lower priority lanes get their share as
+    well, so urgent mail is never stuck behind a flood of bulk mail and bulk mail never starves.
+
+    Failed messages are scheduled for another attempt with exponential backoff, so they do not
+    block messages queued behind them. After too many failed attempts the message is given up and
+    left in the queue as dead with its ``next_attempt_at`` empty. Invalid messages, e.g. with
+    a linebreak in a header, never succeed, so they are given up right after the first attempt.
+
+    Settings:
+     -- EMAIL_OUTBOUND_BATCH_SIZE: Max number of messages sent in one batch. Defaults to 10.
+     -- EMAIL_OUTBOUND_TIME_BUDGET: Seconds after which workers stop taking new messages from the
+        batch. ``None`` means no limit. Defaults to 50 seconds.
+     -- EMAIL_OUTBOUND_WORKERS: Number of worker threads. Defaults to 1.
+     -- EMAIL_OUTBOUND_PRIORITY_WEIGHTS: Dict mapping ``Message.PRIORITIES`` names to number of
+        messages the lane takes in its turn. Defaults to 8 for URGENT, 4 for HIGH, 2 for NORMAL
+        and 1 for LOW priority.
+     -- EMAIL_OUTBOUND_RETRY_DELAY: Seconds to wait before the first retry of a failed message. The
+        delay doubles with every further failed attempt. Defaults to 60 seconds.
+     -- EMAIL_OUTBOUND_RETRY_MAX_DELAY: Upper limit of the delay in seconds. Defaults to one day.
+     -- EMAIL_OUTBOUND_MAX_ATTEMPTS: Number of failed attempts after which the message is given
+        up. Defaults to 10.
+    """
+
+    # Failures which are not worth another attempt.
+    PERMANENT_ERRORS = (BadHeaderError,)
+
+    def __init__(self, transport_class, batch_size=None, time_budget=None, workers=None):
+        self.transport_class = transport_class
+        self.batch_size = batch_size if batch_size is not None else (
+                getattr(settings, u'EMAIL_OUTBOUND_BATCH_SIZE', 10))
+        self.time_budget = time_budget if time_budget is not None else (
+                getattr(settings, u'EMAIL_OUTBOUND_TIME_BUDGET', 50))
+        self.workers = workers if workers is not None else (
+                getattr(settings, u'EMAIL_OUTBOUND_WORKERS', 1))
+        self.priority_weights = getattr(settings, u'EMAIL_OUTBOUND_PRIORITY_WEIGHTS', {
+                u'URGENT': 8, u'HIGH': 4, u'NORMAL': 2, u'LOW': 1})
+        self.retry_delay = getattr(settings, u'EMAIL_OUTBOUND_RETRY_DELAY', 60)
+        self.retry_max_delay = getattr(settings, u'EMAIL_OUTBOUND_RETRY_MAX_DELAY', 24*60*60)
+        self.max_attempts = getattr(settings, u'EMAIL_OUTBOUND_MAX_ATTEMPTS', 10)
+
+    def queued_messages(self):
+        u"""
+        Returns the list of at most ``batch_size`` messages ready to be sent in the order they
+        should be sent.
+        """
+        lanes = []
+        for priority, _ in sorted(Message.PRIORITIES._choices):
+            weight = self.priority_weights.get(Message.PRIORITIES._inverse[priority], 1)
+            pks = list(Message.objects
+                    .ready()
+                    .priority(priority)
+                    .order_by_next_attempt_at()
+                    .values_list(u'pk', flat=True)
+                    [:self.batch_size])
+            lanes.append((max(weight, 1), pks))
+
+        batch = []
+        while len(batch) < self.batch_size and any(pks for _, pks in lanes):
+            for weight, pks in lanes:
+                take = min(weight, self.batch_size - len(batch))
+                batch.extend(pks[:take])
+                del pks[:take]
+
+        messages = (Message.objects
+                .filter(pk__in=batch)
+                .prefetch_related(Message.prefetch_recipients())
+                .prefetch_related(Message.prefetch_attachments())
+                )
+        messages = {m.pk: m for m in messages}
+        return [messages[pk] for pk in batch if pk in messages]
+
+    def _mark_processed(self, message):
+        processed = utc_now()
+        Message.objects.filter(pk=message.pk).update(
+                processed=processed, attempts=F(u'attempts') + 1)
+        message.processed = processed
+        message.attempts += 1
+
+    def _notify_sent(self, message):
+        # Emitted in the transaction the message is marked processed in. A failing receiver is
+        # rolled back to the savepoint, so the message stays marked.
+        try:
+            with transaction.atomic():
+                message_sent.send(sender=None, message=message)
+        except Exception:
+            trace = unicode(traceback.format_exc(), u'utf-8')
+            cron_logger.error(u'Processing sent email failed: {}\n{}'.format(message, trace))
+
+    def _send(self, transport, message, sent, failed, results):
+        try:
+            with transaction.atomic():
+                transport.send_message(message)
+                nop() # To let tests raise testing exception here.
+                # The message is marked processed in the same transaction it is sent in, so it is
+                # not sent again if the process crashes before the batch is finished. Worker
+                # threads pass it to the calling thread to mark it right away instead.
+                if results is None:
+                    self._mark_processed(message)
+                    self._notify_sent(message)
+            if results is not None:
+                results.put(message)
+            cron_logger.info(u'Sent email: {}'.format(message))
+            sent.append(message)
+        except Exception as e:
+            trace = unicode(traceback.format_exc(), u'utf-8')
+            cron_logger.error(u'Sending email failed: {}\n{}'.format(message, trace))
+            failed.append((message, trace, isinstance(e, self.PERMANENT_ERRORS)))
+
+    def _drain(self, transport, queue, deadline, sent, failed, results=None):
+        while deadline is None or time.time() < deadline:
+            try:
+                message = queue.get_nowait()
+            except Empty:
+                break
+            self._send(transport, message, sent, failed, results)
+
+    def _work(self, queue, deadline, sent, failed, results=None):
+        with self.transport_class() as transport:
+            self._drain(transport, queue, deadline, sent, failed, results)
+
+    def _work_in_thread(self, queue, deadline, sent, failed, results, errors):
+        try:
+            self._work(queue, deadline, sent, failed, results)
+        except Exception:
+            errors.append(sys.exc_info())
+        finally:
+            # Every thread has its own DB connections, they are not closed automatically.
+            for connection in connections.all():
+                connection.close()
+
+    def _mark_results(self, results, threads):
+        while True:
+            alive = any(thread.is_alive() for thread in threads)
+            try:
+                while True:
+                    message = results.get(timeout=0.1 if alive else 0)
+                    with transaction.atomic():
+                        self._mark_processed(message)
+                        self._notify_sent(message)
+            except Empty:
+                pass
+            if not alive:
+                break
+
+    def backoff(self, attempts):
+        u"""
+        Returns the delay before the next attempt to send a message that has already failed
+        ``attempts`` times, or ``None`` if the message should be given up.
+        """
+        if attempts >= self.max_attempts:
+            return None
+        delay = min(self.retry_delay * 2 ** (attempts - 1), self.retry_max_delay)
+        return datetime.timedelta(seconds=delay)
+
+    def _mark_failed(self, failures):
+        now = utc_now()
+        for message, trace, permanent in failures:
+            message.attempts += 1
+            delay = self.backoff(message.attempts) if not permanent else None
+            message.next_attempt_at = now + delay if delay is not None else None
+            message.last_error = trace
+            with transaction.atomic():
+                Message.objects.filter(pk=message.pk).update(attempts=F(u'attempts') + 1,
+                        next_attempt_at=message.next_attempt_at, last_error=trace)
+            if message.next_attempt_at is None:
+                cron_logger.error(u'Sending email given up after {} attempts: {}'.format(
+                        message.attempts, message))
+
+    def dispatch(self, messages=None, transport=None):
+        u"""
+        Sends given messages, or queued messages if no messages are given. Returns the list of
+        successfully sent messages in the order they were sent. If a connected ``transport`` is
+        given, messages are sent with it in the calling thread and no new connection is opened.
+        """
+        if messages is None:
+            messages = self.queued_messages()
+        messages = list(messages)
+        if not messages:
+            return []
+
+        queue = Queue()
+        for message in messages:
+            queue.put(message)
+        deadline = time.time() + self.time_budget if self.time_budget is not None else None
+        sent = [] # ``list.append`` is atomic, so workers may share it.
+        failed = []
+
+        workers = min(self.workers, len(messages))
+        errors = []
+        try:
+            if transport is not None:
+                self._drain(transport, queue, deadline, sent, failed)
+            elif workers <= 1:
+                self._work(queue, deadline, sent, failed)
+            else:
+                results = Queue()
+                threads = [threading.Thread(target=self._work_in_thread,
+                        args=(queue, deadline, sent, failed, results, errors))
+                        for i in range(workers)]
+                for thread in threads:
+                    thread.start()
+                self._mark_results(results, threads)
+                for thread in threads:
+                    thread.join()
+        finally:
+            self._mark_failed(failed)
+
+        # Reraise transport failure from worker threads
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+        return sent
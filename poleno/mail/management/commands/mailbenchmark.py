@@ -0,0 +1,80 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import time
+import datetime
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.utils.module_loading import import_by_path
+
+from poleno.utils.date import utc_now
+from poleno.utils.misc import squeeze
+
+from ...models import Message, Recipient
+from ...dispatcher import OutboundDispatcher
+
+
+class Command(NoArgsCommand):
+    default_count = 1000
+    default_workers = 1
+    default_transport = u'poleno.mail.transports.dummy.DummyTransport'
+
+    help = squeeze(u"""
+            Measures outbound mail throughput. Creates testing outbound messages, sends them with
+            the outbound dispatcher and reports sent messages per second. The testing messages are
+            deleted afterwards. Never use it with a real mail transport.
+            """)
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(u'--count', action=u'store', type=u'int', dest=u'count',
+            default=default_count,
+            help=u'Number of messages to send. Defaults to {}.'.format(default_count)),
+        make_option(u'--workers', action=u'store', type=u'int', dest=u'workers',
+            default=default_workers,
+            help=u'Number of worker threads. Defaults to {}.'.format(default_workers)),
+        make_option(u'--transport', action=u'store', type=u'string', dest=u'transport',
+            default=default_transport,
+            help=u'Outbound transport to use. Defaults to "{}".'.format(default_transport)),
+        )
+
+    def handle_noargs(self, **options):
+        count = options[u'count']
+        workers = options[u'workers']
+        klass = import_by_path(options[u'transport'])
+
+        # Testing messages are scheduled far in the future, so the regular outbound queue never
+        # sees them and never sends them with a real transport. They are dispatched explicitly.
+        hidden = utc_now() + datetime.timedelta(days=100*365)
+        messages = []
+        try:
+            for i in range(count):
+                message = Message.objects.create(
+                        type=Message.TYPES.OUTBOUND,
+                        next_attempt_at=hidden,
+                        from_mail=u'benchmark@example.com',
+                        subject=u'Benchmark {}'.format(i),
+                        text=u'Benchmark message.',
+                        )
+                messages.append(message)
+                Recipient.objects.create(
+                        message=message,
+                        mail=u'benchmark{}@example.com'.format(i),
+                        type=Recipient.TYPES.TO,
+                        status=Recipient.STATUSES.QUEUED,
+                        )
+
+            queryset = (Message.objects
+                    .filter(pk__in=[m.pk for m in messages])
+                    .order_by_pk()
+                    .prefetch_related(Message.prefetch_recipients())
+                    .prefetch_related(Message.prefetch_attachments())
+                    )
+            dispatcher = OutboundDispatcher(klass, time_budget=float(u'inf'), workers=workers)
+            start = time.time()
+            sent = dispatcher.dispatch(queryset)
+            duration = time.time() - start
+        finally:
+            Message.objects.filter(pk__in=[m.pk for m in messages]).delete()
+
+        self.stdout.write(u'Sent {} of {} messages with {} workers in {:.3f} s: {:.1f} messages/s'
+                .format(len(sent), count, workers, duration, len(sent) / duration if duration else 0))
@@ -0,0 +1,69 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import time
+import traceback
+from optparse import make_option
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import NoArgsCommand
+from django.db import close_old_connections
+from django.utils.module_loading import import_by_path
+
+from poleno.cron import cron_logger
+from poleno.utils.misc import squeeze
+
+from ...cron import receive_mail, process_received_mail
+
+
+class Command(NoArgsCommand):
+    default_idle_timeout = 20 * 60
+    default_retry_interval = 60
+
+    help = squeeze(u"""
+            Long-running inbound mail listener. Holds a connection to the IMAP server configured
+            by EMAIL_INBOUND_TRANSPORT in IDLE state and receives and processes new messages as
+            soon as the server announces them. Set EMAIL_INBOUND_IDLE to True when running this
+            command, so the "mail" cron job stops polling the server.
+            """)
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(u'--idle-timeout', action=u'store', type=u'int', dest=u'idle_timeout',
+            default=default_idle_timeout, help=squeeze(u"""
+                Seconds after which IDLE command is renewed. Servers drop idling clients after 30
+                minutes. Defaults to {} seconds.
+                """).format(default_idle_timeout)),
+        make_option(u'--retry-interval', action=u'store', type=u'int', dest=u'retry_interval',
+            default=default_retry_interval, help=squeeze(u"""
+                Seconds to wait before reconnecting after a failure. Defaults to {} seconds.
+                """).format(default_retry_interval)),
+        )
+
+    def handle_noargs(self, **options):
+        idle_timeout = options[u'idle_timeout']
+        retry_interval = options[u'retry_interval']
+
+        path = getattr(settings, u'EMAIL_INBOUND_TRANSPORT', None)
+        if not path:
+            raise ImproperlyConfigured(u'Setting EMAIL_INBOUND_TRANSPORT is not set.')
+        klass = import_by_path(path)
+        if not hasattr(klass, u'idle'):
+            raise ImproperlyConfigured(u'Inbound transport {} does not support IDLE.'.format(path))
+
+        try:
+            while True:
+                try:
+                    with klass() as transport:
+                        while True:
+                            close_old_connections()
+                            receive_mail(transport)
+                            process_received_mail(limit=None)
+                            transport.idle(idle_timeout)
+                except KeyboardInterrupt:
+                    raise
+                except Exception:
+                    trace = unicode(traceback.format_exc(), u'utf-8')
+                    cron_logger.error(u'Listening for inbound emails failed:\n{}'.format(trace))
+                    time.sleep(retry_interval)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,94 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import time
+import traceback
+from optparse import make_option
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import NoArgsCommand
+from django.db import close_old_connections
+from django.utils.module_loading import import_by_path
+
+from poleno.cron import cron_logger
+from poleno.utils.misc import squeeze
+
+from ...models import Message
+from ...dispatcher import OutboundDispatcher
+
+
+class Command(NoArgsCommand):
+    default_poll_interval = 1.0
+    default_recheck_interval = 30
+    default_retry_interval = 60
+
+    help = squeeze(u"""
+            Long-running outbound mail worker. Keeps a connection of the transport configured by
+            EMAIL_OUTBOUND_TRANSPORT open and sends new messages as soon as they are queued. Set
+            EMAIL_OUTBOUND_WORKER to True when running this command, so the "mail" cron job stops
+            sending outbound messages.
+            """)
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(u'--poll-interval', action=u'store', type=u'float', dest=u'poll_interval',
+            default=default_poll_interval, help=squeeze(u"""
+                Seconds between checks for newly created messages. Defaults to {} seconds.
+                """).format(default_poll_interval)),
+        make_option(u'--recheck-interval', action=u'store', type=u'int', dest=u'recheck_interval',
+            default=default_recheck_interval, help=squeeze(u"""
+                Seconds between checks for failed messages due for another attempt. Defaults to {}
+                seconds.
+                """).format(default_recheck_interval)),
+        make_option(u'--retry-interval', action=u'store', type=u'int', dest=u'retry_interval',
+            default=default_retry_interval, help=squeeze(u"""
+                Seconds to wait before reconnecting after a failure. Defaults to {} seconds.
+                """).format(default_retry_interval)),
+        )
+
+    def _latest_pk(self):
+        # Cheap query using only the primary key index.
+        return Message.objects.order_by(u'-pk').values_list(u'pk', flat=True).first()
+
+    def _send_queued(self, dispatcher, transport):
+        while True:
+            messages = list(dispatcher.queued_messages())
+            if not messages:
+                break
+            dispatcher.dispatch(messages, transport=transport)
+
+    def _work(self, dispatcher, transport, poll_interval, recheck_interval):
+        cursor = None
+        recheck = 0
+        while True:
+            close_old_connections()
+            latest = self._latest_pk()
+            if latest != cursor or time.time() >= recheck:
+                cursor = latest
+                recheck = time.time() + recheck_interval
+                self._send_queued(dispatcher, transport)
+            time.sleep(poll_interval)
+
+    def handle_noargs(self, **options):
+        poll_interval = options[u'poll_interval']
+        recheck_interval = options[u'recheck_interval']
+        retry_interval = options[u'retry_interval']
+
+        path = getattr(settings, u'EMAIL_OUTBOUND_TRANSPORT', None)
+        if not path:
+            raise ImproperlyConfigured(u'Setting EMAIL_OUTBOUND_TRANSPORT is not set.')
+        klass = import_by_path(path)
+        dispatcher = OutboundDispatcher(klass)
+
+        try:
+            while True:
+                try:
+                    with klass() as transport:
+                        self._work(dispatcher, transport, poll_interval, recheck_interval)
+                except KeyboardInterrupt:
+                    raise
+                except Exception:
+                    trace = unicode(traceback.format_exc(), u'utf-8')
+                    cron_logger.error(u'Sending outbound emails failed:\n{}'.format(trace))
+                    time.sleep(retry_interval)
+        except KeyboardInterrupt:
+            pass
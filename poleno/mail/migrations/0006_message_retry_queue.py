@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import poleno.utils.date
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mail', '0005_address_name_encoding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='attempts',
+            field=models.IntegerField(default=0, help_text='Number of attempts to send the message.'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='last_error',
+            field=models.TextField(help_text='Error raised by the last failed attempt to send the message.', blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=poleno.utils.date.utc_now, help_text='Date and time of the next attempt to send the message. It is blank if the message failed too many times and the application gave it up. Set it to the current time if you want the application to try to send the message again.', null=True, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='message',
+            index_together=set([('type', 'processed', 'next_attempt_at', 'id'), ('processed', 'id'), ('created', 'id')]),
+        ),
+    ]
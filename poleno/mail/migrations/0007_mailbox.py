@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import poleno.utils.misc
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mail', '0006_message_retry_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Mailbox',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(help_text='Unique mailbox identifier, e.g. "username@host:port/INBOX".', unique=True, max_length=255)),
+                ('uid_validity', models.BigIntegerField(help_text='UIDVALIDITY of the mailbox as reported by the server the last time we fetched messages from it.', null=True, blank=True)),
+                ('last_uid', models.BigIntegerField(default=0, help_text='UID of the last fetched message. Only messages with greater UIDs will be fetched. Set it to zero to fetch all messages again.')),
+            ],
+            options={
+            },
+            bases=(poleno.utils.misc.FormatMixin, models.Model),
+        ),
+    ]
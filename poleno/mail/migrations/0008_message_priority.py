@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mail', '0007_mailbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='priority',
+            field=models.SmallIntegerField(default=3, help_text='Outbound queue lane the message is sent from. Messages with higher priority are sent first, but lower priority lanes get their share of every batch as well, so they never starve.', choices=[(1, 'mail:Message:priority:URGENT'), (2, 'mail:Message:priority:HIGH'), (3, 'mail:Message:priority:NORMAL'), (4, 'mail:Message:priority:LOW')]),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='message',
+            index_together=set([('type', 'processed', 'priority', 'next_attempt_at', 'id'), ('created', 'id'), ('processed', 'id')]),
+        ),
+    ]
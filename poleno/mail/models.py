@@ -14,6 +14,7 @@ from jsonfield import JSONField
 from poleno.attachments.models import Attachment
 from poleno.utils.models import FieldChoices, QuerySet, join_lookup
 from poleno.utils.misc import FormatMixin, squeeze
+from poleno.utils.date import utc_now
 
 
 class MessageQuerySet(QuerySet):
@@ -25,12 +26,26 @@ class MessageQuerySet(QuerySet):
         return self.filter(processed__isnull=False)
     def not_processed(self):
         return self.filter(processed__isnull=True)
+    def ready(self, now=None):
+        u"""
+        Queued outbound messages with their next attempt due. Messages given up after too many
+        failed attempts are not ready.
+        """
+        if now is None:
+            now = utc_now()
+        return self.outbound().not_processed().filter(next_attempt_at__lte=now)
+    def dead(self):
+        return self.outbound().not_processed().filter(next_attempt_at__isnull=True)
     def order_by_pk(self):
         return self.order_by(u'pk')
     def order_by_created(self):
         return self.order_by(u'created', u'pk')
     def order_by_processed(self):
         return self.order_by(u'processed', u'pk')
+    def order_by_next_attempt_at(self):
+        return self.order_by(u'next_attempt_at', u'pk')
+    def priority(self, priority):
+        return self.filter(priority=priority)
 
 class Message(FormatMixin, models.Model):
     # May NOT be NULL
@@ -53,6 +68,41 @@ class Message(FormatMixin, models.Model):
                 want the application to process it.
                 """))
 
+    # May NOT be NULL; Used for outbound messages only
+    attempts = models.IntegerField(default=0,
+            help_text=squeeze(u"""
+                Number of attempts to send the message.
+                """))
+
+    # NOT NULL for queued outbound messages; NULL for outbound messages given up after too many
+    # failed attempts; Ignored for processed and inbound messages
+    next_attempt_at = models.DateTimeField(blank=True, null=True, default=utc_now,
+            help_text=squeeze(u"""
+                Date and time of the next attempt to send the message. It is blank if the message
+                failed too many times and the application gave it up. Set it to the current time if
+                you want the application to try to send the message again.
+                """))
+
+    # May NOT be NULL; Used for outbound messages only
+    PRIORITIES = FieldChoices(
+            (u'URGENT', 1, _(u'mail:Message:priority:URGENT')),
+            (u'HIGH',   2, _(u'mail:Message:priority:HIGH')),
+            (u'NORMAL', 3, _(u'mail:Message:priority:NORMAL')),
+            (u'LOW',    4, _(u'mail:Message:priority:LOW')),
+            )
+    priority = models.SmallIntegerField(choices=PRIORITIES._choices, default=PRIORITIES.NORMAL,
+            help_text=squeeze(u"""
+                Outbound queue lane the message is sent from. Messages with higher priority are
+                sent first, but lower priority lanes get their share of every batch as well, so
+                they never starve.
+                """))
+
+    # May be empty
+    last_error = models.TextField(blank=True,
+            help_text=squeeze(u"""
+                Error raised by the last failed attempt to send the message.
+                """))
+
     # May be empty
     from_name = models.CharField(blank=True, max_length=255,
             help_text=escape(squeeze(u"""
@@ -106,8 +156,9 @@ class Message(FormatMixin, models.Model):
     #     Should NOT be empty
 
     # Indexes:
-    #  -- processed, id: index_together
-    #  -- created, id:   index_together
+    #  -- processed, id:                                  index_together
+    #  -- created, id:                                    index_together
+    #  -- type, processed, priority, next_attempt_at, id: index_together
 
     objects = MessageQuerySet.as_manager()
 
@@ -115,6 +166,7 @@ class Message(FormatMixin, models.Model):
         index_together = [
                 [u'processed', u'id'],
                 [u'created', u'id'],
+                [u'type', u'processed', u'priority', u'next_attempt_at', u'id'],
                 ]
 
     @property
@@ -309,3 +361,35 @@ class Recipient(FormatMixin, models.Model):
 
     def __unicode__(self):
         return u'[{}] {}'.format(self.pk, self.mail)
+
+class Mailbox(FormatMixin, models.Model):
+    u"""
+    Synchronization state of a remote mailbox we fetch inbound messages from. Remembers the last
+    fetched message UID, so we may fetch only new messages. UIDs are valid only as long as the
+    mailbox UIDVALIDITY does not change.
+    """
+    # May NOT be empty; Unique
+    name = models.CharField(max_length=255, unique=True,
+            help_text=squeeze(u"""
+                Unique mailbox identifier, e.g. "username@host:port/INBOX".
+                """))
+
+    # May be NULL
+    uid_validity = models.BigIntegerField(blank=True, null=True,
+            help_text=squeeze(u"""
+                UIDVALIDITY of the mailbox as reported by the server the last time we fetched
+                messages from it.
+                """))
+
+    # May NOT be NULL
+    last_uid = models.BigIntegerField(default=0,
+            help_text=squeeze(u"""
+                UID of the last fetched message. Only messages with greater UIDs will be fetched.
+                Set it to zero to fetch all messages again.
+                """))
+
+    # Indexes:
+    #  -- name: unique
+
+    def __unicode__(self):
+        return format(self.pk)
@@ -0,0 +1,247 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import re
+import quopri
+import binascii
+import email.parser
+
+from django.core.files.uploadedfile import TemporaryUploadedFile
+
+
+NLCRE_CRACK = re.compile(r'(\r\n|\r|\n)$')
+
+class _LineReader(object):
+    u"""
+    Reads lines from a file stopping at any of active multipart boundaries. Lines are read in
+    chunks of at most ``max_line`` bytes, so a very long line never gets into memory at once.
+    """
+
+    def __init__(self, fp, max_line):
+        self.fp = fp
+        self.max_line = max_line
+        self.boundaries = []
+        self.pushed = None
+        self.at_line_start = True
+
+    def _readline(self):
+        if self.pushed is not None:
+            line, self.pushed = self.pushed, None
+        else:
+            line = self.fp.readline(self.max_line)
+        return line
+
+    def match_boundary(self, line):
+        u"""
+        Returns ``(boundary, is_closing)`` if the line is a boundary of any active multipart, or
+        ``None`` otherwise. RFC 2046 allows trailing whitespace after the boundary.
+        """
+        for boundary in reversed(self.boundaries):
+            match = boundary.match(line)
+            if match:
+                return boundary, bool(match.group(u'end'))
+        return None
+
+    def readline(self):
+        u"""
+        Returns the next line or an empty string if the file ended or the next line is a boundary.
+        """
+        line = self._readline()
+        if line and self.at_line_start and self.match_boundary(line):
+            self.pushed = line
+            return b''
+        self.at_line_start = line.endswith((b'\n', b'\r'))
+        return line
+
+    def boundary(self):
+        u"""
+        Returns ``match_boundary()`` result for the boundary line that stopped ``readline()``, or
+        ``None`` if the file ended.
+        """
+        return self.match_boundary(self.pushed) if self.pushed is not None else None
+
+    def consume(self):
+        u"""
+        Consumes the boundary line that stopped ``readline()``.
+        """
+        self.pushed = None
+        self.at_line_start = True
+
+    def push_boundary(self, boundary):
+        self.boundaries.append(re.compile(
+                b'(?P<sep>' + re.escape(b'--' + boundary) + b')(?P<end>--)?[ \t]*(\r\n|\r|\n)?$'))
+        return self.boundaries[-1]
+
+    def pop_boundary(self):
+        self.boundaries.pop()
+
+
+class _Decoder(object):
+    u"""
+    Incremental decoder of ``Content-Transfer-Encoding``.
+    """
+
+    def __init__(self, encoding):
+        self.encoding = (encoding or u'').lower()
+        self.remainder = b''
+
+    def decode(self, data):
+        if self.encoding == u'base64':
+            data = self.remainder + b''.join(data.split())
+            cut = len(data) - len(data) % 4
+            data, self.remainder = data[:cut], data[cut:]
+            return self._b64decode(data)
+        if self.encoding == u'quoted-printable':
+            return quopri.decodestring(data)
+        return data
+
+    def flush(self):
+        if self.encoding == u'base64' and self.remainder:
+            data, self.remainder = self.remainder, b''
+            return self._b64decode(data + b'=' * (-len(data) % 4))
+        return b''
+
+    def _b64decode(self, data):
+        try:
+            return binascii.a2b_base64(data)
+        except binascii.Error:
+            return b''
+
+
+class StreamedPart(object):
+    u"""
+    Non-multipart part of a streamed message. ``headers`` is ``email.message.Message`` with the
+    part headers only. ``payload`` is the decoded part content. It is a string for inline text
+    parts and ``TemporaryUploadedFile`` for all other parts.
+    """
+
+    def __init__(self, headers, payload):
+        self.headers = headers
+        self.payload = payload
+
+    @property
+    def is_attachment(self):
+        disposition = self.headers.get(u'Content-Disposition', u'')
+        return disposition.strip().lower().startswith(u'attachment')
+
+    @property
+    def is_inline_text(self):
+        content_type = self.headers.get_content_type()
+        return content_type in [u'text/plain', u'text/html'] and not self.is_attachment
+
+    def close(self):
+        if not isinstance(self.payload, basestring):
+            self.payload.close()
+
+
+class StreamingParser(object):
+    u"""
+    Parses a raw RFC 822 message from a file without loading it into memory. Non-multipart parts
+    are decoded incrementally as they are read. Inline text parts are kept in memory, all other
+    parts are spooled to temporary files in ``FILE_UPLOAD_TEMP_DIR``. Multipart structure and
+    encapsulated ``message/rfc822`` messages are flattened in the same order as
+    ``email.message.Message.walk()`` would visit them.
+
+    Example:
+        headers, parts = StreamingParser().parse(fp)
+        try:
+            ...
+        finally:
+            for part in parts:
+                part.close()
+    """
+
+    def __init__(self, max_line=64*1024):
+        self.max_line = max_line
+
+    def parse(self, fp):
+        reader = _LineReader(fp, self.max_line)
+        parts = []
+        try:
+            headers = self._parse_entity(reader, parts)
+        except:
+            for part in parts:
+                part.close()
+            raise
+        return headers, parts
+
+    def _parse_headers(self, reader):
+        lines = []
+        while True:
+            line = reader.readline()
+            if not line or not NLCRE_CRACK.sub(b'', line):
+                break
+            lines.append(line)
+        return email.parser.HeaderParser().parsestr(b''.join(lines), headersonly=True)
+
+    def _parse_entity(self, reader, parts):
+        headers = self._parse_headers(reader)
+        boundary = headers.get_boundary()
+        if headers.get_content_maintype() == u'multipart' and boundary:
+            self._parse_multipart(reader, parts, boundary.encode(u'utf-8'))
+        elif headers.get_content_type() == u'message/rfc822':
+            self._parse_entity(reader, parts)
+        else:
+            parts.append(self._parse_payload(reader, headers))
+        return headers
+
+    def _parse_multipart(self, reader, parts, boundary):
+        own = reader.push_boundary(boundary)
+        closed = False
+        try:
+            # Skip preamble
+            while reader.readline():
+                pass
+            while True:
+                # Stop at the end of file or at a boundary of an outer multipart
+                matched = reader.boundary()
+                if matched is None or matched[0] is not own:
+                    break
+                reader.consume()
+                if matched[1]:
+                    closed = True
+                    break
+                self._parse_entity(reader, parts)
+                # Skip anything left after the subpart
+                while reader.readline():
+                    pass
+        finally:
+            reader.pop_boundary()
+        if closed:
+            # Skip epilogue
+            while reader.readline():
+                pass
+
+    def _parse_payload(self, reader, headers):
+        part = StreamedPart(headers, None)
+        decoder = _Decoder(headers.get(u'Content-Transfer-Encoding', u'').strip())
+        if part.is_inline_text:
+            chunks = []
+            write = chunks.append
+        else:
+            payload = TemporaryUploadedFile(u'attachment', headers.get_content_type(), 0, None)
+            write = payload.write
+
+        # The line break preceding a boundary belongs to the boundary, not to the payload. So we
+        # always hold back the last read line until we know what follows it.
+        previous = None
+        while True:
+            line = reader.readline()
+            if not line:
+                break
+            if previous is not None:
+                write(decoder.decode(previous))
+            previous = line
+        if previous is not None:
+            # Line break is stripped even if the file ends before the closing boundary.
+            if reader.boundary() is not None or reader.boundaries:
+                previous = NLCRE_CRACK.sub(b'', previous)
+            write(decoder.decode(previous))
+        write(decoder.flush())
+
+        if part.is_inline_text:
+            part.payload = b''.join(chunks)
+        else:
+            payload.size = payload.tell()
+            payload.seek(0)
+            part.payload = payload
+        return part
@@ -3,5 +3,8 @@
 from django.dispatch.dispatcher import Signal
 
 
+# Emitted in the transaction the sent message is marked processed in. Changes made by a failing
+# receiver are rolled back, but the message stays processed, so the signal is not emitted again.
 message_sent = Signal(providing_args=['message'])
 message_received = Signal(providing_args=['message'])
+messages_received = Signal(providing_args=['messages'])
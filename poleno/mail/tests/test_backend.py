@@ -2,7 +2,9 @@
 # -*- coding: utf-8 -*-
 from email.mime.text import MIMEText
 from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from . import MailTestCaseMixin
 from ..models import Message, Recipient
@@ -75,6 +77,21 @@ class EmailBackendTest(MailTestCaseMixin, TestCase):
         mail = self._send_email(headers={u'X-Some-Header': u'Some Value', u'X-Another-Header': u'Another Value'})
         self.assertEqual(mail.instance.headers, {u'X-Some-Header': u'Some Value', u'X-Another-Header': u'Another Value'})
 
+    def test_message_priority(self):
+        mail = self._send_email()
+        self.assertEqual(mail.instance.priority, Message.PRIORITIES.NORMAL)
+
+    def test_message_priority_set_by_sender(self):
+        mail = self._call_with_defaults(EmailMessage, {}, {
+            u'subject': u'Default Testing Subject',
+            u'body': u'Default Testing Content',
+            u'from_email': u'default_testing_from@example.com',
+            u'to': [u'default_testing_to@example.com'],
+            })
+        mail.priority = Message.PRIORITIES.URGENT
+        mail.send()
+        self.assertEqual(Message.objects.get(pk=mail.instance.pk).priority, Message.PRIORITIES.URGENT)
+
     def test_message_recipients(self):
         mail = self._send_email(to=[u'Name <to1@a.com>', u'to2@a.com'], cc=[u'cc1@a.com', u'cc2@a.com'], bcc=[u'bcc@a.com'])
         self.assertEqual(mail.instance.to_formatted, u'Name <to1@a.com>, to2@a.com')
@@ -92,6 +109,16 @@ class EmailBackendTest(MailTestCaseMixin, TestCase):
             self.assertEqual(rcpt.status_details, u'')
             self.assertEqual(rcpt.remote_id, u'')
 
+    def test_message_recipients_and_attachments_are_inserted_in_bulk(self):
+        counts = []
+        for n in [1, 10]:
+            with CaptureQueriesContext(connection) as queries:
+                self._send_email(to=[u'to%s@a.com' % i for i in range(n)], cc=[u'cc%s@a.com' % i for i in range(n)],
+                        attachments=[(u'filename%s.txt' % i, u'content', u'text/plain') for i in range(n)])
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(Recipient.objects.count(), 2*11)
+
     def test_message_with_text_body(self):
         mail = self._send_email(body=u'Text content')
         self.assertEqual(mail.instance.text, u'Text content')
@@ -159,6 +186,17 @@ class EmailBackendTest(MailTestCaseMixin, TestCase):
             (u'another.txt', u'text attachment', u'text/plain'),
             ])
 
+    def test_message_with_attachment_instances_shares_their_files(self):
+        msg = self._create_message()
+        attachment = self._create_attachment(generic_object=msg, content=u'%PDF-2.0', name=u'filename.pdf')
+        mail = self._send_email(attachments=[
+            (u'renamed.pdf', attachment, attachment.content_type),
+            ])
+        shared = mail.instance.attachment_set.get()
+        self.assertEqual(shared.file.name, attachment.file.name)
+        self.assertEqual((shared.name, shared.content, shared.content_type, shared.content_hash),
+                (u'renamed.pdf', u'%PDF-2.0', u'application/pdf', attachment.content_hash))
+
     def test_message_with_attachments_as_tuple_with_missing_filename_and_content_type(self):
         mail = self._send_email(attachments=[
             (None, bytearray([1, 65, 2, 0]), None),
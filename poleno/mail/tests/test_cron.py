@@ -14,7 +14,7 @@ from poleno.utils.test import override_signals, created_instances
 from . import MailTestCaseMixin
 from ..models import Message
 from ..cron import mail as mail_cron_job
-from ..signals import message_sent, message_received
+from ..signals import message_sent, message_received, messages_received
 
 
 class MailCronjobTest(MailTestCaseMixin, TestCase):
@@ -30,21 +30,25 @@ class MailCronjobTest(MailTestCaseMixin, TestCase):
 
     def _run_mail_cron_job(self, outbound=False, inbound=False,
             send_message_method=mock.DEFAULT, message_sent_receiver=None,
-            get_messages_method=mock.DEFAULT, message_received_receiver=None):
+            get_messages_method=mock.DEFAULT, message_received_receiver=None,
+            messages_received_receiver=None):
         u"""
-        Mocks mail transport, overrides ``message_sent`` and ``message_received`` signals, calls
-        ``mail`` cron job and eats any stdout printed by the called job.
+        Mocks mail transport, overrides ``message_sent``, ``message_received`` and
+        ``messages_received`` signals, calls ``mail`` cron job and eats any stdout printed by the
+        called job.
         """
         transport = u'poleno.mail.transports.base.BaseTransport'
         outbound_transport = transport if outbound else None
         inbound_transport = transport if inbound else None
         with self.settings(EMAIL_OUTBOUND_TRANSPORT=outbound_transport, EMAIL_INBOUND_TRANSPORT=inbound_transport):
             with mock.patch.multiple(transport, send_message=send_message_method, get_messages=get_messages_method):
-                with override_signals(message_sent, message_received):
+                with override_signals(message_sent, message_received, messages_received):
                     if message_sent_receiver is not None:
                         message_sent.connect(message_sent_receiver)
                     if message_received_receiver is not None:
                         message_received.connect(message_received_receiver)
+                    if messages_received_receiver is not None:
+                        messages_received.connect(messages_received_receiver)
                     mail_cron_job().do()
 
 
@@ -110,11 +114,19 @@ class MailCronjobTest(MailTestCaseMixin, TestCase):
         self.assertItemsEqual(method.mock_calls, [mock.call(m) for m in msgs])
         self.assertItemsEqual(receiver.mock_calls, [mock.call(message=m, sender=None, signal=message_sent) for m in msgs])
 
+    def test_outbound_transport_sends_at_most_batch_size_messages_in_one_batch(self):
+        msgs = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(20)]
+        method = mock.Mock()
+        with self.settings(EMAIL_OUTBOUND_BATCH_SIZE=15):
+            self._run_mail_cron_job(outbound=True, send_message_method=method)
+        self.assertEqual(len(method.mock_calls), 15)
+        self.assertEqual(Message.objects.filter(pk__in=(m.pk for m in msgs)).processed().count(), 15)
+
     def test_outbound_transport_lefts_message_unprocessed_if_exception_raised_while_processing_it(self):
         msgs = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(3)]
 
-        with mock.patch(u'poleno.mail.cron.nop', side_effect=[None, Exception, None]):
-            with mock.patch(u'poleno.mail.cron.cron_logger') as logger:
+        with mock.patch(u'poleno.mail.dispatcher.nop', side_effect=[None, Exception, None]):
+            with mock.patch(u'poleno.mail.dispatcher.cron_logger') as logger:
                 self._run_mail_cron_job(outbound=True)
         self.assertItemsEqual(Message.objects.filter(pk__in=(m.pk for m in msgs)).processed(), [msgs[0], msgs[2]])
         self.assertEqual(len(logger.mock_calls), 3)
@@ -176,6 +188,38 @@ class MailCronjobTest(MailTestCaseMixin, TestCase):
         self._run_mail_cron_job(inbound=True, get_messages_method=method, message_received_receiver=receiver)
         self.assertItemsEqual(receiver.mock_calls, [mock.call(message=msg, sender=None, signal=message_received)])
 
+    def test_inbound_transport_is_not_used_if_inbound_mail_is_pushed_to_idle_listener(self):
+        method = mock.Mock(return_value=[])
+        with self.settings(EMAIL_INBOUND_IDLE=True):
+            self._run_mail_cron_job(inbound=True, get_messages_method=method)
+        self.assertItemsEqual(method.mock_calls, [])
+
+    def test_outbound_transport_is_not_used_if_outbound_mail_is_sent_by_worker(self):
+        self._create_message(type=Message.TYPES.OUTBOUND, processed=None)
+        method = mock.Mock()
+        with self.settings(EMAIL_OUTBOUND_WORKER=True):
+            self._run_mail_cron_job(outbound=True, send_message_method=method)
+        self.assertItemsEqual(method.mock_calls, [])
+
+    def test_inbound_message_processed_concurrently_is_not_processed_again(self):
+        msgs = [self._create_message(type=Message.TYPES.INBOUND, processed=None) for i in range(2)]
+        def now():
+            # Simulates another process processing the second message after we selected it but
+            # before we claimed it.
+            Message.objects.filter(pk=msgs[1].pk).update(processed=utc_now())
+            return utc_now()
+        receiver = mock.Mock()
+        with mock.patch(u'poleno.mail.cron.utc_now', side_effect=now):
+            self._run_mail_cron_job(inbound=True, get_messages_method=lambda t: [], message_received_receiver=receiver)
+        self.assertItemsEqual(receiver.mock_calls, [mock.call(message=msgs[0], sender=None, signal=message_received)])
+
+    def test_inbound_messages_are_processed_in_one_batch(self):
+        msgs = [self._create_message(type=Message.TYPES.INBOUND, processed=None) for i in range(3)]
+        receiver = mock.Mock()
+        self._run_mail_cron_job(inbound=True, get_messages_method=lambda t: [], messages_received_receiver=receiver)
+        self.assertEqual(receiver.call_count, 1)
+        self.assertEqual(receiver.call_args[1][u'messages'], msgs)
+
     def test_inbound_transport_stops_if_exception_raised_while_receiving_message(self):
         msgs = []
         def method(transport): # pragma: no cover
@@ -202,16 +246,19 @@ class MailCronjobTest(MailTestCaseMixin, TestCase):
                 msgs.append(msg)
                 yield msg
 
-        with mock.patch(u'poleno.mail.cron.nop', side_effect=[None, None, None, None, Exception, None]):
+        # Receiving calls ``nop()`` three times, then the batch fails at the second message and
+        # the messages are processed again one by one.
+        with mock.patch(u'poleno.mail.cron.nop', side_effect=[None, None, None, None, Exception, None, Exception, None]):
             with mock.patch(u'poleno.mail.cron.cron_logger') as logger:
                 with created_instances(Message.objects) as message_set:
                     self._run_mail_cron_job(inbound=True, get_messages_method=method)
         self.assertEqual(message_set.count(), 3)
         self.assertItemsEqual(message_set.processed(), [msgs[0], msgs[2]])
-        self.assertEqual(len(logger.mock_calls), 6)
+        self.assertEqual(len(logger.mock_calls), 7)
         self.assertRegexpMatches(logger.mock_calls[0][1][0], u'Received email: <Message: %s>' % msgs[0].pk)
         self.assertRegexpMatches(logger.mock_calls[1][1][0], u'Received email: <Message: %s>' % msgs[1].pk)
         self.assertRegexpMatches(logger.mock_calls[2][1][0], u'Received email: <Message: %s>' % msgs[2].pk)
-        self.assertRegexpMatches(logger.mock_calls[3][1][0], u'Processed received email: <Message: %s>' % msgs[0].pk)
-        self.assertRegexpMatches(logger.mock_calls[4][1][0], u'Processing received email failed: <Message: %s>' % msgs[1].pk)
-        self.assertRegexpMatches(logger.mock_calls[5][1][0], u'Processed received email: <Message: %s>' % msgs[2].pk)
+        self.assertRegexpMatches(logger.mock_calls[3][1][0], u'Processing received emails in batch failed:')
+        self.assertRegexpMatches(logger.mock_calls[4][1][0], u'Processed received email: <Message: %s>' % msgs[0].pk)
+        self.assertRegexpMatches(logger.mock_calls[5][1][0], u'Processing received email failed: <Message: %s>' % msgs[1].pk)
+        self.assertRegexpMatches(logger.mock_calls[6][1][0], u'Processed received email: <Message: %s>' % msgs[2].pk)
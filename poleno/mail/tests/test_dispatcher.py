@@ -0,0 +1,196 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import datetime
+import mock
+
+from django.test import TestCase
+
+from poleno.utils.date import utc_now
+from poleno.utils.test import override_signals
+
+from . import MailTestCaseMixin
+from ..models import Message
+from ..dispatcher import OutboundDispatcher
+from ..signals import message_sent
+from ..transports.base import BaseTransport
+
+
+class OutboundDispatcherTest(MailTestCaseMixin, TestCase):
+    u"""
+    Tests ``OutboundDispatcher`` sending queued outbound messages with one or more workers.
+    """
+
+    def _dispatch(self, send_message_method=mock.DEFAULT, message_sent_receiver=None, **kwargs):
+        with mock.patch.multiple(BaseTransport, send_message=send_message_method):
+            with override_signals(message_sent):
+                if message_sent_receiver is not None:
+                    message_sent.connect(message_sent_receiver)
+                return OutboundDispatcher(BaseTransport, **kwargs).dispatch()
+
+
+    def test_dispatch_with_no_queued_messages(self):
+        method = mock.Mock()
+        sent = self._dispatch(send_message_method=method)
+        self.assertEqual(sent, [])
+        self.assertItemsEqual(method.mock_calls, [])
+
+    def test_dispatch_sends_queued_outbound_messages_only(self):
+        outbound = self._create_message(type=Message.TYPES.OUTBOUND, processed=None)
+        self._create_message(type=Message.TYPES.OUTBOUND, processed=utc_now())
+        self._create_message(type=Message.TYPES.INBOUND, processed=None)
+        method = mock.Mock()
+        sent = self._dispatch(send_message_method=method)
+        self.assertEqual(sent, [outbound])
+        self.assertItemsEqual(method.mock_calls, [mock.call(outbound)])
+
+    def test_dispatch_respects_batch_size(self):
+        msgs = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(5)]
+        method = mock.Mock()
+        sent = self._dispatch(send_message_method=method, batch_size=3)
+        self.assertEqual(sent, msgs[:3])
+        self.assertItemsEqual(method.mock_calls, [mock.call(m) for m in msgs[:3]])
+
+    def test_sent_message_is_marked_processed_before_batch_is_finished(self):
+        msgs = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(2)]
+        def method(message):
+            if message == msgs[1]:
+                self.assertIsNotNone(Message.objects.get(pk=msgs[0].pk).processed)
+        self._dispatch(send_message_method=mock.Mock(side_effect=method))
+        self.assertEqual(Message.objects.processed().count(), 2)
+
+    def test_dispatch_with_exhausted_time_budget_sends_nothing(self):
+        self._create_message(type=Message.TYPES.OUTBOUND, processed=None)
+        method = mock.Mock()
+        sent = self._dispatch(send_message_method=method, time_budget=0)
+        self.assertEqual(sent, [])
+        self.assertItemsEqual(method.mock_calls, [])
+        self.assertFalse(Message.objects.processed().exists())
+
+    def test_dispatch_marks_sent_messages_processed_and_emits_message_sent(self):
+        msgs = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(3)]
+        receiver = mock.Mock()
+        self._dispatch(message_sent_receiver=receiver)
+        for msg in Message.objects.filter(pk__in=(m.pk for m in msgs)):
+            self.assertAlmostEqual(msg.processed, utc_now(), delta=datetime.timedelta(seconds=10))
+        self.assertItemsEqual(receiver.mock_calls,
+                [mock.call(message=m, sender=None, signal=message_sent) for m in msgs])
+
+    def test_dispatch_keeps_message_processed_if_message_sent_receiver_fails(self):
+        msg = self._create_message(type=Message.TYPES.OUTBOUND, processed=None)
+        receiver = mock.Mock(side_effect=Exception)
+        with mock.patch(u'poleno.mail.dispatcher.cron_logger') as logger:
+            self._dispatch(message_sent_receiver=receiver)
+        self.assertIsNotNone(Message.objects.get(pk=msg.pk).processed)
+        self.assertRegexpMatches(logger.error.call_args[0][0],
+                u'Processing sent email failed: <Message: %s>' % msg.pk)
+
+    def test_message_sent_is_emitted_with_marking_message_processed(self):
+        msgs = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(2)]
+        def receiver(message, **kwargs):
+            self.assertIsNotNone(Message.objects.get(pk=message.pk).processed)
+        receiver = mock.Mock(side_effect=receiver)
+        def method(message):
+            if message == msgs[1]:
+                self.assertItemsEqual(receiver.mock_calls,
+                        [mock.call(message=msgs[0], sender=None, signal=message_sent)])
+        self._dispatch(send_message_method=mock.Mock(side_effect=method),
+                message_sent_receiver=receiver)
+        self.assertEqual(receiver.call_count, 2)
+
+    def test_dispatch_with_multiple_workers_sends_every_message_exactly_once(self):
+        msgs = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(10)]
+        method = mock.Mock()
+        sent = self._dispatch(send_message_method=method, workers=4)
+        self.assertItemsEqual(sent, msgs)
+        self.assertItemsEqual(method.mock_calls, [mock.call(m) for m in msgs])
+        self.assertEqual(Message.objects.filter(pk__in=(m.pk for m in msgs)).processed().count(), 10)
+
+    def test_dispatch_with_multiple_workers_opens_one_transport_per_worker(self):
+        for i in range(10):
+            self._create_message(type=Message.TYPES.OUTBOUND, processed=None)
+        with mock.patch.object(BaseTransport, u'connect') as connect:
+            self._dispatch(workers=3)
+        self.assertEqual(connect.call_count, 3)
+
+    def test_dispatch_with_given_transport_does_not_open_new_connection(self):
+        msgs = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(3)]
+        transport = mock.Mock()
+        with mock.patch.object(BaseTransport, u'connect') as connect:
+            with override_signals(message_sent):
+                sent = OutboundDispatcher(BaseTransport, workers=3).dispatch(transport=transport)
+        self.assertEqual(sent, msgs)
+        self.assertItemsEqual(transport.send_message.mock_calls, [mock.call(m) for m in msgs])
+        self.assertEqual(connect.call_count, 0)
+
+    def test_queued_messages_are_taken_from_priority_lanes_by_weighted_round_robin(self):
+        low = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None, priority=Message.PRIORITIES.LOW) for i in range(5)]
+        normal = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None, priority=Message.PRIORITIES.NORMAL) for i in range(5)]
+        urgent = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None, priority=Message.PRIORITIES.URGENT) for i in range(5)]
+        with self.settings(EMAIL_OUTBOUND_PRIORITY_WEIGHTS={u'URGENT': 3, u'HIGH': 2, u'NORMAL': 2, u'LOW': 1}):
+            dispatcher = OutboundDispatcher(BaseTransport, batch_size=10)
+        result = dispatcher.queued_messages()
+        self.assertEqual(result, urgent[:3] + normal[:2] + low[:1] + urgent[3:5] + normal[2:4])
+
+    def test_urgent_messages_are_not_stuck_behind_bulk_messages(self):
+        bulk = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None, priority=Message.PRIORITIES.LOW) for i in range(20)]
+        urgent = self._create_message(type=Message.TYPES.OUTBOUND, processed=None, priority=Message.PRIORITIES.URGENT)
+        sent = self._dispatch(batch_size=5)
+        self.assertEqual(sent[0], urgent)
+        self.assertEqual(sent[1:], bulk[:4])
+
+    def test_dispatch_schedules_failed_message_for_retry(self):
+        msg = self._create_message(type=Message.TYPES.OUTBOUND, processed=None)
+        method = mock.Mock(side_effect=Exception(u'Testing failure'))
+        with self.settings(EMAIL_OUTBOUND_RETRY_DELAY=60):
+            sent = self._dispatch(send_message_method=method)
+        msg = Message.objects.get(pk=msg.pk)
+        self.assertEqual(sent, [])
+        self.assertIsNone(msg.processed)
+        self.assertEqual(msg.attempts, 1)
+        self.assertAlmostEqual(msg.next_attempt_at, utc_now() + datetime.timedelta(seconds=60), delta=datetime.timedelta(seconds=10))
+        self.assertIn(u'Testing failure', msg.last_error)
+
+    def test_dispatch_skips_failed_message_until_its_next_attempt(self):
+        failing = self._create_message(type=Message.TYPES.OUTBOUND, processed=None)
+        method = mock.Mock(side_effect=Exception)
+        self._dispatch(send_message_method=method)
+        other = self._create_message(type=Message.TYPES.OUTBOUND, processed=None)
+        method = mock.Mock()
+        sent = self._dispatch(send_message_method=method)
+        self.assertEqual(sent, [other])
+        self.assertItemsEqual(method.mock_calls, [mock.call(other)])
+
+    def test_dispatch_poisoned_messages_do_not_starve_queue(self):
+        poisoned = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(3)]
+        healthy = [self._create_message(type=Message.TYPES.OUTBOUND, processed=None) for i in range(3)]
+        def method(message):
+            if message in poisoned:
+                raise Exception
+        self._dispatch(send_message_method=mock.Mock(side_effect=method), batch_size=3)
+        sent = self._dispatch(send_message_method=mock.Mock(side_effect=method), batch_size=3)
+        self.assertEqual(sent, healthy)
+
+    def test_backoff_grows_exponentially_up_to_max_delay(self):
+        with self.settings(EMAIL_OUTBOUND_RETRY_DELAY=60, EMAIL_OUTBOUND_RETRY_MAX_DELAY=600, EMAIL_OUTBOUND_MAX_ATTEMPTS=10):
+            dispatcher = OutboundDispatcher(BaseTransport)
+        delays = [dispatcher.backoff(a) for a in range(1, 11)]
+        self.assertEqual(delays, [datetime.timedelta(seconds=s) for s in [60, 120, 240, 480, 600, 600, 600, 600, 600]] + [None])
+
+    def test_dispatch_gives_up_message_after_max_attempts(self):
+        msg = self._create_message(type=Message.TYPES.OUTBOUND, processed=None, attempts=2)
+        method = mock.Mock(side_effect=Exception)
+        with self.settings(EMAIL_OUTBOUND_MAX_ATTEMPTS=3):
+            with mock.patch(u'poleno.mail.dispatcher.cron_logger') as logger:
+                self._dispatch(send_message_method=method)
+        msg = Message.objects.get(pk=msg.pk)
+        self.assertEqual(msg.attempts, 3)
+        self.assertIsNone(msg.next_attempt_at)
+        self.assertItemsEqual(Message.objects.dead(), [msg])
+        self.assertRegexpMatches(logger.mock_calls[-1][1][0], u'Sending email given up after 3 attempts: <Message: %s>' % msg.pk)
+
+    def test_dispatch_increments_attempts_of_sent_messages(self):
+        msg = self._create_message(type=Message.TYPES.OUTBOUND, processed=None, attempts=1)
+        self._dispatch()
+        msg = Message.objects.get(pk=msg.pk)
+        self.assertEqual(msg.attempts, 2)
+        self.assertIsNotNone(msg.processed)
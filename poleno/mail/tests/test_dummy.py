@@ -7,7 +7,7 @@ from poleno.utils.test import override_signals, created_instances
 from . import MailTestCaseMixin
 from ..models import Message, Recipient
 from ..cron import mail as mail_cron_job
-from ..signals import message_sent, message_received
+from ..signals import message_sent, message_received, messages_received
 
 
 class DummyTransportTest(MailTestCaseMixin, TestCase):
@@ -21,7 +21,7 @@ class DummyTransportTest(MailTestCaseMixin, TestCase):
                 u'EMAIL_INBOUND_TRANSPORT': u'poleno.mail.transports.dummy.DummyTransport',
                 }
         with self.settings(**overrides):
-            with override_signals(message_sent, message_received):
+            with override_signals(message_sent, message_received, messages_received):
                 mail_cron_job().do()
 
 
@@ -1,7 +1,10 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import re
 import mock
+import socket
 import datetime
+from imaplib import IMAP4
 from textwrap import dedent
 
 from django.conf import settings
@@ -11,9 +14,10 @@ from poleno.utils.date import utc_now
 from poleno.utils.test import override_signals
 
 from . import MailTestCaseMixin
-from ..models import Message, Recipient
+from ..models import Message, Recipient, Mailbox
 from ..cron import mail as mail_cron_job
-from ..signals import message_sent, message_received
+from ..transports.imap import ImapTransport
+from ..signals import message_sent, message_received, messages_received
 
 
 class ImapTransportTest(MailTestCaseMixin, TestCase):
@@ -48,7 +52,23 @@ class ImapTransportTest(MailTestCaseMixin, TestCase):
                     --===============1111111111==--""")
         return u'%s\n\n%s' % (headers, body)
 
-    def _run_mail_cron_job(self, transport=None, ssl_transport=None, mails=[], delete_settings=(), **override_settings):
+    def _uid_side_effect(self, mails):
+        # Mail UIDs are their 1-based indexes in ``mails``.
+        def uid(command, *args):
+            if command == u'SEARCH':
+                start = int(args[1].split(u' ')[1].split(u':')[0])
+                uids = [k for k in range(1, len(mails)+1) if k >= start] or [len(mails)]
+                return [u'OK', [u' '.join(str(k) for k in uids if k)]]
+            if command == u'FETCH' and args[1] == u'(RFC822.SIZE)':
+                return [u'OK', [u'%s (UID %s RFC822.SIZE %s)' % (k, k, len(mails[int(k)-1])) for k in args[0].split(u',')]]
+            if command == u'FETCH':
+                offset, size = (int(n) for n in re.match(r'\(BODY\.PEEK\[\]<(\d+)\.(\d+)>\)$', args[1]).groups())
+                content = mails[int(args[0])-1][offset:offset+size]
+                return [u'OK', [(u'%s (UID %s BODY[]<%s> {%s}' % (args[0], args[0], offset, len(content)), content), u')']]
+            return [u'OK', [None]]
+        return uid
+
+    def _run_mail_cron_job(self, transport=None, ssl_transport=None, mails=[], uid_validity=1, delete_settings=(), **override_settings):
         overrides = {
                 u'EMAIL_OUTBOUND_TRANSPORT': None,
                 u'EMAIL_INBOUND_TRANSPORT': u'poleno.mail.transports.imap.ImapTransport',
@@ -61,8 +81,8 @@ class ImapTransportTest(MailTestCaseMixin, TestCase):
         overrides.update(override_settings)
 
         transport = mock.Mock()
-        transport.return_value.search.return_value = [None, [u' '.join(str(k) for k in range(len(mails)))]]
-        transport.return_value.fetch.side_effect = lambda k, _: [None, [[None, mails[int(k)]]]]
+        transport.return_value.response.return_value = [u'UIDVALIDITY', [str(uid_validity) if uid_validity else None]]
+        transport.return_value.uid.side_effect = self._uid_side_effect(mails)
         imap4 = transport if not overrides[u'IMAP_SSL'] else None
         imap4ssl = transport if overrides[u'IMAP_SSL'] else None
 
@@ -70,7 +90,7 @@ class ImapTransportTest(MailTestCaseMixin, TestCase):
             for name in delete_settings:
                 delattr(settings, name)
             with mock.patch.multiple(u'poleno.mail.transports.imap', IMAP4=imap4, IMAP4_SSL=imap4ssl):
-                with override_signals(message_sent, message_received):
+                with override_signals(message_sent, message_received, messages_received):
                     mail_cron_job().do()
 
         return transport
@@ -105,7 +125,9 @@ class ImapTransportTest(MailTestCaseMixin, TestCase):
             mock.call(u'testhost.com', 2000),
             mock.call().login(u'TestUser', u'big_secret'),
             mock.call().select(),
-            mock.call().search(None, u'ALL'),
+            mock.call().select(),
+            mock.call().response(u'UIDVALIDITY'),
+            mock.call().uid(u'SEARCH', None, u'UID 1:*'),
             mock.call().close(),
             mock.call().logout(),
             ])
@@ -117,11 +139,13 @@ class ImapTransportTest(MailTestCaseMixin, TestCase):
             mock.call(u'testhost.com', 2000),
             mock.call().login(u'TestUser', u'big_secret'),
             mock.call().select(),
-            mock.call().search(None, u'ALL'),
-            mock.call().fetch(u'0', '(RFC822)'),
-            mock.call().store(u'0', u'+FLAGS', u'\\Deleted'),
-            mock.call().fetch(u'1', '(RFC822)'),
-            mock.call().store(u'1', u'+FLAGS', u'\\Deleted'),
+            mock.call().select(),
+            mock.call().response(u'UIDVALIDITY'),
+            mock.call().uid(u'SEARCH', None, u'UID 1:*'),
+            mock.call().uid(u'FETCH', u'1,2', u'(RFC822.SIZE)'),
+            mock.call().uid(u'FETCH', u'1', u'(BODY.PEEK[]<0.1048576>)'),
+            mock.call().uid(u'FETCH', u'2', u'(BODY.PEEK[]<0.1048576>)'),
+            mock.call().uid(u'STORE', u'1,2', u'+FLAGS.SILENT', u'(\\Deleted)'),
             mock.call().expunge(),
             mock.call().close(),
             mock.call().logout(),
@@ -130,16 +154,142 @@ class ImapTransportTest(MailTestCaseMixin, TestCase):
     def test_mail_stored_to_database_and_deleted_from_imap(self):
         mail = self._create_mail()
         transport = self._run_mail_cron_job(mails=[mail])
-        transport.return_value.store.assert_called_once_with(u'0', u'+FLAGS', u'\\Deleted')
+        transport.return_value.uid.assert_called_with(u'STORE', u'1', u'+FLAGS.SILENT', u'(\\Deleted)')
         self.assertEqual(Message.objects.count(), 1)
 
     def test_mail_stored_to_database_and_deleted_from_imap_with_multiple_mails_in_inbox(self):
         mails = [self._create_mail() for k in range(10)]
         transport = self._run_mail_cron_job(mails=mails)
-        expected_calls = [mock.call(str(k), u'+FLAGS', u'\\Deleted') for k in range(10)]
-        self.assertEqual(transport.return_value.store.mock_calls, expected_calls)
+        expected_calls = [mock.call(u'STORE', u','.join(str(k) for k in range(1, 11)), u'+FLAGS.SILENT', u'(\\Deleted)')]
+        self.assertEqual([c for c in transport.return_value.uid.mock_calls if c[1][0] == u'STORE'], expected_calls)
         self.assertEqual(Message.objects.count(), 10)
 
+    def test_mails_fetched_and_deleted_in_batches(self):
+        mails = [self._create_mail() for k in range(7)]
+        transport = self._run_mail_cron_job(mails=mails, IMAP_FETCH_BATCH_SIZE=3)
+        self.assertEqual([c for c in transport.return_value.mock_calls if c[0] != u'uid' or c[1][0] != u'SEARCH' and c[1][2] != u'(BODY.PEEK[]<0.1048576>)'][4:], [
+            mock.call.uid(u'FETCH', u'1,2,3', u'(RFC822.SIZE)'),
+            mock.call.uid(u'STORE', u'1,2,3', u'+FLAGS.SILENT', u'(\\Deleted)'),
+            mock.call.expunge(),
+            mock.call.uid(u'FETCH', u'4,5,6', u'(RFC822.SIZE)'),
+            mock.call.uid(u'STORE', u'4,5,6', u'+FLAGS.SILENT', u'(\\Deleted)'),
+            mock.call.expunge(),
+            mock.call.uid(u'FETCH', u'7', u'(RFC822.SIZE)'),
+            mock.call.uid(u'STORE', u'7', u'+FLAGS.SILENT', u'(\\Deleted)'),
+            mock.call.expunge(),
+            mock.call.close(),
+            mock.call.logout(),
+            ])
+        self.assertEqual(Message.objects.count(), 7)
+
+    def test_mail_fetched_in_chunks(self):
+        mails = [self._create_mail(body=dedent(u"""\
+                --===============1111111111==
+                MIME-Version: 1.0
+                Content-Type: text/plain; charset="utf-8"
+                Content-Transfer-Encoding: 7bit
+
+                {}
+                --===============1111111111==--""").format(u'x' * 300))]
+        transport = self._run_mail_cron_job(mails=mails, IMAP_FETCH_CHUNK_SIZE=64)
+        expected_calls = [mock.call(u'FETCH', u'1', u'(BODY.PEEK[]<{}.64>)'.format(k)) for k in range(0, len(mails[0]), 64)]
+        self.assertEqual([c for c in transport.return_value.uid.mock_calls if c[1][0] == u'FETCH'][1:], expected_calls)
+        self.assertEqual(Message.objects.get().text, u'x' * 300)
+
+    def test_mail_gone_from_server_is_skipped(self):
+        mails = [self._create_mail(), self._create_mail()]
+        uid = self._uid_side_effect(mails)
+        transport = ImapTransport()
+        transport.connection = mock.Mock()
+        transport.connection.response.return_value = [u'UIDVALIDITY', [u'1']]
+        transport.connection.uid.side_effect = lambda command, *args: (
+                [u'OK', [None]] if command == u'FETCH' and args[0] == u'1' else uid(command, *args))
+        self.assertEqual(len(list(transport.get_messages())), 1)
+        transport.connection.uid.assert_called_with(u'STORE', u'2', u'+FLAGS.SILENT', u'(\\Deleted)')
+
+    def test_last_fetched_uid_is_remembered(self):
+        mails = [self._create_mail() for k in range(3)]
+        self._run_mail_cron_job(mails=mails, IMAP_HOST=u'testhost.com', IMAP_PORT=2000, IMAP_USERNAME=u'TestUser')
+        mailbox = Mailbox.objects.get()
+        self.assertEqual(mailbox.name, u'TestUser@testhost.com:2000/INBOX')
+        self.assertEqual(mailbox.uid_validity, 1)
+        self.assertEqual(mailbox.last_uid, 3)
+
+    def test_already_fetched_mails_are_not_fetched_again(self):
+        mails = [self._create_mail() for k in range(3)]
+        self._run_mail_cron_job(mails=mails)
+        transport = self._run_mail_cron_job(mails=mails + [self._create_mail()])
+        self.assertEqual([c for c in transport.return_value.uid.mock_calls if c[1][0] != u'STORE'], [
+            mock.call(u'SEARCH', None, u'UID 4:*'),
+            mock.call(u'FETCH', u'4', u'(RFC822.SIZE)'),
+            mock.call(u'FETCH', u'4', u'(BODY.PEEK[]<0.1048576>)'),
+            ])
+        self.assertEqual(Message.objects.count(), 4)
+
+    def test_highest_uid_matched_by_search_is_not_fetched_again(self):
+        mails = [self._create_mail() for k in range(3)]
+        self._run_mail_cron_job(mails=mails)
+        transport = self._run_mail_cron_job(mails=mails)
+        self.assertEqual(transport.return_value.uid.mock_calls, [
+            mock.call(u'SEARCH', None, u'UID 4:*'),
+            ])
+        self.assertEqual(Message.objects.count(), 3)
+
+    def test_all_mails_are_fetched_again_if_uid_validity_changes(self):
+        mails = [self._create_mail() for k in range(3)]
+        self._run_mail_cron_job(mails=mails, uid_validity=1)
+        transport = self._run_mail_cron_job(mails=mails, uid_validity=2)
+        self.assertIn(mock.call(u'SEARCH', None, u'UID 1:*'), transport.return_value.uid.mock_calls)
+        self.assertEqual(Message.objects.count(), 6)
+        self.assertEqual(Mailbox.objects.get().uid_validity, 2)
+
+    def test_unparsable_mail_is_skipped_but_not_deleted_and_fetched_again(self):
+        mails = [self._create_mail(headers={u'Subject': u'=?invalid?q?Invalid?='}), self._create_mail()]
+        transport = self._run_mail_cron_job(mails=mails)
+        transport.return_value.uid.assert_called_with(u'STORE', u'2', u'+FLAGS.SILENT', u'(\\Deleted)')
+        self.assertEqual(Message.objects.count(), 1)
+        self.assertEqual(Mailbox.objects.get().last_uid, 0)
+        transport = self._run_mail_cron_job(mails=mails[:1])
+        self.assertIn(mock.call(u'SEARCH', None, u'UID 1:*'), transport.return_value.uid.mock_calls)
+
+    def test_remembered_uids_are_kept_if_uid_validity_is_missing(self):
+        mails = [self._create_mail() for k in range(3)]
+        self._run_mail_cron_job(mails=mails, uid_validity=1)
+        transport = self._run_mail_cron_job(mails=mails, uid_validity=None)
+        self.assertIn(mock.call(u'SEARCH', None, u'UID 4:*'), transport.return_value.uid.mock_calls)
+        self.assertEqual(Message.objects.count(), 3)
+        self.assertEqual(Mailbox.objects.get().uid_validity, 1)
+
+    def test_get_messages_called_twice_on_one_connection(self):
+        mails = [self._create_mail() for k in range(3)]
+        connection = mock.Mock()
+        connection.response.return_value = [u'UIDVALIDITY', [u'1']]
+        connection.uid.side_effect = self._uid_side_effect(mails)
+        transport = ImapTransport()
+        transport.connection = connection
+        self.assertEqual(len(list(transport.get_messages())), 3)
+        self.assertEqual(len(list(transport.get_messages())), 0)
+        self.assertEqual([c for c in connection.uid.mock_calls if c[1][0] == u'SEARCH'], [
+            mock.call(u'SEARCH', None, u'UID 1:*'),
+            mock.call(u'SEARCH', None, u'UID 4:*'),
+            ])
+        self.assertEqual(connection.select.call_count, 2)
+
+    def test_mail_after_stopped_batch_is_deleted_only_if_stored(self):
+        mails = [self._create_mail() for k in range(3)]
+        transport = ImapTransport()
+        transport.connection = mock.Mock()
+        transport.connection.response.return_value = [u'UIDVALIDITY', [u'1']]
+        transport.connection.uid.side_effect = self._uid_side_effect(mails)
+        messages = transport.get_messages()
+        next(messages)
+        next(messages)
+        messages.close()
+        self.assertEqual([c for c in transport.connection.uid.mock_calls if c[1][0] == u'STORE'], [
+            mock.call(u'STORE', u'1', u'+FLAGS.SILENT', u'(\\Deleted)'),
+            ])
+        self.assertEqual(Mailbox.objects.get().last_uid, 2)
+
     def test_mail_marked_as_inbound(self):
         mail = self._create_mail()
         transport = self._run_mail_cron_job(mails=[mail])
@@ -478,3 +628,41 @@ class ImapTransportTest(MailTestCaseMixin, TestCase):
                 --===============1111111111==--"""))
         transport = self._run_mail_cron_job(mails=[mail])
         self.assertEqual(Message.objects.count(), 0)
+
+    def _idle(self, lines):
+        transport = ImapTransport()
+        transport.connection = mock.Mock()
+        transport.connection.error = IMAP4.error
+        transport.connection.abort = IMAP4.abort
+        transport.connection.readline.side_effect = lines
+        return transport, transport.idle(60)
+
+    def test_idle_returns_true_if_new_messages_announced(self):
+        transport, announced = self._idle([b'+ idling\r\n', b'* 1 RECENT\r\n', b'* 3 EXISTS\r\n', b'idle1 OK IDLE terminated\r\n'])
+        self.assertTrue(announced)
+        self.assertEqual(transport.connection.send.mock_calls, [mock.call(b'idle1 IDLE\r\n'), mock.call(b'DONE\r\n')])
+
+    def test_idle_returns_false_after_timeout(self):
+        transport, announced = self._idle([b'+ idling\r\n', socket.timeout, b'idle1 OK IDLE terminated\r\n'])
+        self.assertFalse(announced)
+        self.assertEqual(transport.connection.send.mock_calls, [mock.call(b'idle1 IDLE\r\n'), mock.call(b'DONE\r\n')])
+        self.assertEqual(transport.connection.socket.return_value.settimeout.mock_calls, [mock.call(60), mock.call(None)])
+
+    def test_idle_raises_error_if_idle_not_supported(self):
+        with self.assertRaisesMessage(IMAP4.error, u'IDLE command failed: idle1 BAD Unknown command'):
+            self._idle([b'idle1 BAD Unknown command\r\n'])
+
+    def test_idle_raises_abort_if_connection_closed(self):
+        with self.assertRaisesMessage(IMAP4.abort, u'Connection closed while idling.'):
+            self._idle([b'+ idling\r\n', b''])
+
+    def test_idle_uses_new_tag_every_time(self):
+        transport, _ = self._idle([b'+ idling\r\n', b'* 3 EXISTS\r\n', b'idle1 OK IDLE terminated\r\n'])
+        transport.connection.readline.side_effect = [b'+ idling\r\n', b'* 4 EXISTS\r\n', b'idle2 OK IDLE terminated\r\n']
+        self.assertTrue(transport.idle(60))
+        self.assertEqual(transport.connection.send.mock_calls[2], mock.call(b'idle2 IDLE\r\n'))
+
+    def test_idle_ignores_responses_for_other_tags(self):
+        transport, announced = self._idle([b'+ idling\r\n', b'* 3 EXISTS\r\n', b'idle10 OK\r\n', b'idle1 OK IDLE terminated\r\n'])
+        self.assertTrue(announced)
+        self.assertEqual(transport.connection.readline.call_count, 4)
@@ -0,0 +1,207 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import socket
+import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import TestCase
+
+from poleno.utils.test import override_signals
+
+from . import MailTestCaseMixin
+from ..models import Message
+from ..cron import mail as mail_cron_job
+from ..signals import message_sent, message_received, messages_received
+from ..transports.base import BaseTransport
+
+
+class IdleTransport(BaseTransport):
+    def idle(self, timeout):
+        raise NotImplementedError
+
+class MailManagementTestMixin(MailTestCaseMixin):
+
+    def _stop_after(self, iterations, side_effect=None):
+        u"""
+        Returns a mock to replace ``time.sleep()`` of the command with. The command loops forever,
+        so the mock stops it by raising ``KeyboardInterrupt`` on its ``iterations``-th call. Calls
+        before that run ``side_effect`` if given.
+        """
+        calls = []
+        def sleep(seconds):
+            calls.append(seconds)
+            if len(calls) >= iterations:
+                raise KeyboardInterrupt
+            if side_effect is not None:
+                side_effect()
+        return mock.Mock(side_effect=sleep)
+
+class MailworkerManagementTest(MailManagementTestMixin, TestCase):
+    u"""
+    Tests ``mailworker`` management command. The transport is mocked and the command loop is
+    stopped after a fixed number of iterations.
+    """
+    transport = u'poleno.mail.transports.base.BaseTransport'
+    command = u'poleno.mail.management.commands.mailworker'
+
+    def _call_mailworker(self, sleep, connect_method=mock.DEFAULT, send_message_method=mock.DEFAULT,
+            message_sent_receiver=None, **kwargs):
+        with self.settings(EMAIL_OUTBOUND_TRANSPORT=self.transport, EMAIL_OUTBOUND_WORKER=True):
+            with mock.patch.multiple(self.transport, connect=connect_method,
+                    send_message=send_message_method):
+                with mock.patch.multiple(self.command, time=mock.DEFAULT,
+                        close_old_connections=mock.DEFAULT) as patched:
+                    patched[u'time'].sleep = sleep
+                    patched[u'time'].time.return_value = 0
+                    with override_signals(message_sent):
+                        if message_sent_receiver is not None:
+                            message_sent.connect(message_sent_receiver)
+                        call_command(u'mailworker', **kwargs)
+
+
+    def test_queued_message_is_sent(self):
+        msg = self._create_message(type=Message.TYPES.OUTBOUND, processed=None)
+        method, receiver = mock.Mock(), mock.Mock()
+        self._call_mailworker(self._stop_after(1), send_message_method=method,
+                message_sent_receiver=receiver)
+        msg = Message.objects.get(pk=msg.pk)
+        self.assertIsNotNone(msg.processed)
+        self.assertItemsEqual(method.mock_calls, [mock.call(msg)])
+        self.assertItemsEqual(receiver.mock_calls,
+                [mock.call(message=msg, sender=None, signal=message_sent)])
+
+    def test_message_queued_meanwhile_is_sent_after_next_poll(self):
+        msgs = []
+        def queue():
+            msgs.append(self._create_message(type=Message.TYPES.OUTBOUND, processed=None))
+        method = mock.Mock()
+        sleep = self._stop_after(2, side_effect=queue)
+        self._call_mailworker(sleep, send_message_method=method, poll_interval=0.5)
+        self.assertItemsEqual(method.mock_calls, [mock.call(msgs[0])])
+        self.assertEqual(sleep.mock_calls, [mock.call(0.5), mock.call(0.5)])
+
+    def test_no_message_is_sent_if_none_is_queued(self):
+        method = mock.Mock()
+        self._call_mailworker(self._stop_after(3), send_message_method=method)
+        self.assertItemsEqual(method.mock_calls, [])
+
+    def test_worker_reconnects_after_transport_failure(self):
+        msg = self._create_message(type=Message.TYPES.OUTBOUND, processed=None)
+        connect = mock.Mock(side_effect=[socket.error(u'Testing failure'), None])
+        method = mock.Mock()
+        sleep = self._stop_after(2)
+        with mock.patch(self.command + u'.cron_logger') as logger:
+            self._call_mailworker(sleep, connect_method=connect, send_message_method=method,
+                    retry_interval=15)
+        self.assertEqual(connect.call_count, 2)
+        self.assertEqual(sleep.call_args_list[0], mock.call(15))
+        self.assertRegexpMatches(logger.error.call_args[0][0], u'Sending outbound emails failed')
+        self.assertItemsEqual(method.mock_calls, [mock.call(Message.objects.get(pk=msg.pk))])
+
+    def test_worker_fails_without_outbound_transport(self):
+        with self.settings(EMAIL_OUTBOUND_TRANSPORT=None):
+            with self.assertRaisesMessage(ImproperlyConfigured,
+                    u'Setting EMAIL_OUTBOUND_TRANSPORT is not set.'):
+                call_command(u'mailworker')
+
+    def test_message_is_sent_by_worker_not_by_cron_job(self):
+        msg = self._create_message(type=Message.TYPES.OUTBOUND, processed=None)
+        method = mock.Mock()
+        with self.settings(EMAIL_OUTBOUND_TRANSPORT=self.transport, EMAIL_OUTBOUND_WORKER=True):
+            with mock.patch.multiple(self.transport, send_message=method):
+                with override_signals(message_sent, message_received, messages_received):
+                    mail_cron_job().do()
+        self.assertItemsEqual(method.mock_calls, [])
+        self._call_mailworker(self._stop_after(1), send_message_method=method)
+        self.assertItemsEqual(method.mock_calls, [mock.call(Message.objects.get(pk=msg.pk))])
+
+class MailidleManagementTest(MailManagementTestMixin, TestCase):
+    u"""
+    Tests ``mailidle`` management command. The transport is mocked and the command loop is
+    stopped after a fixed number of iterations.
+    """
+    transport = u'poleno.mail.tests.test_management.IdleTransport'
+    command = u'poleno.mail.management.commands.mailidle'
+
+    def _receive(self, *batches):
+        u"""
+        Returns a mock to replace ``get_messages()`` of the transport with. Every call receives
+        the next batch of messages.
+        """
+        batches = list(batches)
+        def get_messages():
+            for kwargs in batches.pop(0) if batches else []:
+                yield self._create_message(type=Message.TYPES.INBOUND, processed=None, **kwargs)
+        return mock.Mock(side_effect=get_messages)
+
+    def _call_mailidle(self, idle, connect_method=mock.DEFAULT, get_messages_method=mock.DEFAULT,
+            message_received_receiver=None, sleep=None, **kwargs):
+        with self.settings(EMAIL_INBOUND_TRANSPORT=self.transport, EMAIL_INBOUND_IDLE=True):
+            with mock.patch.multiple(self.transport, connect=connect_method,
+                    get_messages=get_messages_method, idle=idle):
+                with mock.patch.multiple(self.command, time=mock.DEFAULT,
+                        close_old_connections=mock.DEFAULT) as patched:
+                    patched[u'time'].sleep = sleep or mock.Mock()
+                    with override_signals(message_received, messages_received):
+                        if message_received_receiver is not None:
+                            message_received.connect(message_received_receiver)
+                        call_command(u'mailidle', **kwargs)
+
+
+    def test_messages_are_received_and_processed_before_idling_and_after_announcement(self):
+        method = self._receive([{}], [{}, {}])
+        receiver = mock.Mock()
+        idle = mock.Mock(side_effect=[True, KeyboardInterrupt])
+        self._call_mailidle(idle, get_messages_method=method, message_received_receiver=receiver,
+                idle_timeout=300)
+        self.assertEqual(method.call_count, 2)
+        self.assertEqual(idle.mock_calls, [mock.call(300), mock.call(300)])
+        msgs = Message.objects.inbound()
+        self.assertEqual(len(msgs), 3)
+        self.assertItemsEqual(receiver.mock_calls,
+                [mock.call(message=m, sender=None, signal=message_received) for m in msgs])
+        self.assertFalse(Message.objects.not_processed().exists())
+
+    def test_idle_is_renewed_after_timeout(self):
+        method = self._receive()
+        idle = mock.Mock(side_effect=[False, False, KeyboardInterrupt])
+        self._call_mailidle(idle, get_messages_method=method)
+        self.assertEqual(method.call_count, 3)
+        self.assertEqual(idle.call_count, 3)
+
+    def test_listener_reconnects_after_transport_failure(self):
+        method = self._receive([], [{}])
+        connect = mock.Mock()
+        idle = mock.Mock(side_effect=[socket.error(u'Testing failure'), KeyboardInterrupt])
+        sleep = mock.Mock()
+        with mock.patch(self.command + u'.cron_logger') as logger:
+            self._call_mailidle(idle, connect_method=connect, get_messages_method=method,
+                    sleep=sleep, retry_interval=15)
+        self.assertEqual(connect.call_count, 2)
+        self.assertEqual(sleep.mock_calls, [mock.call(15)])
+        self.assertRegexpMatches(logger.error.call_args[0][0],
+                u'Listening for inbound emails failed')
+        self.assertEqual(Message.objects.inbound().count(), 1)
+
+    def test_listener_fails_without_inbound_transport(self):
+        with self.settings(EMAIL_INBOUND_TRANSPORT=None):
+            with self.assertRaisesMessage(ImproperlyConfigured,
+                    u'Setting EMAIL_INBOUND_TRANSPORT is not set.'):
+                call_command(u'mailidle')
+
+    def test_listener_fails_if_transport_does_not_support_idle(self):
+        with self.settings(EMAIL_INBOUND_TRANSPORT=u'poleno.mail.transports.base.BaseTransport'):
+            with self.assertRaisesMessage(ImproperlyConfigured, u'does not support IDLE'):
+                call_command(u'mailidle')
+
+    def test_messages_are_received_by_listener_not_by_cron_job(self):
+        method = self._receive([{}])
+        with self.settings(EMAIL_INBOUND_TRANSPORT=self.transport, EMAIL_INBOUND_IDLE=True):
+            with mock.patch.multiple(self.transport, get_messages=method):
+                with override_signals(message_sent, message_received, messages_received):
+                    mail_cron_job().do()
+        self.assertEqual(method.call_count, 0)
+        self._call_mailidle(mock.Mock(side_effect=KeyboardInterrupt), get_messages_method=method)
+        self.assertEqual(method.call_count, 1)
+        self.assertEqual(Message.objects.inbound().count(), 1)
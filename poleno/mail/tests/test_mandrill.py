@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 import json
 import mock
+import base64
 import contextlib
 
 from django.core.exceptions import ImproperlyConfigured
@@ -17,8 +18,8 @@ from poleno.utils.urls import reverse
 from . import MailTestCaseMixin
 from ..models import Message, Recipient
 from ..cron import mail as mail_cron_job
-from ..signals import message_sent, message_received
-from ..transports.mandrill.signals import webhook_event, message_status_webhook_event, inbound_email_webhook_event
+from ..signals import message_sent, message_received, messages_received
+from ..transports.mandrill.signals import webhook_event, webhook_events, message_status_webhook_events, inbound_email_webhook_event
 
 
 class MandrillTransportTest(MailTestCaseMixin, TestCase):
@@ -54,19 +55,26 @@ class MandrillTransportTest(MailTestCaseMixin, TestCase):
                 }
         overrides.update(override_settings)
 
+        # The payload is a temporary file closed after the request, so we read it immediately
+        posts = []
+        def post(url, data):
+            posts.append(Bunch(url=url, data=json.loads(data.read())))
+            return mock.DEFAULT
+
         requests = mock.Mock()
-        requests.post.return_value.status_code = status_code
-        requests.post.return_value.text = u'Response text'
-        requests.post.return_value.json.return_value = response
+        session = requests.Session.return_value
+        session.post.side_effect = post
+        session.post.return_value.status_code = status_code
+        session.post.return_value.text = u'Response text'
+        session.post.return_value.json.return_value = response
 
         with self.settings(**overrides):
             for name in delete_settings:
                 delattr(settings, name)
             with mock.patch(u'poleno.mail.transports.mandrill.transport.requests', requests):
-                with override_signals(message_sent, message_received):
+                with override_signals(message_sent, message_received, messages_received):
                     mail_cron_job().do()
 
-        posts = [Bunch(url=call[0][0], data=json.loads(call[1][u'data'])) for call in requests.post.call_args_list]
         return posts
 
 
@@ -80,7 +88,7 @@ class MandrillTransportTest(MailTestCaseMixin, TestCase):
         msg = self._create_message()
         rcpt = self._create_recipient(message=msg)
         logger = mock.Mock()
-        with mock.patch(u'poleno.mail.cron.cron_logger', logger):
+        with mock.patch(u'poleno.mail.dispatcher.cron_logger', logger):
             self._run_mail_cron_job(status_code=404)
         logged = logger.error.call_args[0][0]
         self.assertIn(u'Sending email failed: <Message: %s>' % msg.pk, logged)
@@ -219,6 +227,14 @@ class MandrillTransportTest(MailTestCaseMixin, TestCase):
             {u'content': u'JVBERi0yLjA=', u'type': u'application/pdf', u'name': u'filename.pdf'},
             ])
 
+    def test_large_message_attachment_encoded_in_chunks(self):
+        msg = self._create_message()
+        rcpt = self._create_recipient(message=msg)
+        content = b''.join(chr(i % 256) for i in range(100000))
+        attch = self._create_attachment(generic_object=msg, content=content, name=u'filename.bin')
+        requests = self._run_mail_cron_job()
+        self.assertEqual(base64.b64decode(requests[0].data[u'message'][u'attachments'][0][u'content']), content)
+
     def test_response_id_saved_as_recipient_remote_id(self):
         msg = self._create_message()
         rcpt = self._create_recipient(message=msg, mail=u'rcpt@a.com')
@@ -315,7 +331,7 @@ class WebhookViewTest(MailTestCaseMixin, ViewTestCaseMixin, TestCase):
         with self.settings(**overrides):
             for name in delete_settings:
                 delattr(settings, name)
-            with override_signals(webhook_event):
+            with override_signals(webhook_event, webhook_events):
                 with patch_logger(u'django.security.SuspiciousOperation', u'error') as self.log_messages:
                     yield
 
@@ -436,6 +452,23 @@ class WebhookViewTest(MailTestCaseMixin, ViewTestCaseMixin, TestCase):
             mock.call(signal=webhook_event, data={u'_id': u'remote-3', u'event': u'click'}, event_type=u'click', sender=None),
             ])
 
+    def test_post_request_with_valid_data_emits_one_batched_webhook_events(self):
+        events = [
+                {u'event': u'deferral', u'_id': u'remote-1'},
+                {u'event': u'soft_bounce', u'_id': u'remote-2'},
+                {u'event': u'click', u'_id': u'remote-3'},
+                ]
+        with self._overrides(MANDRILL_WEBHOOK_URL=u'https://testhost/', MANDRILL_WEBHOOK_KEYS=[u'testkey']):
+            receiver = mock.Mock()
+            webhook_events.connect(receiver)
+            response = self.client.post(self._webhook_url(), secure=True,
+                    data={u'mandrill_events': json.dumps(events)},
+                    HTTP_X_MANDRILL_SIGNATURE=u'e/e0y1qBZghx4pyHFFoRrtgqmWg=')
+        self._check_response(response)
+        self.assertItemsEqual(receiver.mock_calls, [
+            mock.call(signal=webhook_events, events=events, sender=None),
+            ])
+
     def test_post_request_with_valid_data_rolls_back_if_exception_raised(self):
         def receiver(*args, **kwargs):
             self._create_message()
@@ -464,7 +497,7 @@ class WebhookViewTest(MailTestCaseMixin, ViewTestCaseMixin, TestCase):
 
 class MessageStatusWebhookEventTest(MailTestCaseMixin, TestCase):
     u"""
-    Tests ``message_status_webhook_event()`` event receiver.
+    Tests ``message_status_webhook_events()`` event receiver.
     """
 
     def _create_message(self, **kwargs):
@@ -477,12 +510,12 @@ class MessageStatusWebhookEventTest(MailTestCaseMixin, TestCase):
 
 
     def test_event_receiver_is_registered(self):
-        self.assertIn(message_status_webhook_event, webhook_event._live_receivers(sender=None))
+        self.assertIn(message_status_webhook_events, webhook_events._live_receivers(sender=None))
 
     def _test_event_type_changing_recipient_status(self, event_type, status):
         msg = self._create_message()
         rcpt = self._create_recipient(message=msg, remote_id=u'remote-1')
-        message_status_webhook_event(sender=None, event_type=event_type, data={u'_id': u'remote-1'})
+        message_status_webhook_events(sender=None, events=[{u'event': event_type, u'_id': u'remote-1'}])
         rcpt = Recipient.objects.get(pk=rcpt.pk)
         self.assertEqual(rcpt.status, status)
         self.assertEqual(rcpt.status_details, event_type)
@@ -514,7 +547,7 @@ class MessageStatusWebhookEventTest(MailTestCaseMixin, TestCase):
     def test_event_type_inbound_does_nothing(self):
         msg = self._create_message()
         rcpt = self._create_recipient(message=msg, remote_id=u'remote-1', status=Recipient.STATUSES.UNDEFINED, status_details=u'details')
-        message_status_webhook_event(sender=None, event_type=u'inbound', data={u'_id': u'remote-1'})
+        message_status_webhook_events(sender=None, events=[{u'event': u'inbound', u'_id': u'remote-1'}])
         rcpt = Recipient.objects.get(pk=rcpt.pk)
         self.assertEqual(rcpt.status, Recipient.STATUSES.UNDEFINED)
         self.assertEqual(rcpt.status_details, u'details')
@@ -522,7 +555,7 @@ class MessageStatusWebhookEventTest(MailTestCaseMixin, TestCase):
     def test_other_event_types_do_nothing(self):
         msg = self._create_message()
         rcpt = self._create_recipient(message=msg, remote_id=u'remote-1', status=Recipient.STATUSES.UNDEFINED, status_details=u'details')
-        message_status_webhook_event(sender=None, event_type=u'other', data={u'_id': u'remote-1'})
+        message_status_webhook_events(sender=None, events=[{u'event': u'other', u'_id': u'remote-1'}])
         rcpt = Recipient.objects.get(pk=rcpt.pk)
         self.assertEqual(rcpt.status, Recipient.STATUSES.UNDEFINED)
         self.assertEqual(rcpt.status_details, u'details')
@@ -531,7 +564,7 @@ class MessageStatusWebhookEventTest(MailTestCaseMixin, TestCase):
         msg = self._create_message()
         rcpt1 = self._create_recipient(message=msg, remote_id=u'remote-1', status=Recipient.STATUSES.UNDEFINED, status_details=u'details')
         rcpt2 = self._create_recipient(message=msg, remote_id=u'remote-1', status=Recipient.STATUSES.UNDEFINED, status_details=u'details')
-        message_status_webhook_event(sender=None, event_type=u'deferral', data={u'_id': u'remote-1'})
+        message_status_webhook_events(sender=None, events=[{u'event': u'deferral', u'_id': u'remote-1'}])
         rcpt1 = Recipient.objects.get(pk=rcpt1.pk)
         rcpt2 = Recipient.objects.get(pk=rcpt2.pk)
         self.assertEqual(rcpt1.status, Recipient.STATUSES.UNDEFINED)
@@ -542,11 +575,33 @@ class MessageStatusWebhookEventTest(MailTestCaseMixin, TestCase):
     def test_remote_id_matching_no_recipients_does_nothing(self):
         msg = self._create_message()
         rcpt = self._create_recipient(message=msg, remote_id=u'remote-1', status=Recipient.STATUSES.UNDEFINED, status_details=u'details')
-        message_status_webhook_event(sender=None, event_type=u'deferral', data={u'_id': u'remote-2'})
+        message_status_webhook_events(sender=None, events=[{u'event': u'deferral', u'_id': u'remote-2'}])
         rcpt = Recipient.objects.get(pk=rcpt.pk)
         self.assertEqual(rcpt.status, Recipient.STATUSES.UNDEFINED)
         self.assertEqual(rcpt.status_details, u'details')
 
+    def test_multiple_events_are_applied_with_constant_number_of_queries(self):
+        msg = self._create_message()
+        rcpts = [self._create_recipient(message=msg, remote_id=u'remote-%s' % i) for i in range(20)]
+        events = [{u'event': u'send' if i % 2 else u'open', u'_id': u'remote-%s' % i} for i in range(20)]
+        with self.assertNumQueries(3):
+            message_status_webhook_events(sender=None, events=events)
+        for i, rcpt in enumerate(rcpts):
+            rcpt = Recipient.objects.get(pk=rcpt.pk)
+            self.assertEqual(rcpt.status, Recipient.STATUSES.SENT if i % 2 else Recipient.STATUSES.OPENED)
+
+    def test_last_event_for_the_same_recipient_wins(self):
+        msg = self._create_message()
+        rcpt = self._create_recipient(message=msg, remote_id=u'remote-1')
+        message_status_webhook_events(sender=None, events=[
+                {u'event': u'deferral', u'_id': u'remote-1'},
+                {u'event': u'send', u'_id': u'remote-1'},
+                {u'event': u'open', u'_id': u'remote-1'},
+                ])
+        rcpt = Recipient.objects.get(pk=rcpt.pk)
+        self.assertEqual(rcpt.status, Recipient.STATUSES.OPENED)
+        self.assertEqual(rcpt.status_details, u'open')
+
 class InboundEmailWebhookEvent(MailTestCaseMixin, TestCase):
     u"""
     Tests ``inbound_email_webhook_event()`` event receiver.
@@ -1,6 +1,7 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 import random
+import datetime
 
 from django.db import IntegrityError
 from django.test import TestCase
@@ -306,6 +307,34 @@ class MessageModelTest(MailTestCaseMixin, TestCase):
         result = Message.objects.not_processed()
         self.assertItemsEqual(result, [obj1, obj2])
 
+    def test_attempts_next_attempt_at_and_last_error_fields_with_default_values_if_omitted(self):
+        msg = self._create_message()
+        self.assertEqual(msg.attempts, 0)
+        self.assertAlmostEqual(msg.next_attempt_at, utc_now(), delta=datetime.timedelta(seconds=10))
+        self.assertEqual(msg.last_error, u'')
+
+    def test_ready_and_dead_query_methods(self):
+        now = utc_now()
+        obj1 = self._create_message(type=Message.TYPES.OUTBOUND, processed=None, next_attempt_at=now)
+        obj2 = self._create_message(type=Message.TYPES.OUTBOUND, processed=None, next_attempt_at=now - datetime.timedelta(hours=1))
+        obj3 = self._create_message(type=Message.TYPES.OUTBOUND, processed=None, next_attempt_at=now + datetime.timedelta(hours=1))
+        obj4 = self._create_message(type=Message.TYPES.OUTBOUND, processed=None, next_attempt_at=None)
+        obj5 = self._create_message(type=Message.TYPES.OUTBOUND, processed=now, next_attempt_at=now)
+        obj6 = self._create_message(type=Message.TYPES.INBOUND, processed=None, next_attempt_at=now)
+        result = Message.objects.ready(now)
+        self.assertItemsEqual(result, [obj1, obj2])
+        result = Message.objects.ready(now + datetime.timedelta(hours=2))
+        self.assertItemsEqual(result, [obj1, obj2, obj3])
+        result = Message.objects.dead()
+        self.assertItemsEqual(result, [obj4])
+
+    def test_order_by_next_attempt_at_query_method(self):
+        now = utc_now()
+        offsets = [3, 1, 1, 1, 2, 0, 5, 2]
+        msgs = [self._create_message(next_attempt_at=now + datetime.timedelta(minutes=o)) for o in offsets]
+        result = Message.objects.order_by_next_attempt_at()
+        self.assertEqual(list(result), sorted(msgs, key=lambda o: (o.next_attempt_at, o.pk)))
+
     def test_order_by_pk_query_method(self):
         msgs = [self._create_message() for i in range(20)]
         sample = random.sample(msgs, 10)
@@ -0,0 +1,121 @@
+# vim: expandtab
+# -*- coding: utf-8 -*-
+import email
+import base64
+from StringIO import StringIO
+from textwrap import dedent
+
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.test import TestCase
+
+from ..parser import StreamingParser
+
+
+class StreamingParserTest(TestCase):
+    u"""
+    Tests ``StreamingParser`` comparing its results with ``email.message.Message.walk()``.
+    """
+
+    def _parse(self, raw, **kwargs):
+        headers, parts = StreamingParser(**kwargs).parse(StringIO(raw))
+        self.addCleanup(lambda: [p.close() for p in parts])
+        return headers, parts
+
+    def _payload(self, part):
+        if isinstance(part.payload, basestring):
+            return part.payload
+        return part.payload.read()
+
+    def _assert_same_as_email_parser(self, raw, **kwargs):
+        headers, parts = self._parse(raw, **kwargs)
+        expected = [p for p in email.message_from_string(raw).walk() if not p.is_multipart()]
+        self.assertEqual(headers.items(), email.message_from_string(raw).items())
+        self.assertEqual([p.headers.get_content_type() for p in parts],
+                [p.get_content_type() for p in expected])
+        self.assertEqual([self._payload(p) for p in parts],
+                [p.get_payload(decode=True) for p in expected])
+        return parts
+
+
+    def test_simple_message(self):
+        parts = self._assert_same_as_email_parser(dedent(u"""\
+                Subject: Testing
+                Content-Type: text/plain; charset="utf-8"
+
+                Text content
+                on two lines.
+                """).encode(u'utf-8'))
+        self.assertEqual(len(parts), 1)
+
+    def test_multipart_message_with_attachments(self):
+        pdf = b''.join(chr(i % 256) for i in range(5000))
+        parts = self._assert_same_as_email_parser(dedent(u"""\
+                Subject: Testing
+                Content-Type: multipart/mixed; boundary="===1=="
+
+                Preamble
+                --===1==
+                Content-Type: multipart/alternative; boundary="===2=="
+
+                --===2==
+                Content-Type: text/plain; charset="utf-8"
+                Content-Transfer-Encoding: quoted-printable
+
+                P=C5=99=C3=ADli=C5=A1 =C5=BElu=C5=A5ou=C4=8Dk=C3=BD k=C5=AF=C5=88
+                --===2==
+                Content-Type: text/html; charset="utf-8"
+
+                <p>Html content</p>
+                --===2==--
+                --===1==
+                Content-Type: application/pdf
+                Content-Disposition: attachment; filename="filename.pdf"
+                Content-Transfer-Encoding: base64
+
+                {}
+                --===1==--
+                Epilogue
+                """).format(base64.encodestring(pdf).strip()).encode(u'utf-8'))
+        self.assertEqual([p.is_inline_text for p in parts], [True, True, False])
+        self.assertIsInstance(parts[2].payload, TemporaryUploadedFile)
+        self.assertEqual(parts[2].payload.size, len(pdf))
+        self.assertEqual(parts[2].headers.get_filename(), u'filename.pdf')
+
+    def test_encapsulated_message(self):
+        self._assert_same_as_email_parser(dedent(u"""\
+                Subject: Testing
+                Content-Type: multipart/mixed; boundary="===1=="
+
+                --===1==
+                Content-Type: message/rfc822
+
+                Subject: Encapsulated
+                Content-Type: text/plain
+
+                Encapsulated content
+                --===1==--
+                """).encode(u'utf-8'))
+
+    def test_unterminated_multipart(self):
+        self._assert_same_as_email_parser(dedent(u"""\
+                Subject: Testing
+                Content-Type: multipart/mixed; boundary="===1=="
+
+                --===1==
+                Content-Type: text/plain
+
+                Text content
+                """).encode(u'utf-8'))
+
+    def test_lines_longer_than_max_line_are_read_in_chunks(self):
+        content = u'x' * 1000 + u'\n--===1==x\n' + u'y' * 1000
+        self._assert_same_as_email_parser(dedent(u"""\
+                Subject: Testing
+                Content-Type: multipart/mixed; boundary="===1=="
+
+                --===1==
+                Content-Type: application/octet-stream
+
+                {}
+                --===1==--
+                """).format(content).encode(u'utf-8'), max_line=64)
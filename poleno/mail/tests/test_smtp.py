@@ -1,10 +1,11 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 import mock
+import email
+import smtplib
 from textwrap import dedent
 from collections import defaultdict
 
-from django.core.mail import BadHeaderError
 from django.test import TestCase
 
 from poleno.timewarp import timewarp
@@ -15,7 +16,8 @@ from poleno.utils.test import override_signals
 from . import MailTestCaseMixin
 from ..models import Message, Recipient
 from ..cron import mail as mail_cron_job
-from ..signals import message_sent, message_received
+from ..transports.smtp import SmtpTransport
+from ..signals import message_sent, message_received, messages_received
 
 
 class SmtpTransportTest(MailTestCaseMixin, TestCase):
@@ -40,19 +42,29 @@ class SmtpTransportTest(MailTestCaseMixin, TestCase):
         res = {k: v for k, v in dd.iteritems()}
         return res
 
-    def _run_mail_cron_job(self):
+    def _create_connection(self):
         connection = mock.Mock()
+        smtp = connection.connection
+        smtp.mail.return_value = (250, u'OK')
+        smtp.rcpt.return_value = (250, u'OK')
+        smtp.docmd.return_value = (354, u'Start mail input')
+        smtp.getreply.return_value = (250, u'OK')
+        return connection
+
+    def _run_mail_cron_job(self, connection=None):
+        connection = connection or self._create_connection()
         with self.settings(EMAIL_OUTBOUND_TRANSPORT=u'poleno.mail.transports.smtp.SmtpTransport', EMAIL_INBOUND_TRANSPORT=None):
             with mock.patch(u'poleno.mail.transports.smtp.get_connection', return_value=connection):
-                with override_signals(message_sent, message_received):
+                with override_signals(message_sent, message_received, messages_received):
                     mail_cron_job().do()
         res = []
-        for call in connection.send_messages.call_args_list:
-            for mail in call[0][0]:
-                as_bytes = mail.message().as_bytes()
-                headers, body = as_bytes.split(u'\n\n', 1)
-                headers = self._parse_headers(headers)
-                res.append(Bunch(headers=headers, body=body, as_bytes=as_bytes))
+        data = b''.join(call[0][0] for call in connection.connection.send.call_args_list)
+        for mail in data.split(b'\r\n.\r\n')[:-1]:
+            lines = mail.split(b'\r\n')
+            as_bytes = b'\n'.join(l[1:] if l.startswith(b'.') else l for l in lines)
+            headers, body = as_bytes.split(u'\n\n', 1)
+            headers = self._parse_headers(headers)
+            res.append(Bunch(headers=headers, body=body, as_bytes=as_bytes))
         return res
 
 
@@ -102,11 +114,17 @@ class SmtpTransportTest(MailTestCaseMixin, TestCase):
         result = self._run_mail_cron_job()
         self.assertEqual(result[0].headers[u'Subject'], [u''])
 
-    def test_message_with_subject_with_linebreak_raises_exception(self):
+    def test_message_with_subject_with_linebreak_is_given_up(self):
         msg = self._create_message(subject=u'Subject\nwith\nnew\nlines')
         rcpt = self._create_recipient(message=msg)
-        with self.assertRaisesMessage(BadHeaderError, u"Header values can't contain newlines"):
-            result = self._run_mail_cron_job()
+        connection = self._create_connection()
+        result = self._run_mail_cron_job(connection=connection)
+        self.assertEqual(result, [])
+        self.assertFalse(connection.connection.mail.called)
+        msg = Message.objects.get(pk=msg.pk)
+        self.assertIsNone(msg.processed)
+        self.assertIsNone(msg.next_attempt_at)
+        self.assertIn(u"BadHeaderError: Header values can't contain newlines", msg.last_error)
 
     def test_message_with_text_body_only(self):
         msg = self._create_message(text=u'Text content', omit=[u'html'])
@@ -223,6 +241,52 @@ class SmtpTransportTest(MailTestCaseMixin, TestCase):
                 <html><body>content</body></html>
                 --===============.*==--"""))
 
+    def test_message_with_binary_attachment(self):
+        msg = self._create_message(text=u'Text content')
+        rcpt = self._create_recipient(message=msg)
+        content = b'%PDF-1.4\n' + b''.join(chr(i % 256) for i in range(100000))
+        attch = self._create_attachment(generic_object=msg, content=content, name=u'filename.pdf')
+        result = self._run_mail_cron_job()
+        self.assertRegexpMatches(result[0].body, dedent(u"""\
+                --===============.*==
+                Content-Type: application/pdf
+                MIME-Version: 1.0
+                Content-Transfer-Encoding: base64
+                Content-Disposition: attachment; filename="filename.pdf"
+                """))
+        part = email.message_from_string(result[0].as_bytes).get_payload()[1]
+        self.assertEqual(part.get_payload(decode=True), content)
+
+    def test_message_with_large_text_attachment(self):
+        msg = self._create_message(text=u'Text content')
+        rcpt = self._create_recipient(message=msg)
+        content = b''.join(b'.Line {}\n'.format(i) for i in range(20000))
+        attch = self._create_attachment(generic_object=msg, content=content, name=u'filename.txt')
+        result = self._run_mail_cron_job()
+        self.assertRegexpMatches(result[0].body, dedent(u"""\
+                --===============.*==
+                Content-Type: text/plain
+                MIME-Version: 1.0
+                Content-Transfer-Encoding: base64
+                Content-Disposition: attachment; filename="filename.txt"
+                """))
+        part = email.message_from_string(result[0].as_bytes).get_payload()[1]
+        self.assertEqual(part.get_payload(decode=True), content)
+
+    def test_message_data_is_sent_in_chunks(self):
+        msg = self._create_message(text=u'.Text content starting with a dot')
+        rcpt = self._create_recipient(message=msg)
+        content = b'%PDF-1.4\n' + b''.join(chr(i % 256) for i in range(300000))
+        attch = self._create_attachment(generic_object=msg, content=content, name=u'filename.pdf')
+        connection = self._create_connection()
+        result = self._run_mail_cron_job(connection=connection)
+        self.assertGreater(connection.connection.send.call_count, 1)
+        for call in connection.connection.send.call_args_list:
+            self.assertLess(len(call[0][0]), 2 * SmtpTransport.SEND_CHUNK_SIZE)
+        self.assertIn(u'\n.Text content starting with a dot', result[0].body)
+        part = email.message_from_string(result[0].as_bytes).get_payload()[1]
+        self.assertEqual(part.get_payload(decode=True), content)
+
     def test_message_with_to_and_cc_recipients(self):
         msg = self._create_message()
         to1 = self._create_recipient(message=msg, name=u'To Recipient1', mail=u'to1@a.com', type=Recipient.TYPES.TO)
@@ -280,3 +344,27 @@ class SmtpTransportTest(MailTestCaseMixin, TestCase):
         self.assertEqual(to.status, Recipient.STATUSES.SENT)
         self.assertEqual(cc.status, Recipient.STATUSES.SENT)
         self.assertEqual(bcc.status, Recipient.STATUSES.SENT)
+
+    def test_dropped_connection_is_reopened_before_message_data(self):
+        msg = self._create_message()
+        rcpt = self._create_recipient(message=msg)
+        connection = self._create_connection()
+        connection.connection.mail.side_effect = [smtplib.SMTPServerDisconnected, (250, u'OK')]
+        result = self._run_mail_cron_job(connection=connection)
+        self.assertEqual(len(result), 1)
+        self.assertEqual([c[0] for c in connection.mock_calls if not c[0].startswith(u'connection.')], [u'open', u'open', u'close', u'open', u'close'])
+        self.assertEqual(connection.connection.mail.call_count, 2)
+        self.assertIsNotNone(Message.objects.get(pk=msg.pk).processed)
+
+    def test_dropped_connection_after_message_data_is_not_retried(self):
+        msg = self._create_message()
+        rcpt = self._create_recipient(message=msg)
+        connection = self._create_connection()
+        connection.connection.getreply.side_effect = smtplib.SMTPServerDisconnected
+        result = self._run_mail_cron_job(connection=connection)
+        self.assertEqual(connection.connection.mail.call_count, 1)
+        self.assertEqual(connection.connection.send.call_count, 1)
+        msg = Message.objects.get(pk=msg.pk)
+        self.assertIsNone(msg.processed)
+        self.assertEqual(msg.attempts, 1)
+        self.assertIsNotNone(msg.next_attempt_at)
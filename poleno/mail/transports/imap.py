@@ -1,19 +1,26 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import re
+import socket
 import email
+import tempfile
+import traceback
 import email.message
+from contextlib import contextmanager
 from email.utils import parseaddr
 from imaplib import IMAP4, IMAP4_SSL, IMAP4_PORT, IMAP4_SSL_PORT
 
 from django.core.files.base import ContentFile
 from django.conf import settings
 
+from poleno.cron import cron_logger
 from poleno.attachments.models import Attachment
 from poleno.utils.mail import full_decode_header
 from poleno.utils.misc import guess_extension
 
 from .base import BaseTransport
-from ..models import Message, Recipient
+from ..models import Message, Recipient, Mailbox
+from ..parser import StreamingParser
 
 
 class ImapTransport(BaseTransport):
@@ -24,8 +31,11 @@ class ImapTransport(BaseTransport):
         self.port = getattr(settings, u'IMAP_PORT', IMAP4_SSL_PORT if self.ssl else IMAP4_PORT)
         self.username = getattr(settings, u'IMAP_USERNAME', u'')
         self.password = getattr(settings, u'IMAP_PASSWORD', u'')
+        self.fetch_batch_size = getattr(settings, u'IMAP_FETCH_BATCH_SIZE', 20)
+        self.fetch_chunk_size = getattr(settings, u'IMAP_FETCH_CHUNK_SIZE', 1024*1024)
         self.transport = IMAP4_SSL if self.ssl else IMAP4
         self.connection = None
+        self._idle_count = 0
 
     def connect(self):
         self.connection = self.transport(self.host, self.port)
@@ -37,6 +47,57 @@ class ImapTransport(BaseTransport):
         self.connection.logout()
         self.connection = None
 
+    @contextmanager
+    def _idling(self):
+        u"""
+        Keeps the connection in IMAP IDLE state (RFC 2177) while the block runs. The block may read
+        untagged server responses with ``connection.readline()``. If the block raises, the
+        connection is left idling and should be dropped.
+
+        ``imaplib`` does not support IDLE command, so the command is sent with its public ``send()``
+        and ``readline()`` methods under our own tag. The tag is lowercase, so it never clashes with
+        tags generated by ``imaplib``.
+        """
+        self._idle_count += 1
+        tag = b'idle{}'.format(self._idle_count)
+        self.connection.send(b'{} IDLE\r\n'.format(tag))
+        line = self.connection.readline()
+        if not line.startswith(b'+'):
+            raise self.connection.error(u'IDLE command failed: {}'.format(line.strip()))
+        yield
+
+        self.connection.send(b'DONE\r\n')
+        while True:
+            line = self.connection.readline()
+            if not line:
+                raise self.connection.abort(u'Connection closed while idling.')
+            if line.startswith(tag + b' '):
+                if not line[len(tag):].strip().startswith(b'OK'):
+                    raise self.connection.error(u'IDLE command failed: {}'.format(line.strip()))
+                break
+
+    def idle(self, timeout):
+        u"""
+        Waits in IMAP IDLE state until the server announces new messages, or until ``timeout``
+        seconds pass. Returns ``True`` if new messages were announced. Servers drop idling clients
+        after 30 minutes, so the timeout should be shorter.
+        """
+        announced = False
+        sock = self.connection.socket()
+        with self._idling():
+            sock.settimeout(timeout)
+            try:
+                while not announced:
+                    line = self.connection.readline()
+                    if not line:
+                        raise self.connection.abort(u'Connection closed while idling.')
+                    announced = bool(re.match(br'\* \d+ EXISTS', line))
+            except socket.timeout:
+                pass
+            finally:
+                sock.settimeout(None)
+        return announced
+
     def _decode_content(self, content, charset):
         try:
             decoded = content.decode(charset, u'replace') if charset else content
@@ -51,7 +112,7 @@ class ImapTransport(BaseTransport):
         except LookupError as e:
             raise email.errors.MessageParseError(e)
 
-    def _decode_message(self, msg):
+    def _decode_message(self, msg, parts):
         assert isinstance(msg, email.message.Message)
 
         headers = {name: self._decode_header(value) for name, value in msg.items()}
@@ -62,23 +123,21 @@ class ImapTransport(BaseTransport):
         text = u''
         html = u''
         attachments = []
-        for part in msg.walk():
-            if part.is_multipart():
-                continue
-            content_type = part.get_content_type()
-            charset = part.get_content_charset()
-            content = part.get_payload(decode=True)
-            disposition = self._decode_header(part.get(u'Content-Disposition', u''))
-            is_attachment = disposition.startswith(u'attachment')
-            if not text and content_type == u'text/plain' and not is_attachment:
-                text = self._decode_content(content, charset)
-            elif not html and content_type == u'text/html' and not is_attachment:
-                html = self._decode_content(content, charset)
+        for part in parts:
+            content_type = part.headers.get_content_type()
+            charset = part.headers.get_content_charset()
+            if not text and content_type == u'text/plain' and part.is_inline_text:
+                text = self._decode_content(part.payload, charset)
+            elif not html and content_type == u'text/html' and part.is_inline_text:
+                html = self._decode_content(part.payload, charset)
             else:
                 default = u'attachment{}'.format(guess_extension(content_type))
-                filename = part.get_filename(default)
+                filename = part.headers.get_filename(default)
+                # Inline text parts are small and kept in memory, other parts are already spooled
+                # to temporary files by the parser.
+                content = ContentFile(part.payload) if part.is_inline_text else part.payload
                 attachments.append(Attachment(
-                        file=ContentFile(content),
+                        file=content,
                         name=filename,
                         ))
 
@@ -111,27 +170,119 @@ class ImapTransport(BaseTransport):
 
         for recipient in recipients:
             recipient.message = message
-            recipient.save()
+        Recipient.objects.bulk_create(recipients)
 
         for attachment in attachments:
             attachment.generic_object = message
-            attachment.save()
+        Attachment.objects.bulk_save(attachments)
 
         return message
 
+    def _get_mailbox(self):
+        name = u'{}@{}:{}/INBOX'.format(self.username, self.host, self.port)
+        mailbox, _ = Mailbox.objects.get_or_create(name=name)
+        # ``imaplib`` pops untagged responses when they are read, so the mailbox is selected again
+        # to get its current UIDVALIDITY on every call, even on a long-lived connection.
+        self.connection.select()
+        _, uid_validity = self.connection.response(u'UIDVALIDITY')
+        uid_validity = int(uid_validity[0]) if uid_validity and uid_validity[0] else None
+        if uid_validity is None:
+            # Without UIDVALIDITY we can't tell if remembered UIDs are still valid. We keep them,
+            # as fetched messages are deleted anyway.
+            return mailbox
+        if uid_validity != mailbox.uid_validity:
+            # Remembered UIDs are no longer valid.
+            mailbox.uid_validity = uid_validity
+            mailbox.last_uid = 0
+        return mailbox
+
+    def _parse_fetch_sizes(self, data):
+        # Every fetched size is a line ``b'<seq> (UID <uid> RFC822.SIZE <size>)'``.
+        for item in data:
+            if isinstance(item, tuple):
+                item = item[0]
+            match = re.search(r'\bUID (\d+)', item or b'')
+            size = re.search(r'\bRFC822\.SIZE (\d+)', item or b'')
+            if match and size:
+                yield int(match.group(1)), int(size.group(1))
+
+    def _fetch_message(self, uid, size):
+        u"""
+        Fetches the raw message into a temporary file in ``FILE_UPLOAD_TEMP_DIR``. The message is
+        fetched in partial ranges of at most ``IMAP_FETCH_CHUNK_SIZE`` bytes, so a large message
+        never gets into memory at once. Returns ``None`` if the message is gone from the server.
+        """
+        fp = tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR)
+        try:
+            for offset in range(0, max(size, 1), self.fetch_chunk_size):
+                _, data = self.connection.uid(u'FETCH', str(uid),
+                        u'(BODY.PEEK[]<{}.{}>)'.format(offset, self.fetch_chunk_size))
+                # Every fetched range is a pair ``(b'<seq> (UID <uid> BODY[]<<offset>> {<size>}',
+                # b'<raw>')`` followed by a closing ``b')'``.
+                chunks = [item[1] for item in data if isinstance(item, tuple)]
+                if not chunks:
+                    if offset == 0:
+                        fp.close()
+                        return None
+                    break
+                fp.write(chunks[0])
+                if len(chunks[0]) < self.fetch_chunk_size:
+                    break
+            fp.seek(0)
+            return fp
+        except:
+            fp.close()
+            raise
+
     def get_messages(self):
-        # Based on django_mailbox.transports.imap.ImapTransport
-        _, inbox = self.connection.search(None, u'ALL')
-        if inbox[0]:
-            for key in inbox[0].split():
-                try:
-                    _, contents = self.connection.fetch(key, '(RFC822)')
-                    msg = email.message_from_string(contents[0][1])
-                    message = self._decode_message(msg)
-                except email.errors.MessageParseError:
-                    continue
-
-                yield message
-
-                self.connection.store(key, u'+FLAGS', u'\\Deleted')
-            self.connection.expunge()
+        mailbox = self._get_mailbox()
+
+        # Search for messages newer then the last fetched one. Note that "<n>:*" always matches
+        # the message with the highest UID, even if its UID is lower than <n>.
+        _, inbox = self.connection.uid(u'SEARCH', None, u'UID {}:*'.format(mailbox.last_uid + 1))
+        uids = sorted(int(k) for k in inbox[0].split()) if inbox and inbox[0] else []
+        uids = [k for k in uids if k > mailbox.last_uid]
+
+        # Only UIDs below the first message that failed to be stored are remembered, so the
+        # failed message is fetched again next time. Stored messages are deleted from the server.
+        failed = False
+        for i in range(0, len(uids), self.fetch_batch_size):
+            batch = u','.join(str(k) for k in uids[i:i+self.fetch_batch_size])
+            _, data = self.connection.uid(u'FETCH', batch, u'(RFC822.SIZE)')
+            stored = []
+            try:
+                for uid, size in sorted(self._parse_fetch_sizes(data)):
+                    fp = self._fetch_message(uid, size)
+                    if fp is None:
+                        continue
+                    try:
+                        msg, parts = StreamingParser().parse(fp)
+                        try:
+                            message = self._decode_message(msg, parts)
+                        finally:
+                            for part in parts:
+                                part.close()
+                    except email.errors.MessageParseError:
+                        trace = unicode(traceback.format_exc(), u'utf-8')
+                        cron_logger.error(u'Parsing email with UID {} failed:\n{}'.format(
+                                uid, trace))
+                        failed = True
+                        continue
+                    finally:
+                        fp.close()
+
+                    # The mailbox state is saved in the same transaction as the message.
+                    if not failed:
+                        mailbox.last_uid = max(mailbox.last_uid, uid)
+                    mailbox.save()
+                    yield message
+                    # The caller asks for the next message only after the previous one was
+                    # stored.
+                    stored.append(uid)
+            finally:
+                # Delete exactly the stored messages, even if the caller stops in the middle of
+                # the batch.
+                if stored:
+                    self.connection.uid(u'STORE', u','.join(str(k) for k in stored),
+                            u'+FLAGS.SILENT', u'(\\Deleted)')
+                    self.connection.expunge()
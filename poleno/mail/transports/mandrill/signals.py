@@ -1,6 +1,7 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
 from base64 import b64decode
+from collections import defaultdict
 
 from django.core.files.base import ContentFile
 from django.dispatch import Signal, receiver
@@ -12,30 +13,48 @@ from ...models import Message, Recipient
 
 
 webhook_event = Signal(providing_args=['event_type', 'data'])
+webhook_events = Signal(providing_args=['events'])
 
-@receiver(webhook_event)
-def message_status_webhook_event(sender, event_type, data, **kwargs):
-    if u'_id' not in data:
-        return
+@receiver(webhook_events)
+def message_status_webhook_events(sender, events, **kwargs):
+    u"""
+    Updates statuses of recipients referenced by the events. All recipients are fetched with a
+    single query and updated with one query per distinct resulting status. If there are multiple
+    events for the same recipient, the last one wins.
+    """
+    updates = {}
+    for event in events:
+        event_type = event.get(u'event')
+        if u'_id' not in event:
+            continue
+        if event_type == u'deferral':
+            status = Recipient.STATUSES.QUEUED
+        elif event_type in [u'soft_bounce', u'hard_bounce', u'spam', u'reject']:
+            status = Recipient.STATUSES.REJECTED
+        elif event_type == u'send':
+            status = Recipient.STATUSES.SENT
+        elif event_type in [u'open', u'click']:
+            status = Recipient.STATUSES.OPENED
+        else:
+            continue
+        updates[event[u'_id']] = (status, event_type)
 
-    if event_type == u'deferral':
-        status = Recipient.STATUSES.QUEUED
-    elif event_type in [u'soft_bounce', u'hard_bounce', u'spam', u'reject']:
-        status = Recipient.STATUSES.REJECTED
-    elif event_type == u'send':
-        status = Recipient.STATUSES.SENT
-    elif event_type in [u'open', u'click']:
-        status = Recipient.STATUSES.OPENED
-    else:
+    if not updates:
         return
 
-    try:
-        recipient = Recipient.objects.get(remote_id=data[u'_id'])
-        recipient.status = status
-        recipient.status_details = event_type
-        recipient.save(update_fields=[u'status', u'status_details'])
-    except (Recipient.DoesNotExist, Recipient.MultipleObjectsReturned):
-        pass
+    recipients = defaultdict(list)
+    queryset = Recipient.objects.filter(remote_id__in=updates).values_list(u'pk', u'remote_id')
+    for pk, remote_id in queryset:
+        recipients[remote_id].append(pk)
+
+    grouped = defaultdict(list)
+    for remote_id, pks in recipients.items():
+        # Ambiguous remote_ids are ignored
+        if len(pks) == 1:
+            grouped[updates[remote_id]].extend(pks)
+
+    for (status, status_details), pks in grouped.items():
+        Recipient.objects.filter(pk__in=pks).update(status=status, status_details=status_details)
 
 @receiver(webhook_event)
 def inbound_email_webhook_event(sender, event_type, data, **kwargs):
@@ -89,8 +108,8 @@ def inbound_email_webhook_event(sender, event_type, data, **kwargs):
 
         for recipient in recipients:
             recipient.message = message
-            recipient.save()
+        Recipient.objects.bulk_create(recipients)
 
         for attachment in attachments:
             attachment.generic_object = message
-            attachment.save()
+        Attachment.objects.bulk_save(attachments)
@@ -2,18 +2,23 @@
 # -*- coding: utf-8 -*-
 import json
 import base64
+import tempfile
 import requests
 from collections import defaultdict
 
 from django.core.exceptions import ImproperlyConfigured
 from django.conf import settings
 
-from poleno.utils.misc import squeeze
+from poleno.utils.misc import random_string, squeeze
 
 from ..base import BaseTransport
 
 
 class MandrillTransport(BaseTransport):
+    # Base64 encodes every 3 bytes separately, so chunks of multiples of 3 bytes may be encoded
+    # independently.
+    BASE64_CHUNK_SIZE = 3*16*1024
+
     def __init__(self, **kwargs):
         super(MandrillTransport, self).__init__(**kwargs)
         self.api_key = getattr(settings, u'MANDRILL_API_KEY', None)
@@ -23,6 +28,39 @@ class MandrillTransport(BaseTransport):
         if self.api_key is None:
             raise ImproperlyConfigured(u'Setting MANDRILL_API_KEY is not set.')
 
+        self.session = None
+
+    def connect(self):
+        # Keeps the HTTPS connection alive between messages
+        self.session = requests.Session()
+
+    def disconnect(self):
+        self.session.close()
+        self.session = None
+
+    def _payload(self, data, attachments):
+        u"""
+        Writes JSON encoded ``data`` to a temporary file. Attachment contents are base64 encoded
+        into the file chunk by chunk, so they are never loaded to memory as a whole. Their
+        ``content`` fields in ``data`` are replaced with unique placeholders first.
+        """
+        placeholders = []
+        for attch, attachment in attachments:
+            placeholder = u'attachment-{}'.format(random_string(32))
+            attch[u'content'] = placeholder
+            placeholders.append((placeholder, attachment))
+
+        payload = tempfile.TemporaryFile()
+        rest = json.dumps(data)
+        for placeholder, attachment in placeholders:
+            head, rest = rest.split(placeholder, 1)
+            payload.write(head)
+            for chunk in attachment.content_chunks(self.BASE64_CHUNK_SIZE):
+                payload.write(base64.b64encode(chunk))
+        payload.write(rest)
+        payload.seek(0)
+        return payload
+
     def send_message(self, message):
         assert message.type == message.TYPES.OUTBOUND
         assert message.processed is None
@@ -59,18 +97,20 @@ class MandrillTransport(BaseTransport):
             recipients[recipient.mail].append(recipient)
 
         msg[u'attachments'] = []
+        attachments = []
         for attachment in message.attachments:
             attch = {}
             attch[u'type'] = attachment.content_type
             attch[u'name'] = attachment.name
-            attch[u'content'] = base64.b64encode(attachment.content)
             msg[u'attachments'].append(attch)
+            attachments.append((attch, attachment))
 
         data = {}
         data[u'key'] = self.api_key
         data[u'message'] = msg
 
-        response = requests.post(self.api_send, data=json.dumps(data))
+        with self._payload(data, attachments) as payload:
+            response = self.session.post(self.api_send, data=payload)
 
         if response.status_code != 200:
             raise RuntimeError(squeeze(u"""
@@ -14,7 +14,7 @@ from django.conf import settings
 
 from poleno.utils.views import secure_required
 
-from .signals import webhook_event
+from .signals import webhook_event, webhook_events
 
 
 @require_http_methods([u'HEAD', u'GET', u'POST'])
@@ -62,6 +62,7 @@ def webhook(request):
             data = json.loads(request.POST.get(u'mandrill_events'))
         except (TypeError, ValueError):
             raise SuspiciousOperation(u'Request syntax error')
+        webhook_events.send(sender=None, events=data)
         for event in data:
             webhook_event.send(sender=None, event_type=event[u'event'], data=event)
 
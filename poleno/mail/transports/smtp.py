@@ -1,11 +1,28 @@
 # vim: expandtab
 # -*- coding: utf-8 -*-
+import socket
+import base64
+import smtplib
+import tempfile
+from email.mime.base import MIMEBase
+
 from django.core.mail import get_connection, EmailMultiAlternatives, EmailMessage
+from django.core.mail.message import sanitize_address
+
+from poleno.utils.misc import random_string
 
 from .base import BaseTransport
 
 
 class SmtpTransport(BaseTransport):
+    # Base64 encoded lines have 76 characters, i.e. 57 bytes of the content. Chunks of multiples of
+    # 57 bytes are encoded into whole lines independently.
+    BASE64_CHUNK_SIZE = 57*1024
+    # Message data is sent to the server in chunks of about this size.
+    SEND_CHUNK_SIZE = 64*1024
+    # Larger text attachments are base64 encoded as binary attachments.
+    TEXT_ATTACHMENT_MAX_SIZE = 64*1024
+
     def __init__(self, *args, **kwargs):
         super(SmtpTransport, self).__init__(*args, **kwargs)
         self.connection = None
@@ -18,6 +35,101 @@ class SmtpTransport(BaseTransport):
         self.connection.close()
         self.connection = None
 
+    def _mime_attachment(self, attachment, placeholders):
+        u"""
+        Small text and message attachments are left to Django, as it may need to reencode them as
+        a whole. Other attachments get a unique placeholder instead of their content. The
+        placeholder is appended to ``placeholders`` and replaced with the base64 encoded content
+        when the message is written to a temporary file.
+        """
+        basetype, _, subtype = attachment.content_type.partition(u'/')
+        if (basetype == u'message' or not subtype or basetype == u'text'
+                and attachment.size is not None and attachment.size <= self.TEXT_ATTACHMENT_MAX_SIZE):
+            with attachment.open_content() as file:
+                return (attachment.name, file.read(), attachment.content_type)
+
+        placeholder = b'attachment-' + random_string(32).encode(u'ascii')
+        placeholders.append((placeholder, attachment))
+        part = MIMEBase(basetype, subtype)
+        part.set_payload(placeholder)
+        part[u'Content-Transfer-Encoding'] = u'base64'
+        # Based on: django.core.mail.message.EmailMessage._create_attachment
+        filename = attachment.name
+        try:
+            filename.encode(u'ascii')
+        except UnicodeEncodeError:
+            filename = (u'utf-8', u'', filename.encode(u'utf-8'))
+        part.add_header(u'Content-Disposition', u'attachment', filename=filename)
+        return part
+
+    def _payload(self, msg, placeholders):
+        u"""
+        Writes the MIME encoded message to a temporary file. Attachment placeholders are replaced
+        with the attachment contents base64 encoded chunk by chunk, so they are never loaded to
+        memory as a whole.
+        """
+        payload = tempfile.TemporaryFile()
+        rest = msg.message().as_bytes()
+        for placeholder, attachment in placeholders:
+            head, rest = rest.split(placeholder, 1)
+            payload.write(head)
+            for chunk in attachment.content_chunks(self.BASE64_CHUNK_SIZE):
+                payload.write(base64.encodestring(chunk))
+        payload.write(rest)
+        payload.seek(0)
+        return payload
+
+    def _start_data(self, smtp, from_email, recipients):
+        u"""
+        Sends the message envelope and starts the message data. Based on ``smtplib.SMTP.sendmail``
+        which we can't use directly, because we need to know whether the server accepted the
+        message data when the connection fails.
+        """
+        smtp.ehlo_or_helo_if_needed()
+        code, resp = smtp.mail(from_email)
+        if code != 250:
+            smtp.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, from_email)
+        refused = {}
+        for recipient in recipients:
+            code, resp = smtp.rcpt(recipient)
+            if code not in [250, 251]:
+                refused[recipient] = (code, resp)
+        if len(refused) == len(recipients):
+            smtp.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        code, resp = smtp.docmd(u'data')
+        if code != 354:
+            smtp.rset()
+            raise smtplib.SMTPDataError(code, resp)
+
+    def _send_data(self, smtp, payload):
+        u"""
+        Sends the message data read from ``payload`` file and finishes the message. Based on
+        ``smtplib.SMTP.data``, but the data is quoted line by line and sent in chunks, so it is
+        never held in memory as a whole.
+        """
+        chunk = []
+        size = 0
+        for line in payload:
+            if line.endswith(b'\n'):
+                line = line[:-1]
+            if line.endswith(b'\r'):
+                line = line[:-1]
+            if line.startswith(b'.'):
+                line = b'.' + line
+            chunk.append(line + smtplib.CRLF)
+            size += len(line) + len(smtplib.CRLF)
+            if size >= self.SEND_CHUNK_SIZE:
+                smtp.send(b''.join(chunk))
+                chunk = []
+                size = 0
+        chunk.append(b'.' + smtplib.CRLF)
+        smtp.send(b''.join(chunk))
+        code, resp = smtp.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
+
     def send_message(self, message):
         assert message.type == message.TYPES.OUTBOUND
         assert message.processed is None
@@ -29,7 +141,12 @@ class SmtpTransport(BaseTransport):
         kwargs[u'to'] = (r.formatted for r in message.recipients_to)
         kwargs[u'cc'] = (r.formatted for r in message.recipients_cc)
         kwargs[u'bcc'] = (r.formatted for r in message.recipients_bcc)
-        kwargs[u'attachments'] = ((a.name, a.content, a.content_type) for a in message.attachments)
+        # Attachments are passed as a generator which is always true, so Django builds
+        # a multipart message even if there are no attachments. The generator is consumed when
+        # the message is built, filling the placeholders list.
+        placeholders = []
+        kwargs[u'attachments'] = (self._mime_attachment(a, placeholders)
+                for a in message.attachments)
         kwargs[u'headers'] = message.headers
 
         if message.text and message.html:
@@ -41,7 +158,24 @@ class SmtpTransport(BaseTransport):
         else:
             msg = EmailMessage(body=message.text, **kwargs)
 
-        msg.send()
+        # Based on: django.core.mail.backends.smtp.EmailBackend._send
+        from_email = sanitize_address(msg.from_email, msg.encoding)
+        recipients = [sanitize_address(a, msg.encoding) for a in msg.recipients()]
+
+        if recipients:
+            with self._payload(msg, placeholders) as payload:
+                self.connection.open()
+                try:
+                    self._start_data(self.connection.connection, from_email, recipients)
+                except (smtplib.SMTPServerDisconnected, socket.error):
+                    # Long-lived connections may be dropped by the server. The server has not
+                    # accepted the message data yet, so we may safely reconnect and try once
+                    # again. Failures after the data was accepted are not retried, as the message
+                    # might have been delivered already.
+                    self.connection.close()
+                    self.connection.open()
+                    self._start_data(self.connection.connection, from_email, recipients)
+                self._send_data(self.connection.connection, payload)
 
         for recipient in message.recipients:
             recipient.status = recipient.STATUSES.SENT
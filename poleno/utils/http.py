@@ -4,9 +4,14 @@ import os
 import stat
 from threading import local
 
-from django.http import HttpResponseNotModified, FileResponse, JsonResponse
+from django.conf import settings
+from django.http import (HttpResponse, HttpResponseNotModified, StreamingHttpResponse,
+        FileResponse, JsonResponse)
 from django.views.static import was_modified_since
 from django.utils.http import http_date, urlquote
+from django.utils.module_loading import import_by_path
+
+from poleno.utils.misc import random_string
 
 # Thread local data
 _local = local()
@@ -25,27 +30,219 @@ class RequestProviderMiddleware(object):
         return response
 
 
-def send_file_response(request, path, name, content_type, attachment=True):
-    # Based on: django.views.static.serve
+MAX_RANGES = 20
+FILE_CHUNK_SIZE = 64 * 1024
+
+def parse_range_header(header, size):
+    u"""
+    Parses HTTP ``Range`` header for a file of the given size. Returns the list of ``(first,
+    last)`` tuples of inclusive byte positions of satisfiable ranges. The list is empty if no range
+    is satisfiable. Returns None if the header is missing, invalid, or asks for too many ranges,
+    so the whole file should be sent.
+    """
+    if not header:
+        return None
+    unit, sep, specs = header.partition(u'=')
+    if not sep or unit.strip().lower() != u'bytes':
+        return None
+    specs = [spec.strip() for spec in specs.split(u',') if spec.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        first, sep, last = spec.partition(u'-')
+        first, last = first.strip(), last.strip()
+        if not sep or not (first or last):
+            return None
+        if (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            # Suffix range: the last given number of bytes
+            suffix = int(last)
+            if not suffix:
+                continue
+            first, last = max(size - suffix, 0), size - 1
+        else:
+            first = int(first)
+            if last and int(last) < first:
+                return None
+            last = min(int(last), size - 1) if last else size - 1
+        if first >= size:
+            continue
+        ranges.append((first, last))
+    return ranges
+
+def parse_etags(header):
+    u"""
+    Parses HTTP ``If-None-Match`` or ``If-Match`` header into a list of opaque tags with quotes and
+    without weakness indicators.
+    """
+    etags = []
+    for etag in header.split(u','):
+        etag = etag.strip()
+        if etag.startswith(u'W/'):
+            etag = etag[2:]
+        if etag:
+            etags.append(etag)
+    return etags
+
+def read_file_range(path, first, last):
+    with open(path, u'rb') as file:
+        file.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = file.read(min(FILE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+class StreamingFileBackend(object):
+    u"""
+    Streams the file through the application. Works everywhere, but keeps the worker busy until
+    the whole file is sent. Supports single and multipart byte ranges.
+    """
+
+    def _range_requested(self, request, statobj, etag):
+        # If the file changed since the client got its part, the whole file must be sent.
+        if_range = request.META.get(u'HTTP_IF_RANGE')
+        if not if_range:
+            return True
+        if if_range.startswith(u'"'):
+            return if_range == etag
+        return if_range == http_date(statobj.st_mtime)
+
+    def _single_range_response(self, path, content_type, size, first, last):
+        response = StreamingHttpResponse(read_file_range(path, first, last), status=206,
+                content_type=content_type)
+        response[u'Content-Range'] = u'bytes {}-{}/{}'.format(first, last, size)
+        response[u'Content-Length'] = last - first + 1
+        return response
+
+    def _multipart_response(self, path, content_type, size, ranges):
+        boundary = random_string(32)
+        parts = []
+        length = 0
+        for first, last in ranges:
+            header = (u'--{}\r\nContent-Type: {}\r\nContent-Range: bytes {}-{}/{}\r\n\r\n'
+                      .format(boundary, content_type, first, last, size).encode(u'utf-8'))
+            parts.append((header, first, last))
+            length += len(header) + last - first + 1 + 2
+        trailer = u'--{}--\r\n'.format(boundary).encode(u'utf-8')
+        length += len(trailer)
+
+        def content():
+            for header, first, last in parts:
+                yield header
+                for chunk in read_file_range(path, first, last):
+                    yield chunk
+                yield b'\r\n'
+            yield trailer
+
+        response = StreamingHttpResponse(content(), status=206,
+                content_type=u'multipart/byteranges; boundary={}'.format(boundary))
+        response[u'Content-Length'] = length
+        return response
+
+    def response(self, request, path, content_type, statobj, etag):
+        size = statobj.st_size
+        ranges = None
+        if self._range_requested(request, statobj, etag):
+            ranges = parse_range_header(request.META.get(u'HTTP_RANGE'), size)
 
-    # FIXME: If running on real Apache server, we should use "X-SENDFILE" header to let Apache
-    # serve the file. It's much faster. Possibly will be fixed in Django 1.8.
-    # See: http://django.readthedocs.org/en/latest/ref/request-response.html#django.http.FileResponse
+        if ranges is None:
+            response = FileResponse(open(path, u'rb'), content_type=content_type)
+            response[u'Content-Length'] = size
+        elif not ranges:
+            response = HttpResponse(status=416)
+            response[u'Content-Range'] = u'bytes */{}'.format(size)
+        elif len(ranges) == 1:
+            response = self._single_range_response(path, content_type, size, *ranges[0])
+        else:
+            response = self._multipart_response(path, content_type, size, ranges)
+        response[u'Accept-Ranges'] = u'bytes'
+        return response
+
+class XSendfileBackend(object):
+    u"""
+    Lets the web server send the file using ``X-Sendfile`` header, e.g. Apache with mod_xsendfile
+    or lighttpd. The web server must be allowed to serve the files. Byte ranges are handled by the
+    web server.
+    """
+
+    def response(self, request, path, content_type, statobj, etag):
+        response = HttpResponse(content_type=content_type)
+        response[u'X-Sendfile'] = path
+        return response
+
+class XAccelRedirectBackend(object):
+    u"""
+    Lets nginx send the file using ``X-Accel-Redirect`` header. Files under ``SEND_FILE_ACCEL_ROOT``
+    directory are redirected to the same relative path under ``SEND_FILE_ACCEL_PREFIX`` location,
+    which must be configured as ``internal`` in nginx with the root directory as its alias. Files
+    outside of the root directory are streamed. Byte ranges are handled by nginx.
 
+    Settings:
+     -- SEND_FILE_ACCEL_ROOT: Directory served by nginx. Defaults to ``MEDIA_ROOT``.
+     -- SEND_FILE_ACCEL_PREFIX: Internal nginx location. Defaults to "/protected/".
+    """
+
+    def __init__(self):
+        self.root = os.path.join(
+                os.path.abspath(getattr(settings, u'SEND_FILE_ACCEL_ROOT', settings.MEDIA_ROOT)),
+                u'')
+        self.prefix = getattr(settings, u'SEND_FILE_ACCEL_PREFIX', u'/protected/')
+
+    def response(self, request, path, content_type, statobj, etag):
+        path = os.path.abspath(path)
+        if not path.startswith(self.root):
+            return StreamingFileBackend().response(request, path, content_type, statobj, etag)
+        response = HttpResponse(content_type=content_type)
+        response[u'X-Accel-Redirect'] = urlquote(self.prefix + path[len(self.root):])
+        return response
+
+def get_send_file_backend():
+    path = getattr(settings, u'SEND_FILE_BACKEND', u'poleno.utils.http.StreamingFileBackend')
+    return import_by_path(path)()
+
+def send_file_response(request, path, name, content_type, attachment=True, etag=None):
+    u"""
+    Sends the file using the backend set by ``SEND_FILE_BACKEND`` setting. The backend may let the
+    web server send the file, so the application only checks the request and writes the headers.
+    Defaults to ``StreamingFileBackend`` streaming the file through the application.
+
+    The response has a strong ``ETag`` made of ``etag``, e.g. the file content hash, or of the file
+    size and modification time if ``etag`` is None. Requests with matching ``If-None-Match``
+    header, or if there is no such header, with ``If-Modified-Since`` header not older than the
+    file get 304 response.
+    """
+    # Based on: django.views.static.serve
     statobj = os.stat(path)
     if not stat.S_ISREG(statobj.st_mode):
         raise OSError(u'Not a regular file: {}'.format(path))
-    http_header = request.META.get(u'HTTP_IF_MODIFIED_SINCE')
-    if not was_modified_since(http_header, statobj.st_mtime, statobj.st_size):
-        return HttpResponseNotModified()
-    response = FileResponse(open(path, u'rb'), content_type=content_type)
+    if etag is None:
+        etag = u'{:x}-{:x}'.format(statobj.st_size, int(statobj.st_mtime))
+    etag = u'"{}"'.format(etag)
+
+    if_none_match = request.META.get(u'HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        etags = parse_etags(if_none_match)
+        not_modified = u'*' in etags or etag in etags
+    else:
+        http_header = request.META.get(u'HTTP_IF_MODIFIED_SINCE')
+        not_modified = not was_modified_since(http_header, statobj.st_mtime, statobj.st_size)
+    if not_modified:
+        response = HttpResponseNotModified()
+        response[u'ETag'] = etag
+        return response
+
+    response = get_send_file_backend().response(request, path, content_type, statobj, etag)
+    response[u'ETag'] = etag
     response[u'Last-Modified'] = http_date(statobj.st_mtime)
-    response[u'Content-Length'] = statobj.st_size
     if attachment:
         response[u'Content-Disposition'] = "attachment; filename*=UTF-8''{}".format(urlquote(name))
     return response
 
-
 class JsonOperations(JsonResponse):
     def __init__(self, *args):
         super(JsonOperations, self).__init__({
@@ -8,6 +8,7 @@ import re
 import mimetypes
 import contextlib
 import collections
+import threading
 from functools import wraps
 from StringIO import StringIO
 from unidecode import unidecode
@@ -360,6 +361,62 @@ def cached_method(method=None, cached_exceptions=None):
         return actual_decorator(method)
     return actual_decorator
 
+def lru_cache(maxsize=128):
+    u"""
+    Decorator to cache function results for hashable positional arguments. At most ``maxsize``
+    least recently used results are kept. The cache is shared by all threads. Use
+    ``func.cache_clear()`` to empty it and ``func.__wrapped__`` to call the function uncached.
+
+    Example:
+        @lru_cache(maxsize=2)
+        def foo(value):
+            print('foo({})'.format(value))
+            return value * 2
+
+        >>> foo(1)
+        foo(1)
+        2
+        >>> foo(1)
+        2
+        >>> foo(2)
+        foo(2)
+        4
+        >>> foo(3)
+        foo(3)
+        6
+
+        The least recently used result was evicted:
+        >>> foo(1)
+        foo(1)
+        2
+    """
+    def actual_decorator(func):
+        cache = collections.OrderedDict()
+        lock = threading.Lock()
+        @wraps(func, assigned=available_attrs(func))
+        def wrapped_func(*args):
+            with lock:
+                try:
+                    res = cache.pop(args)
+                except KeyError:
+                    pass
+                else:
+                    cache[args] = res
+                    return res
+            res = func(*args)
+            with lock:
+                cache[args] = res
+                while len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return res
+        def cache_clear():
+            with lock:
+                cache.clear()
+        wrapped_func.cache_clear = cache_clear
+        wrapped_func.__wrapped__ = func
+        return wrapped_func
+    return actual_decorator
+
 def print_invocations(func=None):
     if not hasattr(print_invocations, u'level'):
         print_invocations.level = 0
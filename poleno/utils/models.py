@@ -155,7 +155,7 @@ class QuerySet(models.query.QuerySet):
         """
         if getattr(self.model.save, u'prevent_bulk_create', False):
             raise ValueError(u"Can't bulk create {}".format(self.model.__name__))
-        super(QuerySet, self).bulk_create(*args, **kwargs)
+        return super(QuerySet, self).bulk_create(*args, **kwargs)
 
     def get_or_404(self, *args, **kwargs):
         u"""
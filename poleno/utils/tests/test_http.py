@@ -5,12 +5,12 @@ import random
 from testfixtures import TempDirectory
 
 from django.conf.urls import patterns, url
-from django.http import HttpResponseNotModified, FileResponse
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse, FileResponse
 from django.utils.http import urlquote, urlencode, http_date
 from django.test import TestCase
 from django.test.utils import override_settings
 
-from poleno.utils.http import send_file_response
+from poleno.utils.http import send_file_response, parse_range_header
 from poleno.utils.misc import random_string
 
 
@@ -18,9 +18,10 @@ class SendFileResponseTest(TestCase):
     u"""
     Tests ``send_file_response()`` function. Checks that regular files are sent correctly, but
     sending non-regular or non-existent files raises an exception. Also checks that if the request
-    has ``HTTP_IF_MODIFIED_SINCE`` header, the file is sent only if it was changes since then.
-    Finally checks if ``Last-Modified``, ``Content-Disposition`` and ``Content-Length`` headers are
-    set correctly.
+    has ``HTTP_IF_MODIFIED_SINCE`` or ``HTTP_IF_NONE_MATCH`` header, the file is sent only if it was
+    changes since then. Checks single and multipart byte ranges. Finally checks if
+    ``Last-Modified``, ``ETag``, ``Content-Disposition`` and ``Content-Length`` headers are set
+    correctly.
     """
 
     def file_view(request):
@@ -150,3 +151,161 @@ class SendFileResponseTest(TestCase):
         name = random_string(20, chars=u'BａｃòԉíρｓûϻᏧｏｌｒѕìｔãｍｅéӽѵ߀ɭｐèлｕｉｎ.Iüà,ɦëǥｈƅɢïêｇԁSùúâɑｆäｂƃｄｋϳɰյƙｙáFХ-åɋｗ')
         response = self._request_file(path, name)
         self.assertEqual(response[u'Content-Disposition'], u"attachment; filename*=UTF-8''%s" % urlquote(name))
+
+    def test_default_backend_streams_file(self):
+        path = self._create_file()
+        with self.settings(SEND_FILE_BACKEND=u'poleno.utils.http.StreamingFileBackend'):
+            response = self._request_file(path)
+        self._check_response(response, FileResponse, 200)
+        self.assertNotIn(u'X-Sendfile', response)
+        self.assertNotIn(u'X-Accel-Redirect', response)
+
+    def test_x_sendfile_backend(self):
+        path = self._create_file()
+        with self.settings(SEND_FILE_BACKEND=u'poleno.utils.http.XSendfileBackend'):
+            response = self._request_file(path, u'thefile.txt')
+        self._check_response(response, HttpResponse, 200)
+        self.assertEqual(response.content, u'')
+        self.assertEqual(response[u'X-Sendfile'], path)
+        self.assertEqual(response[u'Content-Type'], u'text/plain')
+        self.assertEqual(response[u'Content-Disposition'], u"attachment; filename*=UTF-8''thefile.txt")
+        self.assertIn(u'Last-Modified', response)
+
+    def test_x_sendfile_backend_with_if_modified_since_with_unmodified_file(self):
+        modified_timestamp = 1413500000
+        path = self._create_file()
+        os.utime(path, (modified_timestamp, modified_timestamp))
+        with self.settings(SEND_FILE_BACKEND=u'poleno.utils.http.XSendfileBackend'):
+            response = self._request_file(path, HTTP_IF_MODIFIED_SINCE=http_date(modified_timestamp + 1000))
+        self._check_response(response, HttpResponseNotModified, 304)
+
+    def test_x_accel_redirect_backend(self):
+        path = self._create_file(u'my file.txt')
+        with self.settings(SEND_FILE_BACKEND=u'poleno.utils.http.XAccelRedirectBackend',
+                SEND_FILE_ACCEL_ROOT=self.tempdir.path, SEND_FILE_ACCEL_PREFIX=u'/internal/'):
+            response = self._request_file(path)
+        self._check_response(response, HttpResponse, 200)
+        self.assertEqual(response.content, u'')
+        self.assertEqual(response[u'X-Accel-Redirect'], u'/internal/my%20file.txt')
+
+    def test_x_accel_redirect_backend_streams_files_outside_root(self):
+        path = self._create_file()
+        with self.settings(SEND_FILE_BACKEND=u'poleno.utils.http.XAccelRedirectBackend',
+                SEND_FILE_ACCEL_ROOT=u'/nonexistent'):
+            response = self._request_file(path)
+        self._check_response(response, FileResponse, 200)
+        self._check_content(response, path)
+
+    def test_etag_header(self):
+        modified_timestamp = 1413500000
+        path = self._create_file(content=u'Some text.')
+        os.utime(path, (modified_timestamp, modified_timestamp))
+        response = self._request_file(path)
+        self.assertEqual(response[u'ETag'], u'"a-%x"' % modified_timestamp)
+        self.assertEqual(response[u'Accept-Ranges'], u'bytes')
+
+    def test_if_none_match_with_matching_etag(self):
+        path = self._create_file()
+        etag = self._request_file(path)[u'ETag']
+        response = self._request_file(path, HTTP_IF_NONE_MATCH=u'"other", W/%s' % etag)
+        self._check_response(response, HttpResponseNotModified, 304)
+        self.assertEqual(response[u'ETag'], etag)
+
+    def test_if_none_match_with_star(self):
+        path = self._create_file()
+        response = self._request_file(path, HTTP_IF_NONE_MATCH=u'*')
+        self._check_response(response, HttpResponseNotModified, 304)
+
+    def test_if_none_match_with_other_etag_ignores_if_modified_since(self):
+        modified_timestamp = 1413500000
+        path = self._create_file()
+        os.utime(path, (modified_timestamp, modified_timestamp))
+        response = self._request_file(path, HTTP_IF_NONE_MATCH=u'"other"',
+                HTTP_IF_MODIFIED_SINCE=http_date(modified_timestamp + 1000))
+        self._check_response(response, FileResponse, 200)
+
+    def test_single_range(self):
+        path = self._create_file(content=u'0123456789')
+        response = self._request_file(path, HTTP_RANGE=u'bytes=2-5')
+        self._check_response(response, StreamingHttpResponse, 206)
+        self.assertEqual(response[u'Content-Range'], u'bytes 2-5/10')
+        self.assertEqual(response[u'Content-Length'], u'4')
+        self.assertEqual(u''.join(response.streaming_content), u'2345')
+
+    def test_suffix_range(self):
+        path = self._create_file(content=u'0123456789')
+        response = self._request_file(path, HTTP_RANGE=u'bytes=-3')
+        self._check_response(response, StreamingHttpResponse, 206)
+        self.assertEqual(response[u'Content-Range'], u'bytes 7-9/10')
+        self.assertEqual(u''.join(response.streaming_content), u'789')
+
+    def test_multiple_ranges(self):
+        path = self._create_file(content=u'0123456789')
+        response = self._request_file(path, HTTP_RANGE=u'bytes=0-1,7-')
+        self._check_response(response, StreamingHttpResponse, 206)
+        content_type, boundary = response[u'Content-Type'].split(u'; boundary=')
+        self.assertEqual(content_type, u'multipart/byteranges')
+        content = u''.join(response.streaming_content)
+        self.assertEqual(content,
+                u'--%(b)s\r\nContent-Type: text/plain\r\nContent-Range: bytes 0-1/10\r\n\r\n01\r\n'
+                u'--%(b)s\r\nContent-Type: text/plain\r\nContent-Range: bytes 7-9/10\r\n\r\n789\r\n'
+                u'--%(b)s--\r\n' % {u'b': boundary})
+        self.assertEqual(response[u'Content-Length'], str(len(content)))
+
+    def test_unsatisfiable_range(self):
+        path = self._create_file(content=u'0123456789')
+        response = self._request_file(path, HTTP_RANGE=u'bytes=20-30')
+        self._check_response(response, HttpResponse, 416)
+        self.assertEqual(response[u'Content-Range'], u'bytes */10')
+
+    def test_invalid_range_sends_whole_file(self):
+        path = self._create_file(content=u'0123456789')
+        response = self._request_file(path, HTTP_RANGE=u'bytes=5-2')
+        self._check_response(response, FileResponse, 200)
+        self._check_content(response, path)
+
+    def test_range_with_matching_if_range(self):
+        path = self._create_file(content=u'0123456789')
+        etag = self._request_file(path)[u'ETag']
+        response = self._request_file(path, HTTP_RANGE=u'bytes=2-5', HTTP_IF_RANGE=etag)
+        self._check_response(response, StreamingHttpResponse, 206)
+
+    def test_range_with_outdated_if_range_sends_whole_file(self):
+        path = self._create_file(content=u'0123456789')
+        response = self._request_file(path, HTTP_RANGE=u'bytes=2-5', HTTP_IF_RANGE=u'"outdated"')
+        self._check_response(response, FileResponse, 200)
+        self._check_content(response, path)
+
+    def test_x_sendfile_backend_leaves_range_to_web_server(self):
+        path = self._create_file()
+        with self.settings(SEND_FILE_BACKEND=u'poleno.utils.http.XSendfileBackend'):
+            response = self._request_file(path, HTTP_RANGE=u'bytes=2-5')
+        self._check_response(response, HttpResponse, 200)
+        self.assertEqual(response[u'X-Sendfile'], path)
+        self.assertIn(u'ETag', response)
+
+class ParseRangeHeaderTest(TestCase):
+    u"""
+    Tests ``parse_range_header()`` function.
+    """
+
+    def test_ranges(self):
+        self.assertEqual(parse_range_header(u'bytes=0-9', 10), [(0, 9)])
+        self.assertEqual(parse_range_header(u'bytes=5-', 10), [(5, 9)])
+        self.assertEqual(parse_range_header(u'bytes=-3', 10), [(7, 9)])
+        self.assertEqual(parse_range_header(u'bytes=-30', 10), [(0, 9)])
+        self.assertEqual(parse_range_header(u'bytes=0-100', 10), [(0, 9)])
+        self.assertEqual(parse_range_header(u'bytes=0-0, 5-6', 10), [(0, 0), (5, 6)])
+
+    def test_unsatisfiable_ranges(self):
+        self.assertEqual(parse_range_header(u'bytes=10-20', 10), [])
+        self.assertEqual(parse_range_header(u'bytes=-0', 10), [])
+        self.assertEqual(parse_range_header(u'bytes=0-', 0), [])
+
+    def test_invalid_ranges(self):
+        self.assertIsNone(parse_range_header(None, 10))
+        self.assertIsNone(parse_range_header(u'items=0-1', 10))
+        self.assertIsNone(parse_range_header(u'bytes=a-b', 10))
+        self.assertIsNone(parse_range_header(u'bytes=5-2', 10))
+        self.assertIsNone(parse_range_header(u'bytes=-', 10))
+        self.assertIsNone(parse_range_header(u'bytes=' + u','.join([u'0-1'] * 100), 10))
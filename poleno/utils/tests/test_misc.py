@@ -7,7 +7,7 @@ import random
 from django.test import TestCase
 
 from poleno.utils.misc import (Bunch, random_string, random_readable_string, try_except, squeeze,
-        flatten, guess_extension, filesize, collect_stdout, decorate, cached_method)
+        flatten, guess_extension, filesize, collect_stdout, decorate, cached_method, lru_cache)
 
 
 class BunchTest(TestCase):
@@ -382,3 +382,45 @@ class CachedMethodTest(TestCase):
             with self.assertRaises(ValueError): obj.method1(7, 4)
             with self.assertRaises(ValueError): obj.method2(7, 4)
         self.assertEqual(output.stdout, u'method1\nmethod1\nmethod2\n')
+
+class LruCacheTest(TestCase):
+    u"""
+    Tests ``lru_cache()`` decorator
+    """
+
+    def _func(self, maxsize):
+        @lru_cache(maxsize=maxsize)
+        def func(a, b):
+            print(u'func')
+            return a + b
+        return func
+
+    def test_result_is_cached(self):
+        func = self._func(2)
+        with collect_stdout() as output:
+            self.assertEqual(func(2, 3), 5)
+            self.assertEqual(func(2, 3), 5)
+            self.assertEqual(func(3, 2), 5)
+        self.assertEqual(output.stdout, u'func\nfunc\n')
+
+    def test_least_recently_used_result_is_evicted(self):
+        func = self._func(2)
+        with collect_stdout() as output:
+            func(1, 1)
+            func(2, 2)
+            func(1, 1)
+            func(3, 3)
+        self.assertEqual(output.stdout, u'func\nfunc\nfunc\n')
+        with collect_stdout() as output:
+            func(1, 1)
+            func(3, 3)
+            func(2, 2)
+        self.assertEqual(output.stdout, u'func\n')
+
+    def test_cache_clear(self):
+        func = self._func(2)
+        with collect_stdout() as output:
+            func(1, 1)
+            func.cache_clear()
+            func(1, 1)
+        self.assertEqual(output.stdout, u'func\nfunc\n')